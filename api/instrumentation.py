@@ -0,0 +1,156 @@
+"""
+Per-request instrumentation. RequestMetricsMiddleware counts the SQL
+queries of each request and the time spent in the database, the blob
+storage and the crypto engine. It returns them in a Server-Timing header and
+logs one JSON line per request on the "api.requests" logger. A request
+over REQUEST_QUERY_BUDGET queries also logs its statements, grouped so N+1
+patterns stand out.
+
+Storage and crypto code report their time with ``timed("storage")`` or
+``timed("crypto")``; outside a request the timers do nothing.
+"""
+
+import json
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("api.requests")
+
+TIMERS = ("storage", "crypto")
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.statements = Counter()
+        self.times = dict.fromkeys(("db", *TIMERS), 0.0)
+
+    def record_query(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper for the whole request
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.times["db"] += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def server_timing(self):
+        timings = [
+            f'db;dur={self.times["db"] * 1000:.1f};desc="{self.queries} queries"'
+        ]
+        timings += [f"{name};dur={self.times[name] * 1000:.1f}" for name in TIMERS]
+        timings.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(timings)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's ``name`` timer."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.times[name] += time.perf_counter() - started
+
+
+def timed_iterator(name, iterable):
+    """Time every step of ``iterable``, for data fetched while it is consumed."""
+    iterator = iter(iterable)
+    while True:
+        with timed(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        response["Server-Timing"] = metrics.server_timing()
+        if response.streaming:
+            # Streamed bodies are decrypted after the view returns, their
+            # storage and crypto time only makes it into the log line
+            response.streaming_content = self.stream(
+                request, response, metrics, response.streaming_content
+            )
+        else:
+            self.log(request, response, metrics)
+        return response
+
+    def stream(self, request, response, metrics, content):
+        iterator = iter(content)
+        try:
+            while True:
+                token = _current.set(metrics)
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _current.reset(token)
+                yield chunk
+        finally:
+            self.log(request, response, metrics)
+
+    def log(self, request, response, metrics):
+        logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(
+                        (time.perf_counter() - metrics.started) * 1000, 1
+                    ),
+                    "queries": metrics.queries,
+                    **{
+                        f"{name}_ms": round(seconds * 1000, 1)
+                        for name, seconds in metrics.times.items()
+                    },
+                }
+            )
+        )
+
+        budget = settings.REQUEST_QUERY_BUDGET
+        if budget and metrics.queries > budget:
+            statements = "\n".join(
+                f"{count:>5} x {sql}" for sql, count in metrics.statements.most_common()
+            )
+            logger.warning(
+                "%s %s ran %d queries, over the budget of %d:\n%s",
+                request.method,
+                request.path,
+                metrics.queries,
+                budget,
+                statements,
+            )
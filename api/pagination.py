@@ -0,0 +1,121 @@
+"""
+Keyset (cursor) pagination. A page is fetched with ``WHERE (key) < (last
+key of the previous page) ORDER BY key LIMIT n``, so with an index on the
+ordering key every page costs the same, however deep. The cursor handed to
+clients is the opaque, base64 encoded key of the last row served.
+"""
+
+import base64
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate by ``ordering``, a sequence of model field names that ends with
+    a unique one (usually ``id``), each optionally prefixed with ``-``.
+    Views set ``keyset_ordering`` or pass ``ordering``.
+    """
+
+    ordering = ("-id",)
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor."
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, row):
+        key = [getattr(row, name.lstrip("-")) for name in self.ordering]
+        raw = json.dumps(key, default=str, separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor, model):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            key = json.loads(raw)
+            if not isinstance(key, list) or len(key) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(name.lstrip("-")).to_python(value)
+                for name, value in zip(self.ordering, key)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def after(self, key):
+        """
+        Rows sorting after ``key``: a not before x, and (a after x) or (a = x
+        and b after y) ... The first term is implied by the rest, but it is
+        the one the database can start an index range scan from. The OR
+        alone is only applied as a filter, to every row from the head of the
+        index.
+        """
+        condition = Q()
+        equal = {}
+        for name, value in zip(self.ordering, key):
+            field = name.lstrip("-")
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition |= Q(**equal, **{f"{field}__{lookup}": value})
+            equal[field] = value
+        first = self.ordering[0]
+        bound = "lte" if first.startswith("-") else "gte"
+        return Q(**{f"{first.lstrip('-')}__{bound}": key[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if view is not None and hasattr(view, "keyset_ordering"):
+            self.ordering = tuple(view.keyset_ordering)
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(
+                self.after(self.decode_cursor(cursor, queryset.model))
+            )
+
+        # One extra row tells whether there is a next page
+        rows = list(queryset[: page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = self.encode_cursor(rows[-1])
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
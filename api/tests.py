@@ -1,3 +1,287 @@
+import hashlib
+import json
+import logging
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from file_management.models import File, SharedFile
+from user_api.models import UserProfile
+
+# Tables that grow with the number of users and files. Small bookkeeping
+# tables (rollups, checkpoints, contacts) may be scanned.
+LARGE_TABLES = {
+    "auth_user",
+    "file_management_file",
+    "file_management_sharedfile",
+    "file_management_linkshare",
+    "file_management_storageusage",
+    "user_api_userprofile",
+}
+
+
+def seq_scans(plan):
+    """Yield the relations a plan node and its children scan sequentially."""
+    if plan["Node Type"] == "Seq Scan":
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", ()):
+        yield from seq_scans(child)
+
+
+def file_name(index):
+    # Distinct names, so a search matches a handful of rows like in production
+    return f"{hashlib.md5(str(index).encode()).hexdigest()[:12]} report"
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        File.objects.bulk_create(
+            File(user=self.user, file_name=f"file_{index}", key="k", nonce="n", tag="t")
+            for index in range(7)
+        )
+        # Ties on upload_date are broken by id
+        File.objects.filter(id__in=File.objects.order_by("id")[2:5]).update(
+            upload_date=timezone.now()
+        )
+
+    def test_pages_follow_the_ordering(self):
+        expected = list(
+            File.objects.order_by("-upload_date", "-id").values_list("id", flat=True)
+        )
+        seen = []
+        url = "/api/v1/files/?page_size=3"
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                seen += [file["id"] for file in response.data["results"]]
+                url = response.data["next"]
+        self.assertEqual(seen, expected)
+        # Later pages bound the first ordering field
+        page_queries = [query["sql"] for query in queries if "ORDER BY" in query["sql"]]
+        self.assertIn('"upload_date" <=', page_queries[-1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/v1/files/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans are checked on PostgreSQL")
+# Every request has to reach the view and run its queries
+@override_settings(RESPONSE_CACHE_TTL=0)
+class QueryPlanTests(TestCase):
+    """
+    Call each endpoint against a seeded database and EXPLAIN every query it
+    runs. A sequential scan of a large table means a query stopped matching
+    its index.
+    """
+
+    USERS = 2000
+    FILES_PER_USER = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create(
+            User(
+                username=f"user_{index}",
+                email=f"user_{index}@example.com",
+                is_active=index % 10 != 0,
+            )
+            for index in range(cls.USERS)
+        )
+        UserProfile.objects.bulk_create(
+            UserProfile(user=user, public_id=f"profile-{user.id}")
+            for user in users[::2]
+        )
+        files = File.objects.bulk_create(
+            File(
+                user=user,
+                file_name=file_name(user.id * cls.FILES_PER_USER + index),
+                public_id=f"blob-{user.id}-{index}",
+                file_type=("pdf", "png", "txt")[index % 3],
+                key="k",
+                nonce="n",
+                tag="t",
+                file_size=1000,
+            )
+            for user in users
+            for index in range(cls.FILES_PER_USER)
+        )
+        # Every file is shared with the next user
+        SharedFile.objects.bulk_create(
+            SharedFile(file=file, shared_with=users[(position + 1) % len(users)])
+            for position, user in enumerate(users)
+            for file in files[
+                position * cls.FILES_PER_USER : (position + 1) * cls.FILES_PER_USER
+            ]
+        )
+        File.objects.filter(id__in=[file.id for file in files[::7]]).update(
+            trashed_at=timezone.now()
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        cls.user = users[1]
+        cls.file = File.objects.filter(user=cls.user).first()
+
+    def assert_indexed(self, method, url, data=None):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, data)
+        self.assertLess(response.status_code, 400, getattr(response, "data", None))
+
+        for query in queries:
+            sql = query["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scanned = LARGE_TABLES.intersection(seq_scans(plan[0]["Plan"]))
+            if scanned:
+                self.fail(
+                    f"{method.upper()} {url} scans {', '.join(sorted(scanned))} "
+                    f"sequentially:\n{sql}\n{json.dumps(plan, indent=2)}"
+                )
+
+    def test_file_list(self):
+        self.assert_indexed("get", "/api/v1/files/")
+
+    def test_file_list_deep_page(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        next_page = client.get("/api/v1/files/", {"page_size": 3}).data["next"]
+        self.assert_indexed("get", next_page)
+
+        # The cursor bounds the index scan instead of filtering from its head
+        with CaptureQueriesContext(connection) as queries:
+            client.get(next_page)
+        page_query = next(
+            query["sql"] for query in queries if "ORDER BY" in query["sql"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN " + page_query)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertRegex(plan, r"Index Cond: .*upload_date <=")
+
+    def test_file_detail(self):
+        self.assert_indexed("get", f"/api/v1/files/{self.file.id}/")
+
+    def test_trash(self):
+        self.assert_indexed("get", "/api/v1/files/trash/")
+
+    def test_search(self):
+        query = self.file.file_name[:8]
+        self.assert_indexed("get", "/api/v1/search/", {"q": query})
+        self.assert_indexed("get", "/api/v1/search/", {"q": query, "file_type": "pdf"})
+
+    def test_search_uses_trigram_index(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            client.get("/api/v1/search/", {"q": self.file.file_name[:8]})
+        search_query = next(
+            query["sql"] for query in queries if "ORDER BY" in query["sql"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN " + search_query)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn("file_active_name_trgm_idx", plan)
+
+    def test_shared_with_me(self):
+        self.assert_indexed("get", "/api/v1/files/shared/")
+
+    def test_shared_by_me(self):
+        self.assert_indexed("get", "/api/v1/files/shared-by-the-user/")
+
+    def test_total_size(self):
+        # First call computes the counter, the second reads it
+        self.assert_indexed("post", "/api/v1/get-tot-file-size/")
+        self.assert_indexed("post", "/api/v1/get-tot-file-size/")
+
+    def test_user_list(self):
+        self.assert_indexed("get", "/api/v1/users/", {"is_active": "true"})
+
+    def test_email_lookups(self):
+        self.assert_indexed(
+            "post", "/api/v1/reset-password-request", {"email": "USER_5@example.com"}
+        )
+        self.assert_indexed(
+            "get",
+            "/api/v1/check-unique/",
+            {"username": "user_5", "email": "User_5@Example.com"},
+        )
+
+
+@override_settings(
+    RESPONSE_CACHE_TTL=0,
+    BLOB_STORAGES={
+        "default": {"BACKEND": "file_management.storage.InMemoryBlobStorage"}
+    },
+)
+class RequestMetricsTests(TestCase):
+    """Every request reports its queries and timings."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def logged(self, logs):
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs("api.requests", "INFO") as logs:
+            response = self.client.get("/api/v1/files/")
+        timing = response["Server-Timing"]
+        for name in ("db", "storage", "crypto", "total"):
+            self.assertIn(f"{name};dur=", timing)
+
+        (line,) = self.logged(logs)
+        self.assertEqual(line["method"], "GET")
+        self.assertEqual(line["path"], "/api/v1/files/")
+        self.assertEqual(line["status"], 200)
+        self.assertGreater(line["queries"], 0)
+        self.assertIn(f'desc="{line["queries"]} queries"', timing)
+        for field in ("duration_ms", "db_ms", "storage_ms", "crypto_ms"):
+            self.assertIsInstance(line[field], float)
+
+    def test_streamed_downloads_log_once_consumed(self):
+        with self.assertLogs("api.requests", "INFO"):
+            response = self.client.post(
+                "/api/v1/upload/",
+                {"files": SimpleUploadedFile("notes.bin", b"x" * 1000)},
+                format="multipart",
+            )
+        file_id = response.data[0]["id"]
+        with self.assertLogs("api.requests", "INFO") as logs:
+            response = self.client.get(f"/api/v1/files/{file_id}/decrypt/")
+            self.assertEqual(logs.records, [])
+            self.assertEqual(b"".join(response.streaming_content), b"x" * 1000)
+        (line,) = self.logged(logs)
+        self.assertEqual(line["path"], f"/api/v1/files/{file_id}/decrypt/")
+
+    @override_settings(REQUEST_QUERY_BUDGET=1)
+    def test_queries_over_the_budget(self):
+        with self.assertLogs("api.requests", "WARNING") as logs:
+            self.client.post(
+                "/api/v1/upload/",
+                {"files": SimpleUploadedFile("notes.bin", b"x" * 1000)},
+                format="multipart",
+            )
+        self.assertIn("over the budget of 1", logs.output[0])
 
-# Create your tests here.
+    def test_quiet_by_default(self):
+        self.assertFalse(logging.getLogger("api.requests").isEnabledFor(logging.INFO))
@@ -17,16 +17,38 @@ urlpatterns = [
     path("user-count/", get_user_count, name="user-count"),
     path("change-password/", change_password, name="change_password"),
     path("upload/", file_upload_view, name="file_upload"),
+    path("uploads/", create_upload_session, name="create-upload-session"),
+    path(
+        "uploads/<uuid:session_id>/",
+        upload_session_detail,
+        name="upload-session-detail",
+    ),
+    path(
+        "uploads/<uuid:session_id>/chunks/<int:index>/",
+        upload_chunk,
+        name="upload-chunk",
+    ),
+    path(
+        "uploads/<uuid:session_id>/complete/",
+        complete_upload_session,
+        name="complete-upload-session",
+    ),
     path("files/<int:pk>/delete/", file_delete_view, name="file-delete"),
+    path("files/batch-delete/", file_batch_delete_view, name="file-batch-delete"),
+    path("files/trash/", trash_list_view, name="file-trash"),
+    path("files/<int:pk>/restore/", file_restore_view, name="file-restore"),
     path("files/", file_list_view, name="file-list"),
+    path("files/<int:pk>/", file_detail_view, name="file-detail"),
     path("files/<int:pk>/decrypt/", decrypt_file, name="decrypt-file"),
     path("get-tot-file-size/", get_tot_size, name="get-tot-file-size"),
+    path("blob-cache-stats/", blob_cache_stats, name="blob-cache-stats"),
     # urls for contact create, read, and update
     path("contact/", create_contact, name="create-contact"),
     path("contact-list/", contact_list, name="contact-list"),
     path("contact/<int:pk>/update", update_contact, name="update-contact"),
     path("contact-count/", get_contact_count, name="contact-count"),
     path("deactivated-count/", get_deactivated_count, name="deactivated-count"),
+    path("admin-dashboard/", admin_dashboard, name="admin-dashboard"),
     path("files/share/", share_file, name="share_file"),  # Create share
     path(
         "files/shared/", list_shared_files, name="list_shared_files"
@@ -0,0 +1,125 @@
+"""
+Helpers shared by the benchmark management commands. Benchmarks run
+against a throwaway test database and an offline blob storage, never
+against the configured database or Cloudinary.
+"""
+
+import contextlib
+import datetime
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from .storage import InMemoryBlobStorage
+
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(timings):
+    return {
+        "p50_ms": percentile(timings, 50) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+    }
+
+
+def peak_memory_mb(request):
+    """
+    Call ``request`` once under tracemalloc and return the most memory its
+    Python allocations held at any one time, in MB. Unlike the process'
+    peak RSS this is measured per call. Tracing slows allocations down, so
+    benchmarks make this call apart from the timed ones.
+    """
+    tracemalloc.start()
+    try:
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def clear_memory_blobs():
+    """Drop everything stored in InMemoryBlobStorage, which is process-wide."""
+    with InMemoryBlobStorage.lock:
+        InMemoryBlobStorage.blobs.clear()
+
+
+def run_metadata(**extra):
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": revision,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": settings.DATABASES["default"]["ENGINE"],
+        "crypto_engine": settings.CRYPTO_ENGINE,
+        **extra,
+    }
+
+
+@contextlib.contextmanager
+def benchmark_environment(storage="memory"):
+    """
+    Create the test database and point the blob storage at an in-memory or
+    local-disk backend for the duration of a benchmark.
+    """
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        with contextlib.ExitStack() as stack:
+            if storage == "local":
+                location = stack.enter_context(tempfile.TemporaryDirectory())
+                backend = {
+                    "BACKEND": "file_management.storage.LocalBlobStorage",
+                    "OPTIONS": {"location": location},
+                }
+            else:
+                backend = {"BACKEND": "file_management.storage.InMemoryBlobStorage"}
+            stack.enter_context(
+                # Repeated requests have to reach the views, not the cache
+                override_settings(
+                    BLOB_STORAGES={"default": backend, "profile_pictures": backend},
+                    RESPONSE_CACHE_TTL=0,
+                )
+            )
+            yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
@@ -0,0 +1,229 @@
+"""
+On-disk LRU cache of encrypted blobs in front of a remote blob storage, so
+files that are downloaded over and over are not fetched again every time.
+
+Entries are plain files named after a hash of the ``public_id``. A SQLite
+index next to them records their sizes and last access times plus the
+hit/miss counters, so every worker process pointed at the same location
+shares the entries, the size bound and the statistics. Only ciphertext
+ever passes through the blob storage, so nothing is cached in the clear.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .storage import BlobStorage, stream_file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class BlobCache:
+    """Size bounded LRU cache of blobs below ``location``."""
+
+    def __init__(self, location, max_size):
+        self.location = os.path.abspath(location)
+        self.max_size = max_size
+        self._local = threading.local()
+        os.makedirs(self.location, exist_ok=True)
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        # One connection per thread, and never one inherited across a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(
+                os.path.join(self.location, "index.sqlite3"),
+                timeout=30,
+                isolation_level=None,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _key(self, public_id):
+        return hashlib.sha256(public_id.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.location, key[:2], key)
+
+    def _count(self, name):
+        self._db().execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def open(self, public_id):
+        """Return the cached blob as an open file, or None on a miss."""
+        key = self._key(public_id)
+        try:
+            blob = open(self._path(key), "rb")
+        except FileNotFoundError:
+            blob = None
+        else:
+            indexed = self._db().execute(
+                "UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key)
+            ).rowcount
+            if not indexed:
+                # Left by a process that died before indexing it, the size
+                # bound does not know about it
+                blob.close()
+                blob = None
+        if blob is None:
+            # Either half of an entry without the other is dropped
+            self._remove(key)
+            self._count("misses")
+            return None
+        self._count("hits")
+        return blob
+
+    def fill(self, public_id, chunks):
+        """
+        Pass ``chunks`` through while writing them to the cache. The entry is
+        only added once every chunk was read, an abandoned or failed read
+        leaves nothing behind.
+        """
+        key = self._key(public_id)
+        os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+        temp = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(self._path(key)), suffix=".tmp", delete=False
+        )
+        size = 0
+        complete = False
+        try:
+            for chunk in chunks:
+                if size is not None:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        # Would evict everything else, stop caching it
+                        size = None
+                    else:
+                        temp.write(chunk)
+                yield chunk
+            complete = size is not None
+        finally:
+            temp.close()
+            if complete:
+                os.replace(temp.name, self._path(key))
+                self._db().execute(
+                    "INSERT OR REPLACE INTO entries (key, size, accessed) "
+                    "VALUES (?, ?, ?)",
+                    (key, size, time.time()),
+                )
+                self._evict()
+            else:
+                os.remove(temp.name)
+
+    def _evict(self):
+        db = self._db()
+        (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_size:
+            return
+        for key, size in db.execute(
+            "SELECT key, size FROM entries ORDER BY accessed"
+        ).fetchall():
+            if total <= self.max_size:
+                break
+            self._remove(key)
+            total -= size
+            self._count("evictions")
+
+    def _remove(self, key):
+        # Readers that already opened the file keep reading it until they
+        # close it
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        self._db().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def invalidate(self, public_id):
+        self._remove(self._key(public_id))
+
+    def stats(self):
+        db = self._db()
+        counters = dict(db.execute("SELECT name, value FROM counters").fetchall())
+        entries, size = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else None,
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+        }
+
+
+class CachedBlobStorage(BlobStorage):
+    """
+    Wrap the blob storage configured in ``storage`` (a ``BLOB_STORAGES``
+    style dict) with a BlobCache. Whole blobs are cached as they are read,
+    Range reads are served from the cache but do not fill it.
+    """
+
+    def __init__(self, storage, location=None, max_size=1024 * 1024 * 1024):
+        storage_class = import_string(storage["BACKEND"])
+        self.storage = storage_class(**storage.get("OPTIONS", {}))
+        self.cache = BlobCache(
+            location or os.path.join(settings.BASE_DIR, "blob_cache"), max_size
+        )
+
+    def save(self, content, folder):
+        return self.storage.save(content, folder)
+
+    def read(self, public_id):
+        blob = self.cache.open(public_id)
+        if blob is not None:
+            with blob:
+                return blob.read()
+        data = self.storage.read(public_id)
+        for _ in self.cache.fill(public_id, [data]):
+            pass
+        return data
+
+    def stream(self, public_id, start=0, end=None):
+        blob = self.cache.open(public_id)
+        if blob is not None:
+            yield from stream_file(blob, start, end)
+        elif start == 0 and end is None:
+            yield from self.cache.fill(public_id, self.storage.stream(public_id))
+        else:
+            yield from self.storage.stream(public_id, start, end)
+
+    def concat(self, public_ids, folder):
+        return self.storage.concat(public_ids, folder)
+
+    def exists(self, public_id):
+        return self.storage.exists(public_id)
+
+    def delete(self, public_id):
+        self.cache.invalidate(public_id)
+        return self.storage.delete(public_id)
+
+    def delete_many(self, public_ids):
+        for public_id in public_ids:
+            self.cache.invalidate(public_id)
+        return self.storage.delete_many(public_ids)
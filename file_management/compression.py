@@ -0,0 +1,87 @@
+"""
+Optional compression applied to uploads before they are encrypted, since
+ciphertext no longer compresses. The codec is chosen from the file type and
+recorded in ``File.compression``. By default only text formats are
+compressed: a compressed file can only be decoded from its start, so its
+downloads answer Range requests with the whole file. Uploads whose first
+chunk does not get smaller are stored as they are.
+"""
+
+import lzma
+import zlib
+
+from django.conf import settings
+
+# Formats compressed with FILE_COMPRESSION_TYPES="text"
+COMPRESSIBLE_TYPES = {
+    "conf", "css", "csv", "htm", "html", "ini", "js", "json", "log", "md",
+    "rtf", "sql", "svg", "tex", "tsv", "txt", "xml", "yaml", "yml",
+}
+
+# Already compressed formats, including the zip based office documents.
+# Never compressed, even with FILE_COMPRESSION_TYPES="all".
+INCOMPRESSIBLE_TYPES = {
+    "7z", "aac", "avi", "avif", "br", "bz2", "docx", "epub", "flac", "gif",
+    "gz", "heic", "jar", "jpeg", "jpg", "m4a", "mkv", "mov", "mp3", "mp4",
+    "odp", "ods", "odt", "ogg", "pdf", "png", "pptx", "rar", "tgz", "webm",
+    "webp", "xlsx", "xz", "zip", "zst",
+}
+
+
+class Codec:
+    name = None
+
+    def compressor(self):
+        """Return an object with ``compress(data)`` and ``flush()``."""
+        raise NotImplementedError
+
+    def decompressor(self):
+        """Return an object with ``decompress(data)`` and ``eof``."""
+        raise NotImplementedError
+
+
+class ZlibCodec(Codec):
+    name = "zlib"
+
+    def compressor(self):
+        return zlib.compressobj(settings.FILE_COMPRESSION_LEVEL)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+
+class LzmaCodec(Codec):
+    """Smaller output than zlib for text, at a much higher CPU cost."""
+
+    name = "lzma"
+
+    def compressor(self):
+        return lzma.LZMACompressor(preset=settings.FILE_COMPRESSION_LEVEL)
+
+    def decompressor(self):
+        return lzma.LZMADecompressor()
+
+
+CODECS = {codec.name: codec for codec in (ZlibCodec(), LzmaCodec())}
+
+
+def codec_for(file_type):
+    """The codec new uploads of ``file_type`` are compressed with, or None."""
+    if not settings.FILE_COMPRESSION or file_type in INCOMPRESSIBLE_TYPES:
+        return None
+    if settings.FILE_COMPRESSION_TYPES != "all" and file_type not in COMPRESSIBLE_TYPES:
+        return None
+    return CODECS[settings.FILE_COMPRESSION]
+
+
+def decompress_chunks(codec_name, chunks):
+    decompressor = CODECS[codec_name].decompressor()
+    try:
+        for chunk in chunks:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Decompression failed: {e}")
+    if not decompressor.eof:
+        raise ValueError("Compressed data is truncated.")
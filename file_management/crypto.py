@@ -0,0 +1,284 @@
+"""
+AES-256-GCM container formats for stored files.
+
+Legacy rows (``File.segment_size`` is NULL) hold one ciphertext with a
+single nonce and tag for the whole file. Newer rows use the segmented
+format: the plaintext is cut into ``segment_size`` byte segments and every
+segment is sealed on its own as ``ciphertext || tag``. Segment ``i`` uses
+the nonce ``nonce_prefix || i`` (32-bit big endian) and authenticates a
+one byte flag telling whether it is the final segment, so segments cannot
+be reordered or the file truncated without the tag check failing. Because
+every sealed segment except the last has the same size, the ciphertext of
+any plaintext byte range can be located and decrypted on its own.
+
+The AES-GCM primitive itself comes from a ``CryptoEngine`` chosen with
+``settings.CRYPTO_ENGINE``. Batches of segments at least
+``settings.CRYPTO_OFFLOAD_THRESHOLD`` bytes long are sealed and opened on a
+process pool when ``settings.CRYPTO_PROCESS_POOL_WORKERS`` is set, so the
+request thread does not hold the worker's GIL while it waits.
+"""
+
+import atexit
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+from api.instrumentation import timed
+
+KEY_SIZE = 32  # AES-256 requires a 32-byte key
+NONCE_PREFIX_SIZE = 8
+TAG_SIZE = 16
+SEGMENT_SIZE = 64 * 1024
+# Segments opened together while a download is streamed
+DECRYPT_BATCH_SEGMENTS = 16
+
+
+class CryptoEngine:
+    """One AES-256-GCM implementation. ``seal`` returns ``ciphertext || tag``."""
+
+    name = None
+
+    def seal(self, key, nonce, data, aad=None):
+        raise NotImplementedError
+
+    def open(self, key, nonce, sealed, aad=None):
+        """Return the plaintext, or raise ValueError if the tag does not match."""
+        raise NotImplementedError
+
+
+class PycryptodomeEngine(CryptoEngine):
+    name = "pycryptodome"
+
+    def seal(self, key, nonce, data, aad=None):
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        if aad is not None:
+            cipher.update(aad)
+        ciphertext, tag = cipher.encrypt_and_digest(data)
+        return ciphertext + tag
+
+    def open(self, key, nonce, sealed, aad=None):
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        if aad is not None:
+            cipher.update(aad)
+        return cipher.decrypt_and_verify(sealed[:-TAG_SIZE], sealed[-TAG_SIZE:])
+
+
+class CryptographyEngine(CryptoEngine):
+    """OpenSSL's AES-GCM through the ``cryptography`` package."""
+
+    name = "cryptography"
+
+    def seal(self, key, nonce, data, aad=None):
+        return AESGCM(key).encrypt(nonce, data, aad)
+
+    def open(self, key, nonce, sealed, aad=None):
+        try:
+            return AESGCM(key).decrypt(nonce, sealed, aad)
+        except InvalidTag:
+            raise ValueError("MAC check failed")
+
+
+ENGINES = {
+    engine.name: engine for engine in (PycryptodomeEngine(), CryptographyEngine())
+}
+
+
+def get_crypto_engine(name=None):
+    return ENGINES[name or settings.CRYPTO_ENGINE]
+
+
+@functools.lru_cache(maxsize=None)
+def _process_pool():
+    pool = ProcessPoolExecutor(max_workers=settings.CRYPTO_PROCESS_POOL_WORKERS)
+    atexit.register(pool.shutdown, wait=False)
+    return pool
+
+
+def run_crypto(func, *args, size=0):
+    """
+    Call ``func(*args)`` on the crypto process pool when it is enabled and
+    the payload is at least ``CRYPTO_OFFLOAD_THRESHOLD`` bytes, else inline.
+    """
+    with timed("crypto"):
+        if (
+            settings.CRYPTO_PROCESS_POOL_WORKERS
+            and size >= settings.CRYPTO_OFFLOAD_THRESHOLD
+        ):
+            return _process_pool().submit(func, *args).result()
+        return func(*args)
+
+
+def new_key():
+    return get_random_bytes(KEY_SIZE)
+
+
+def new_nonce_prefix():
+    return get_random_bytes(NONCE_PREFIX_SIZE)
+
+
+def _segment_nonce(nonce_prefix, index):
+    return nonce_prefix + index.to_bytes(4, "big")
+
+
+def _segment_aad(is_last):
+    return b"\x01" if is_last else b"\x00"
+
+
+def seal_segments(engine_name, key, nonce_prefix, first_index, segments, last_index):
+    """Seal consecutive plaintext segments, starting at ``first_index``."""
+    engine = get_crypto_engine(engine_name)
+    return [
+        engine.seal(
+            key,
+            _segment_nonce(nonce_prefix, index),
+            data,
+            _segment_aad(index == last_index),
+        )
+        for index, data in enumerate(segments, first_index)
+    ]
+
+
+def open_segments(engine_name, key, nonce_prefix, first_index, sealed, last_index):
+    """Open consecutive sealed segments, raising ValueError on a bad tag."""
+    engine = get_crypto_engine(engine_name)
+    return [
+        engine.open(
+            key,
+            _segment_nonce(nonce_prefix, index),
+            data,
+            _segment_aad(index == last_index),
+        )
+        for index, data in enumerate(sealed, first_index)
+    ]
+
+
+def decrypt_single(key, nonce, ciphertext, tag):
+    """Decrypt a legacy file sealed as one GCM message."""
+    engine = get_crypto_engine()
+    return run_crypto(
+        engine.open, key, nonce, ciphertext + tag, size=len(ciphertext)
+    )
+
+
+def segment_count(plaintext_size, segment_size):
+    return max(1, -(-plaintext_size // segment_size))
+
+
+def ciphertext_size(plaintext_size, segment_size):
+    return plaintext_size + segment_count(plaintext_size, segment_size) * TAG_SIZE
+
+
+def sealed_offset(index, segment_size):
+    """Offset of sealed segment ``index`` inside the ciphertext."""
+    return index * (segment_size + TAG_SIZE)
+
+
+class SegmentEncryptor:
+    """
+    Turn a stream of plaintext chunks of any size into sealed segments.
+    ``update`` returns the ciphertext that is ready so far and ``finalize``
+    seals what is left, as the final segment unless ``is_last`` is False.
+    A part of a larger file starts at segment ``first_index`` and must then
+    hold a whole number of segments.
+    """
+
+    def __init__(
+        self, key=None, nonce_prefix=None, segment_size=SEGMENT_SIZE, first_index=0
+    ):
+        self.key = key or new_key()
+        self.nonce_prefix = nonce_prefix or new_nonce_prefix()
+        self.segment_size = segment_size
+        self.index = first_index
+        self.last_tag = b""
+        self.engine_name = settings.CRYPTO_ENGINE
+        self._buffer = bytearray()
+
+    def _seal(self, segments, is_last):
+        last_index = self.index + len(segments) - 1 if is_last else -1
+        sealed = run_crypto(
+            seal_segments,
+            self.engine_name,
+            self.key,
+            self.nonce_prefix,
+            self.index,
+            segments,
+            last_index,
+            size=sum(len(segment) for segment in segments),
+        )
+        self.index += len(segments)
+        self.last_tag = sealed[-1][-TAG_SIZE:]
+        return b"".join(sealed)
+
+    def update(self, data):
+        self._buffer += data
+        # Keep at least one byte back: only finalize knows the last segment
+        count = (len(self._buffer) - 1) // self.segment_size
+        if count <= 0:
+            return b""
+        segments = [
+            bytes(self._buffer[i * self.segment_size : (i + 1) * self.segment_size])
+            for i in range(count)
+        ]
+        del self._buffer[: count * self.segment_size]
+        return self._seal(segments, False)
+
+    def finalize(self, is_last=True):
+        if not is_last and len(self._buffer) != self.segment_size:
+            raise ValueError("Only the final part may end with a partial segment.")
+        sealed = self._seal([bytes(self._buffer)], is_last)
+        self._buffer.clear()
+        return sealed
+
+
+def decrypt_segments(key, nonce_prefix, segment_size, plaintext_size, chunks, start, end):
+    """
+    Yield the plaintext for bytes ``start``..``end`` (inclusive) of a
+    segmented file. ``chunks`` must iterate over the ciphertext beginning at
+    the sealed segment that contains ``start``.
+    """
+    engine_name = settings.CRYPTO_ENGINE
+    last_index = segment_count(plaintext_size, segment_size) - 1
+    index = start // segment_size
+    end_index = end // segment_size
+    buffer = bytearray()
+    chunks = iter(chunks)
+    while index <= end_index:
+        # Collect up to DECRYPT_BATCH_SEGMENTS sealed segments
+        batch = []
+        while index + len(batch) <= end_index and len(batch) < DECRYPT_BATCH_SEGMENTS:
+            batch_index = index + len(batch)
+            if batch_index == last_index:
+                sealed_size = plaintext_size - batch_index * segment_size + TAG_SIZE
+            else:
+                sealed_size = segment_size + TAG_SIZE
+            while len(buffer) < sealed_size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise ValueError("Ciphertext is truncated.")
+                buffer += chunk
+            batch.append(bytes(buffer[:sealed_size]))
+            del buffer[:sealed_size]
+
+        plaintexts = run_crypto(
+            open_segments,
+            engine_name,
+            key,
+            nonce_prefix,
+            index,
+            batch,
+            last_index,
+            size=sum(len(sealed) for sealed in batch),
+        )
+        for plaintext in plaintexts:
+            segment_start = index * segment_size
+            yield plaintext[max(start - segment_start, 0) : end - segment_start + 1]
+            index += 1
+
+    # Read the source to its end, so a caching source gets to keep it
+    for _ in chunks:
+        pass
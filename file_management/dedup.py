@@ -0,0 +1,84 @@
+"""
+Reference counted content index behind upload deduplication. A File row
+created from an existing blob copies that blob's crypto metadata, so the
+blob only has to be destroyed once its last ContentBlob reference is
+released.
+"""
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import ContentBlob, File
+
+
+def blob_owner(user):
+    return None if settings.FILE_DEDUP_SCOPE == "global" else user
+
+
+def acquire_duplicate(user, content_hash):
+    """
+    Return a File whose blob already holds the content with ``content_hash``
+    and take a reference on that blob, or None.
+    """
+    if settings.FILE_DEDUP_SCOPE == "off" or not content_hash:
+        return None
+
+    with transaction.atomic():
+        blob = (
+            ContentBlob.objects.select_for_update()
+            .filter(content_hash=content_hash, owner=blob_owner(user))
+            .first()
+        )
+        if blob is None:
+            return None
+        # Files in the trash still hold their reference on the blob
+        template = File.all_objects.filter(public_id=blob.public_id).first()
+        if template is None:
+            return None
+        ContentBlob.objects.filter(pk=blob.pk).update(ref_count=F("ref_count") + 1)
+        return template
+
+
+def register_blob(user, public_id, content_hash, references=1):
+    """Index a newly stored blob as holding ``content_hash``."""
+    if not content_hash:
+        return
+    # Concurrent uploads of the same content can each index their own blob,
+    # acquire_duplicate then simply reuses one of them
+    ContentBlob.objects.create(
+        public_id=public_id,
+        content_hash=content_hash,
+        owner=blob_owner(user),
+        ref_count=references,
+    )
+
+
+def release_blobs(public_ids):
+    """
+    Drop one reference for every entry of ``public_ids`` (an id can appear
+    more than once). Returns the ids no File row uses any more, whose blobs
+    should be destroyed.
+    """
+    released = Counter(public_ids)
+    unused = []
+    emptied = []
+    with transaction.atomic():
+        blobs = ContentBlob.objects.select_for_update().filter(public_id__in=released)
+        indexed = {blob.public_id: blob for blob in blobs}
+        for public_id, count in released.items():
+            blob = indexed.get(public_id)
+            if blob is None:
+                # Blobs stored before deduplication have exactly one row
+                unused.append(public_id)
+            elif blob.ref_count > count:
+                ContentBlob.objects.filter(pk=blob.pk).update(
+                    ref_count=F("ref_count") - count
+                )
+            else:
+                emptied.append(blob.pk)
+                unused.append(public_id)
+        ContentBlob.objects.filter(pk__in=emptied).delete()
+    return unused
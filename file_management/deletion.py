@@ -0,0 +1,125 @@
+"""
+Blobs are destroyed in the background: requests only queue the ids of
+blobs no File row uses any more, and the process_blob_deletions command
+removes them from the blob storage in batches.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .blob_cache import CachedBlobStorage
+from .dedup import release_blobs
+from .models import LinkShare, PendingBlobDeletion, SharedFile
+from .response_cache import bump_file_versions
+from .rollups import files_deleted
+from .storage import BlobStorageError, get_blob_storage
+from .usage import files_removed
+
+# How long a worker keeps the blobs it took; longer than any delete_many
+# call should take, after that the blobs are tried again by others
+DELETION_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def queue_blob_deletions(public_ids):
+    public_ids = list(public_ids)
+    PendingBlobDeletion.objects.bulk_create(
+        [PendingBlobDeletion(public_id=public_id) for public_id in public_ids],
+        ignore_conflicts=True,
+    )
+    # Nothing reads these blobs any more, free their cache space right away
+    storage = get_blob_storage()
+    if isinstance(storage, CachedBlobStorage):
+        for public_id in public_ids:
+            storage.cache.invalidate(public_id)
+
+
+def delete_files(files):
+    """
+    Delete the File rows in the queryset ``files`` for good, with batched
+    ``DELETE ... WHERE id IN`` statements on the file table, and queue the
+    blobs that lose their last reference. Returns the ids of the deleted
+    rows.
+    """
+    with transaction.atomic():
+        found = list(
+            files.select_for_update().only(
+                "id",
+                "public_id",
+                "user",
+                "file_size",
+                "trashed_at",
+                "upload_date",
+                "file_type",
+            )
+        )
+        # Before the shares are deleted below
+        bump_file_versions(found)
+        queue_blob_deletions(release_blobs(file.public_id for file in found))
+        ids = [file.id for file in found]
+        # The cascades by hand, so the collector finds nothing left to
+        # delete row by row
+        SharedFile.objects.filter(file_id__in=ids).delete()
+        LinkShare.objects.filter(file_id__in=ids).delete()
+        files.model.all_objects.filter(id__in=ids).delete()
+        # Trashed files already left their owner's usage
+        files_removed(file for file in found if file.trashed_at is None)
+        files_deleted(found)
+    return ids
+
+
+def trash_files(files):
+    """
+    Move the active File rows in the queryset ``files`` to the trash and
+    return their ids. Their blobs stay until the files are purged.
+    """
+    with transaction.atomic():
+        found = list(
+            files.filter(trashed_at__isnull=True)
+            .select_for_update()
+            .only("id", "public_id", "user", "file_size")
+        )
+        files.model.all_objects.filter(id__in=[file.id for file in found]).update(
+            trashed_at=timezone.now()
+        )
+        files_removed(found)
+        bump_file_versions(found)
+    return [file.id for file in found]
+
+
+def process_blob_deletions(batch_size=100):
+    """
+    Destroy one batch of queued blobs and return ``(deleted, failed)``.
+    Failed blobs stay queued behind the ones that were not tried yet.
+    """
+    storage = get_blob_storage()
+    now = timezone.now()
+    with transaction.atomic():
+        # Workers running side by side each take different rows
+        batch = list(
+            PendingBlobDeletion.objects.select_for_update(skip_locked=True)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+            .order_by("attempts", "id")[:batch_size]
+        )
+        if not batch:
+            return 0, 0
+        PendingBlobDeletion.objects.filter(
+            pk__in=[pending.pk for pending in batch]
+        ).update(attempts=F("attempts") + 1, claimed_until=now + DELETION_CLAIM_TIMEOUT)
+
+    # No transaction or row lock is held while the storage answers
+    error = "Not confirmed by the blob storage."
+    try:
+        gone = storage.delete_many([pending.public_id for pending in batch])
+    except BlobStorageError as e:
+        gone, error = set(), str(e)
+
+    with transaction.atomic():
+        PendingBlobDeletion.objects.filter(public_id__in=gone).delete()
+        failed = [pending.pk for pending in batch if pending.public_id not in gone]
+        PendingBlobDeletion.objects.filter(pk__in=failed).update(
+            last_error=error, claimed_until=None
+        )
+    return len(gone), len(failed)
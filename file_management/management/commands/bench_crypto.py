@@ -0,0 +1,144 @@
+import json
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from file_management.benchmarks import parse_size
+from file_management.crypto import (
+    ENGINES,
+    SegmentEncryptor,
+    decrypt_segments,
+    get_crypto_engine,
+    run_crypto,
+)
+
+FEED_SIZE = 1024 * 1024  # What EncryptingUploadHandler receives per chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the AES-GCM engines across payload sizes: the segmented "
+        "format as used by uploads and downloads, and single-message GCM."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="64K,1M,10M,100M",
+            help="Comma separated payload sizes, K/M/G suffixes allowed.",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--engines", default=",".join(ENGINES), help="Comma separated engines."
+        )
+        parser.add_argument(
+            "--pool-workers",
+            type=int,
+            default=0,
+            help="Also run every case on a crypto process pool of this size.",
+        )
+        parser.add_argument("--json", dest="json_path", help="Write results here.")
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(size) for size in options["sizes"].split(",")]
+        engines = options["engines"].split(",")
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            raise CommandError(f"Unknown engines: {', '.join(sorted(unknown))}")
+
+        pools = [0]
+        if options["pool_workers"]:
+            pools.append(options["pool_workers"])
+
+        results = []
+        self.stdout.write(
+            f"{'engine':<14}{'pool':>5}{'mode':>11}{'size':>12}"
+            f"{'encrypt MB/s':>15}{'decrypt MB/s':>15}"
+        )
+        for size in sizes:
+            data = os.urandom(size)
+            for engine in engines:
+                for workers in pools:
+                    with override_settings(
+                        CRYPTO_ENGINE=engine, CRYPTO_PROCESS_POOL_WORKERS=workers
+                    ):
+                        for mode, bench in (
+                            ("segmented", self.bench_segmented),
+                            ("single", self.bench_single),
+                        ):
+                            encrypt, decrypt = bench(data, options["repeat"])
+                            result = {
+                                "engine": engine,
+                                "pool_workers": workers,
+                                "mode": mode,
+                                "size": size,
+                                "encrypt_mb_s": size / encrypt / 1e6,
+                                "decrypt_mb_s": size / decrypt / 1e6,
+                            }
+                            results.append(result)
+                            self.stdout.write(
+                                f"{engine:<14}{workers:>5}{mode:>11}{size:>12}"
+                                f"{result['encrypt_mb_s']:>15.1f}"
+                                f"{result['decrypt_mb_s']:>15.1f}"
+                            )
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as output:
+                json.dump(results, output, indent=2)
+
+    def median_time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def bench_segmented(self, data, repeat):
+        state = {}
+
+        def encrypt():
+            encryptor = SegmentEncryptor()
+            parts = [
+                encryptor.update(data[offset : offset + FEED_SIZE])
+                for offset in range(0, len(data), FEED_SIZE)
+            ]
+            parts.append(encryptor.finalize())
+            state.update(
+                key=encryptor.key,
+                nonce_prefix=encryptor.nonce_prefix,
+                segment_size=encryptor.segment_size,
+                ciphertext=b"".join(parts),
+            )
+
+        def decrypt():
+            for _ in decrypt_segments(
+                state["key"],
+                state["nonce_prefix"],
+                state["segment_size"],
+                len(data),
+                [state["ciphertext"]],
+                0,
+                len(data) - 1,
+            ):
+                pass
+
+        return self.median_time(encrypt, repeat), self.median_time(decrypt, repeat)
+
+    def bench_single(self, data, repeat):
+        engine = get_crypto_engine()
+        key, nonce = os.urandom(32), os.urandom(16)
+        sealed = engine.seal(key, nonce, data)
+        return (
+            self.median_time(
+                lambda: run_crypto(engine.seal, key, nonce, data, size=len(data)),
+                repeat,
+            ),
+            self.median_time(
+                lambda: run_crypto(engine.open, key, nonce, sealed, size=len(sealed)),
+                repeat,
+            ),
+        )
@@ -0,0 +1,150 @@
+import base64
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.pagination import KeysetPagination
+from file_management.benchmarks import (
+    benchmark_environment,
+    latency_summary,
+    parse_size,
+    peak_memory_mb,
+    run_metadata,
+)
+from file_management.models import File
+from file_management.serializers import FileSerializer
+
+
+class LegacyFileSerializer(FileSerializer):
+    """What the listing returned before: every column, ciphertext included."""
+
+    class Meta(FileSerializer.Meta):
+        fields = FileSerializer.Meta.fields + ["ciphertext"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure response size and latency of file_list_view for users with "
+        "thousands of files: the first and the last keyset page of the lean "
+        "listing, against serializing every file with every column as the "
+        "listing used to."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--files", default="1000,5000", help="Comma separated files per user."
+        )
+        parser.add_argument(
+            "--page-sizes", default="50,200", help="Comma separated page sizes."
+        )
+        parser.add_argument(
+            "--file-size",
+            default="16K",
+            help=(
+                "Size of each file, K/M/G suffixes allowed. Rows carry that much "
+                "inline ciphertext, like legacy rows did."
+            ),
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--output", default="bench_file_list.json")
+
+    def handle(self, *args, **options):
+        file_counts = [int(count) for count in options["files"].split(",")]
+        page_sizes = [int(size) for size in options["page_sizes"].split(",")]
+
+        results = []
+        with benchmark_environment():
+            client = APIClient()
+            for file_count in file_counts:
+                user = User.objects.create_user(f"bench_{file_count}")
+                client.force_authenticate(user)
+                self.create_files(user, file_count, parse_size(options["file_size"]))
+
+                cases = [("full_list", None, self.full_list(user))]
+                for page_size in page_sizes:
+                    first = f"/api/v1/files/?page_size={page_size}"
+                    cases.append(("first_page", page_size, self.get(client, first)))
+                    deep = f"{first}&cursor={self.last_page_cursor(user, page_size)}"
+                    cases.append(("last_page", page_size, self.get(client, deep)))
+
+                for case, page_size, request in cases:
+                    result = self.run_case(request, options["repeat"])
+                    result.update(case=case, files=file_count, page_size=page_size)
+                    results.append(result)
+                    self.stdout.write(
+                        f"{file_count:>7} files {case:<11}{page_size or '-':>5}"
+                        f" {result['response_bytes']:>12} B"
+                        f" p50 {result['p50_ms']:8.1f} ms"
+                        f" p99 {result['p99_ms']:8.1f} ms"
+                        f" peak {result['peak_mb']:8.1f} MB"
+                    )
+
+        report = {
+            "meta": run_metadata(
+                benchmark="file_list", file_size=parse_size(options["file_size"])
+            ),
+            "results": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def create_files(self, user, count, size):
+        def b64(size):
+            return base64.b64encode(os.urandom(size)).decode()
+
+        # In batches, so only a thousand ciphertexts are in memory at a time
+        for offset in range(0, count, 1000):
+            File.objects.bulk_create(
+                File(
+                    user=user,
+                    file_name=f"report_{i}",
+                    file_url=f"https://example.com/user_{user.id}/{i}",
+                    public_id=f"user_{user.id}/{i}",
+                    file_type="pdf",
+                    key=b64(32),
+                    nonce=b64(12),
+                    ciphertext=b64(size),
+                    tag=b64(16),
+                    file_size=size,
+                    content_hash=os.urandom(32).hex(),
+                )
+                for i in range(offset, min(offset + 1000, count))
+            )
+
+    def last_page_cursor(self, user, page_size):
+        paginator = KeysetPagination(ordering=("-upload_date", "-id"))
+        files = File.objects.filter(user=user).order_by(*paginator.ordering)
+        # The row right before the last page
+        return paginator.encode_cursor(files[files.count() - page_size - 1])
+
+    def get(self, client, url):
+        def request():
+            response = client.get(url)
+            return response.content
+
+        return request
+
+    def full_list(self, user):
+        def request():
+            files = File.objects.defer(None).filter(user=user)
+            return JSONRenderer().render(LegacyFileSerializer(files, many=True).data)
+
+        return request
+
+    def run_case(self, request, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = request()
+            timings.append(time.perf_counter() - start)
+        return {
+            "response_bytes": len(content),
+            "peak_mb": peak_memory_mb(request),
+            **latency_summary(timings),
+        }
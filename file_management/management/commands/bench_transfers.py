@@ -0,0 +1,141 @@
+import functools
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from file_management.benchmarks import (
+    benchmark_environment,
+    clear_memory_blobs,
+    latency_summary,
+    parse_size,
+    peak_memory_mb,
+    run_metadata,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the upload -> encrypt -> store -> decrypt -> download path "
+        "through file_upload_view and decrypt_file for a matrix of file sizes "
+        "and files per request, and write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="64K,1M,10M",
+            help="Comma separated file sizes, K/M/G suffixes allowed.",
+        )
+        parser.add_argument(
+            "--counts", default="1,4", help="Comma separated files per upload request."
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=10, help="Upload requests per case."
+        )
+        parser.add_argument(
+            "--storage", choices=["memory", "local"], default="memory"
+        )
+        parser.add_argument("--output", default="bench_transfers.json")
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(size) for size in options["sizes"].split(",")]
+        counts = [int(count) for count in options["counts"].split(",")]
+
+        with benchmark_environment(options["storage"]):
+            user = User.objects.create_user("bench", "bench@example.com", "bench")
+            client = APIClient()
+            client.force_authenticate(user)
+
+            results = []
+            for size in sizes:
+                for count in counts:
+                    result = self.run_case(client, size, count, options["repeat"])
+                    results.append(result)
+                    self.stdout.write(
+                        f"{size:>10} B x {count:<3}"
+                        f" upload {result['upload']['mb_s']:8.1f} MB/s"
+                        f" p50 {result['upload']['p50_ms']:8.1f} ms"
+                        f" p99 {result['upload']['p99_ms']:8.1f} ms |"
+                        f" download {result['download']['mb_s']:8.1f} MB/s"
+                        f" p50 {result['download']['p50_ms']:8.1f} ms"
+                        f" p99 {result['download']['p99_ms']:8.1f} ms |"
+                        f" peak {result['upload']['peak_mb']:.1f}"
+                        f"/{result['download']['peak_mb']:.1f} MB"
+                    )
+
+        report = {
+            "meta": run_metadata(benchmark="transfers", storage=options["storage"]),
+            "results": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def run_case(self, client, size, count, repeat):
+        upload_timings, download_timings = [], []
+        try:
+            for _ in range(repeat):
+                # New content every request, repeated content would only
+                # measure the deduplication path without a single transfer
+                payloads = [os.urandom(size) for _ in range(count)]
+                start = time.perf_counter()
+                uploaded = self.upload(client, payloads)
+                upload_timings.append(time.perf_counter() - start)
+
+                for payload, file in zip(payloads, uploaded):
+                    start = time.perf_counter()
+                    self.download(client, payload, file)
+                    download_timings.append(time.perf_counter() - start)
+
+            # One more round, untimed, for the memory a single request needs.
+            # The upload includes the multipart body the test client builds.
+            payloads = [os.urandom(size) for _ in range(count)]
+            uploaded = []
+            upload_peak = peak_memory_mb(
+                lambda: uploaded.extend(self.upload(client, payloads))
+            )
+            download_peak = max(
+                peak_memory_mb(functools.partial(self.download, client, payload, file))
+                for payload, file in zip(payloads, uploaded)
+            )
+        finally:
+            # Blobs of earlier cases would otherwise stay in memory
+            clear_memory_blobs()
+
+        transferred = size * count * repeat
+        return {
+            "file_size": size,
+            "files_per_request": count,
+            "requests": repeat,
+            "upload": {
+                "mb_s": transferred / sum(upload_timings) / 1e6,
+                "peak_mb": upload_peak,
+                **latency_summary(upload_timings),
+            },
+            "download": {
+                "mb_s": transferred / sum(download_timings) / 1e6,
+                "peak_mb": download_peak,
+                **latency_summary(download_timings),
+            },
+        }
+
+    def upload(self, client, payloads):
+        files = [
+            SimpleUploadedFile(f"bench_{i}.bin", payload)
+            for i, payload in enumerate(payloads)
+        ]
+        response = client.post("/api/v1/upload/", {"files": files}, format="multipart")
+        if response.status_code != 201:
+            raise CommandError(f"Upload failed: {response.status_code} {response.data}")
+        return response.data
+
+    def download(self, client, payload, file):
+        download = client.get(f"/api/v1/files/{file['id']}/decrypt/")
+        received = sum(len(chunk) for chunk in download.streaming_content)
+        if received != len(payload):
+            raise CommandError(f"Downloaded {received} of {len(payload)} bytes")
@@ -0,0 +1,118 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+from django.test.utils import override_settings
+
+from file_management.compression import CODECS
+from file_management.models import File
+
+FEED_SIZE = 1024 * 1024  # What EncryptingUploadHandler receives per chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the bytes saved by compressing uploads before encryption, "
+        "per file type. With --sample, also weigh the CPU time of every "
+        "codec and level against the transfer time it saves on sample files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sample", nargs="+", default=[], help="Files to measure codecs on."
+        )
+        parser.add_argument(
+            "--levels", default="1,6,9", help="Comma separated compression levels."
+        )
+        parser.add_argument(
+            "--bandwidth",
+            type=float,
+            default=100,
+            help="Upload bandwidth to the blob storage in Mbit/s.",
+        )
+
+    def handle(self, *args, **options):
+        self.stored_stats()
+        if options["sample"]:
+            levels = [int(level) for level in options["levels"].split(",")]
+            self.tradeoff(options["sample"], levels, options["bandwidth"])
+
+    def stored_stats(self):
+        rows = (
+            File.objects.exclude(stored_size=None)
+            .values("file_type", "compression")
+            .annotate(
+                files=Count("id"),
+                original=Sum("file_size"),
+                stored=Sum("stored_size"),
+            )
+            .order_by("-original")
+        )
+        self.stdout.write(
+            f"{'type':<10}{'codec':<8}{'files':>8}{'original':>14}"
+            f"{'stored':>14}{'saved':>8}"
+        )
+        total_original = total_stored = 0
+        for row in rows:
+            total_original += row["original"]
+            total_stored += row["stored"]
+            self.stdout.write(
+                f"{row['file_type']:<10}{row['compression'] or '-':<8}"
+                f"{row['files']:>8}{row['original']:>14}{row['stored']:>14}"
+                f"{self.saved(row['original'], row['stored']):>8}"
+            )
+        self.stdout.write(
+            f"Total: {total_original} -> {total_stored} bytes, "
+            f"{total_original - total_stored} saved "
+            f"({self.saved(total_original, total_stored)})"
+        )
+
+    def saved(self, original, stored):
+        if not original:
+            return "-"
+        return f"{(original - stored) / original:.1%}"
+
+    def tradeoff(self, paths, levels, bandwidth):
+        data = b""
+        for path in paths:
+            try:
+                with open(path, "rb") as sample:
+                    data += sample.read()
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+        if not data:
+            raise CommandError("The sample files are empty.")
+
+        bytes_per_second = bandwidth * 1e6 / 8
+        self.stdout.write("")
+        self.stdout.write(
+            f"{len(data)} sample bytes at {bandwidth:g} Mbit/s take "
+            f"{len(data) / bytes_per_second * 1000:.1f} ms to upload uncompressed."
+        )
+        self.stdout.write(
+            f"{'codec':<8}{'level':>6}{'ratio':>8}{'compress ms':>13}"
+            f"{'decompress ms':>15}{'transfer saved ms':>19}{'net ms':>9}"
+        )
+        for codec in CODECS.values():
+            for level in levels:
+                with override_settings(FILE_COMPRESSION_LEVEL=level):
+                    compressor = codec.compressor()
+                started = time.perf_counter()
+                compressed = b"".join(
+                    compressor.compress(data[offset : offset + FEED_SIZE])
+                    for offset in range(0, len(data), FEED_SIZE)
+                ) + compressor.flush()
+                compress_time = time.perf_counter() - started
+
+                started = time.perf_counter()
+                codec.decompressor().decompress(compressed)
+                decompress_time = time.perf_counter() - started
+
+                transfer_saved = (len(data) - len(compressed)) / bytes_per_second
+                # Positive when compressing pays for itself on upload
+                net = transfer_saved - compress_time
+                self.stdout.write(
+                    f"{codec.name:<8}{level:>6}{len(compressed) / len(data):>8.3f}"
+                    f"{compress_time * 1000:>13.1f}{decompress_time * 1000:>15.1f}"
+                    f"{transfer_saved * 1000:>19.1f}{net * 1000:>9.1f}"
+                )
@@ -0,0 +1,145 @@
+import base64
+import hashlib
+import io
+import time
+
+from django.core.management.base import BaseCommand
+
+from file_management.models import File
+from file_management.storage import get_blob_storage
+
+
+def holds_same_bytes(storage, public_id, ciphertext):
+    """Read the blob back and compare its length and SHA-256 with ``ciphertext``."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in storage.stream(public_id):
+        digest.update(chunk)
+        size += len(chunk)
+    return size == len(ciphertext) and (
+        digest.digest() == hashlib.sha256(ciphertext).digest()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the inline ciphertext of legacy File rows out of the table. "
+        "Rows are processed in primary key order in small batches, so the "
+        "command can run against a live database and be stopped and re-run "
+        "at any time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--after-id",
+            type=int,
+            default=0,
+            help="Resume after this primary key instead of the beginning.",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=None, help="Stop after this many rows."
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to pause between batches to limit database load.",
+        )
+        parser.add_argument(
+            "--reupload-missing",
+            action="store_true",
+            help=(
+                "Upload the inline ciphertext when the blob storage lacks it "
+                "or holds different bytes."
+            ),
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        storage = get_blob_storage()
+        # Files in the trash still need their blob once they are restored
+        pending = File.all_objects.exclude(ciphertext="")
+        total = pending.filter(pk__gt=options["after_id"]).count()
+        self.stdout.write(f"{total} rows still carry inline ciphertext.")
+
+        last_id = options["after_id"]
+        migrated = skipped = processed = 0
+        while options["limit"] is None or processed < options["limit"]:
+            batch_size = options["batch_size"]
+            if options["limit"] is not None:
+                batch_size = min(batch_size, options["limit"] - processed)
+            batch = list(
+                pending.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                break
+
+            for pk in batch:
+                # Load one row at a time so only a single ciphertext is in memory
+                file = File.all_objects.defer(None).get(pk=pk)
+                ciphertext = base64.b64decode(file.ciphertext)
+                processed += 1
+                # The column is the only other copy, so it is emptied only
+                # once the blob is read back with the very same bytes
+                try:
+                    verified = holds_same_bytes(storage, file.public_id, ciphertext)
+                    problem = "holds different bytes"
+                except Exception as e:
+                    verified = False
+                    problem = f"could not be read ({e})"
+
+                if verified:
+                    if not options["dry_run"]:
+                        File.all_objects.filter(
+                            pk=pk, public_id=file.public_id
+                        ).update(ciphertext="")
+                    migrated += 1
+                    continue
+
+                if options["reupload_missing"]:
+                    if options["dry_run"]:
+                        migrated += 1
+                        continue
+                    try:
+                        public_id, file_url = storage.save(
+                            io.BytesIO(ciphertext), f"user_{file.user_id}"
+                        )
+                        verified = holds_same_bytes(storage, public_id, ciphertext)
+                    except Exception as e:
+                        self.stderr.write(
+                            f"File {pk}: blob {file.public_id} {problem}, "
+                            f"uploading the inline copy failed: {e}. Skipped."
+                        )
+                        skipped += 1
+                        continue
+                    if verified:
+                        File.all_objects.filter(
+                            pk=pk, public_id=file.public_id
+                        ).update(public_id=public_id, file_url=file_url, ciphertext="")
+                        migrated += 1
+                        continue
+                    storage.delete(public_id)
+                    problem += ", the uploaded copy did not read back the same"
+
+                self.stderr.write(
+                    f"File {pk}: blob {file.public_id} {problem}, skipped."
+                )
+                skipped += 1
+
+            last_id = batch[-1]
+            self.stdout.write(
+                f"{processed}/{total} rows processed, {migrated} migrated, "
+                f"{skipped} skipped (last id {last_id})"
+            )
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Done: {migrated} migrated, {skipped} skipped. "
+                f"Resume with --after-id {last_id}."
+            )
+        )
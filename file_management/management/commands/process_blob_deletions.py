@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from file_management.deletion import process_blob_deletions
+
+
+class Command(BaseCommand):
+    help = (
+        "Destroy the blobs queued by file deletes, in batches through the "
+        "blob storage's bulk delete. Runs until the queue is empty, or "
+        "forever with --loop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--loop", action="store_true", help="Keep polling for new deletions."
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=5,
+            help="Seconds to wait when the queue is empty (with --loop).",
+        )
+
+    def handle(self, *args, **options):
+        total_deleted = total_failed = 0
+        while True:
+            deleted, failed = process_blob_deletions(options["batch_size"])
+            total_deleted += deleted
+            total_failed += failed
+            if deleted or failed:
+                self.stdout.write(f"Deleted {deleted} blobs, {failed} failed.")
+            if deleted:
+                continue
+            # The queue is empty, or only holds blobs that just failed
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Deleted {total_deleted} blobs, {total_failed} attempts failed."
+            )
+        )
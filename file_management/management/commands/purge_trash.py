@@ -0,0 +1,67 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from file_management.deletion import delete_files, process_blob_deletions
+from file_management.models import File
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete files that have been in the trash for longer than the "
+        "retention window, in batches. Their blobs are queued for "
+        "process_blob_deletions, or destroyed right away with --delete-blobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.TRASH_RETENTION_DAYS,
+            help="Files trashed longer ago than this are purged.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to pause between batches to limit database load.",
+        )
+        parser.add_argument(
+            "--delete-blobs",
+            action="store_true",
+            help="Also empty the blob deletion queue afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        expired = File.all_objects.filter(trashed_at__lt=cutoff)
+
+        purged = 0
+        while True:
+            batch = list(
+                expired.order_by("trashed_at", "id").values_list("id", flat=True)[
+                    : options["batch_size"]
+                ]
+            )
+            if not batch:
+                break
+            # Rows restored in the meantime drop out of the filter
+            purged += len(delete_files(expired.filter(id__in=batch)))
+            self.stdout.write(f"Purged {purged} files so far.")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} files from the trash."))
+
+        if options["delete_blobs"]:
+            deleted = 0
+            while True:
+                batch_deleted, _ = process_blob_deletions()
+                if not batch_deleted:
+                    break
+                deleted += batch_deleted
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} blobs."))
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from file_management.deletion import queue_blob_deletions
+from file_management.models import UploadChunk, UploadSession
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete upload sessions that saw no chunk for a while and queue "
+        "their stored chunks for deletion."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="Sessions idle for longer than this are removed.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["hours"])
+        sessions = UploadSession.objects.filter(updated_at__lt=cutoff)
+
+        # The stored chunks are destroyed by process_blob_deletions
+        chunks = UploadChunk.objects.filter(session__in=sessions).exclude(public_id="")
+        with transaction.atomic():
+            queue_blob_deletions(chunks.values_list("public_id", flat=True))
+            deleted, _ = sessions.delete()
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} stale upload rows."))
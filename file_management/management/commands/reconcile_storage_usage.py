@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from file_management.models import StorageUsage
+from file_management.usage import compute_usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every user's storage usage from the file table and "
+        "repair the counters that drifted, in batches of users."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the counters that are off.",
+        )
+
+    def handle(self, *args, **options):
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", flat=True)[: options["batch_size"]]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            with transaction.atomic():
+                # Uploads and deletions of these users wait for the lock, so
+                # their changes apply on top of the recomputed values
+                counters = {
+                    usage.user_id: usage
+                    for usage in StorageUsage.objects.select_for_update().filter(
+                        user_id__in=user_ids
+                    )
+                }
+                actual = compute_usage(user_ids)
+
+                missing, drifted = [], []
+                for user_id, (total, count) in actual.items():
+                    usage = counters.get(user_id)
+                    if usage is None:
+                        missing.append(
+                            StorageUsage(user_id=user_id, bytes=total, file_count=count)
+                        )
+                    elif (usage.bytes, usage.file_count) != (total, count):
+                        self.stdout.write(
+                            f"User {user_id}: {usage.bytes} bytes in "
+                            f"{usage.file_count} files, actually {total} bytes "
+                            f"in {count} files."
+                        )
+                        usage.bytes, usage.file_count = total, count
+                        drifted.append(usage)
+
+                if not options["dry_run"]:
+                    StorageUsage.objects.bulk_create(missing, ignore_conflicts=True)
+                    StorageUsage.objects.bulk_update(drifted, ["bytes", "file_count"])
+
+            checked += len(user_ids)
+            repaired += len(drifted)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} users, {repaired} counters "
+                f"{'are off' if options['dry_run'] else 'repaired'}."
+            )
+        )
@@ -0,0 +1,40 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from file_management.rollups import backfill_rollups, refresh_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold new uploads into the daily rollups read by the admin "
+        "dashboard, or rebuild a range of days from the file table with "
+        "--backfill."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="Recompute the days between --start and --end from scratch.",
+        )
+        parser.add_argument("--start", help="First day to rebuild, YYYY-MM-DD.")
+        parser.add_argument("--end", help="Last day to rebuild, YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        if not options["backfill"]:
+            if options["start"] or options["end"]:
+                raise CommandError("--start and --end only apply to --backfill.")
+            counted = refresh_rollups()
+            self.stdout.write(self.style.SUCCESS(f"Rolled up {counted} new files."))
+            return
+
+        try:
+            start, end = (
+                date.fromisoformat(options[name]) if options[name] else None
+                for name in ("start", "end")
+            )
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        counted = backfill_rollups(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rollups from {counted} files."))
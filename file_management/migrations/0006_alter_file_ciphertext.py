@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0005_remove_sharedfile_access_level'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='ciphertext',
+            field=models.TextField(blank=True),
+        ),
+    ]
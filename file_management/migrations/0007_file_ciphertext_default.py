@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0006_alter_file_ciphertext'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='file',
+            options={'base_manager_name': 'objects'},
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='ciphertext',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0007_file_ciphertext_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='segment_size',
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
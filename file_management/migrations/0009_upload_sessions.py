@@ -0,0 +1,52 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:39
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0008_file_segment_size'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file_size',
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255)),
+                ('file_type', models.CharField(default='unknown', max_length=255)),
+                ('file_size', models.PositiveBigIntegerField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('segment_size', models.PositiveIntegerField()),
+                ('key', models.TextField()),
+                ('nonce', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('public_id', models.CharField(max_length=255)),
+                ('tag', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='file_management.uploadsession')),
+            ],
+            options={
+                'unique_together': {('session', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0009_upload_sessions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='public_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_id', models.CharField(max_length=255, unique=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('ref_count', models.PositiveIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('owner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='content_blobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['content_hash', 'owner'], name='file_manage_content_b5b4e6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0010_content_dedup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='compression',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='stored_size',
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0011_file_compression'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingBlobDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('public_id', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:53
+
+import django.db.models.manager
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0012_pending_blob_deletions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='file',
+            options={'base_manager_name': 'all_objects'},
+        ),
+        migrations.AlterModelManagers(
+            name='file',
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('all_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='trashed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('trashed_at__isnull', True)), fields=['user', '-upload_date'], name='file_active_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('trashed_at__isnull', True)), fields=['user', 'file_name'], name='file_active_user_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('trashed_at__isnull', False)), fields=['trashed_at'], name='file_trashed_at_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# pg_trgm GIN index behind file_management.search. Postgres keeps it up to
+# date on every insert, update and delete; rows in the trash drop out of it.
+CREATE_INDEX = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS file_active_name_trgm_idx
+    ON file_management_file USING gin (UPPER(file_name) gin_trgm_ops)
+    WHERE trashed_at IS NULL;
+"""
+DROP_INDEX = "DROP INDEX IF EXISTS file_active_name_trgm_idx;"
+
+
+def create_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_INDEX)
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0013_file_trash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0014_file_name_trigram_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='file',
+            name='file_active_user_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('trashed_at__isnull', True)), fields=['user', '-upload_date', '-id'], name='file_active_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharedfile',
+            index=models.Index(fields=['shared_with', '-shared_date', '-id'], name='shared_with_date_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0016_storage_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('last_file_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('file_type', models.CharField(max_length=255)),
+                ('file_count', models.IntegerField(default=0)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'file_type'), name='upload_rollup_day_type')],
+            },
+        ),
+    ]
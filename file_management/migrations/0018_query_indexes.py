@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0017_upload_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('trashed_at__isnull', True)), fields=['user', 'file_type'], name='file_active_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharedfile',
+            index=models.Index(fields=['file', 'shared_with'], name='shared_file_recipient_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0018_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadchunk',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='uploadchunk',
+            name='public_id',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0019_upload_chunk_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='completing_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_management', '0020_upload_session_completing_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingblobdeletion',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
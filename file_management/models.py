@@ -1,26 +1,180 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 
 
+class FileManager(models.Manager):
+    def __init__(self, include_trashed=False):
+        super().__init__()
+        self.include_trashed = include_trashed
+
+    def get_queryset(self):
+        # The legacy ciphertext column can hold megabytes per row
+        queryset = super().get_queryset().defer("ciphertext")
+        if not self.include_trashed:
+            queryset = queryset.filter(trashed_at__isnull=True)
+        return queryset
+
+
 class File(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="files")
     file_name = models.CharField(max_length=255)
     file_url = models.URLField(
         max_length=200, null=True
     )  # Store the URL of the uploaded file
-    public_id = models.CharField(max_length=255, unique=True)
+    # Several rows can share one blob once uploads are deduplicated
+    public_id = models.CharField(max_length=255, db_index=True)
     upload_date = models.DateTimeField(auto_now_add=True)
     file_type = models.CharField(max_length=255, default="unknown")
     key = models.TextField()  # Store the encoded key
     nonce = models.TextField()  # Store the encoded nonce
-    ciphertext = models.TextField()  # Store the encoded ciphertext
+    # Encoded ciphertext of legacy rows, emptied by the migrate_ciphertext
+    # command once the blob storage is confirmed to hold the same bytes
+    ciphertext = models.TextField(blank=True, default="")
     tag = models.TextField()
-    file_size = models.PositiveIntegerField(null=True)
+    file_size = models.PositiveBigIntegerField(null=True)
+    # Plaintext bytes per sealed segment, NULL for files encrypted as a
+    # single GCM message (see file_management/crypto.py)
+    segment_size = models.PositiveIntegerField(null=True)
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # Codec the plaintext was compressed with before encryption, if any, and
+    # the size of the data that was sealed into segments
+    compression = models.CharField(max_length=16, blank=True, default="")
+    stored_size = models.PositiveBigIntegerField(null=True)
+    # Set while the file sits in the trash, purge_trash deletes it for good
+    # after TRASH_RETENTION_DAYS
+    trashed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = FileManager()
+    all_objects = FileManager(include_trashed=True)
+
+    class Meta:
+        # Related lookups such as shared_file.file skip the ciphertext too,
+        # and still reach files in the trash
+        base_manager_name = "all_objects"
+        indexes = [
+            # Partial indexes, so lists and totals never scan the trash
+            models.Index(
+                fields=["user", "-upload_date", "-id"],
+                condition=models.Q(trashed_at__isnull=True),
+                name="file_active_user_date_idx",
+            ),
+            models.Index(
+                fields=["user", "file_name"],
+                condition=models.Q(trashed_at__isnull=True),
+                name="file_active_user_name_idx",
+            ),
+            # Search results and facets narrowed to one type
+            models.Index(
+                fields=["user", "file_type"],
+                condition=models.Q(trashed_at__isnull=True),
+                name="file_active_user_type_idx",
+            ),
+            models.Index(
+                fields=["trashed_at"],
+                condition=models.Q(trashed_at__isnull=False),
+                name="file_trashed_at_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.file_name
 
 
+class ContentBlob(models.Model):
+    """
+    Content index for deduplication: the blob holding the plaintext with
+    ``content_hash`` for ``owner`` (NULL when deduplicating across users)
+    and how many File rows point at it.
+    """
+
+    public_id = models.CharField(max_length=255, unique=True)
+    content_hash = models.CharField(max_length=64)
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, related_name="content_blobs"
+    )
+    ref_count = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["content_hash", "owner"])]
+
+    def __str__(self):
+        return f"{self.content_hash} ({self.ref_count} references)"
+
+
+class PendingBlobDeletion(models.Model):
+    """
+    A blob that no File row uses any more, waiting for the
+    process_blob_deletions worker to destroy it.
+    """
+
+    public_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    # Set while a worker is deleting the blob, so no other worker takes it
+    claimed_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.public_id
+
+
+class StorageUsage(models.Model):
+    """
+    Bytes and number of files a user keeps outside the trash, maintained
+    by file_management/usage.py as files come and go. Deduplicated copies
+    of a blob count its bytes once, unlike a sum of file_size over the
+    user's files.
+    """
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="storage_usage"
+    )
+    # Signed so drift cannot fail a request, reconcile_storage_usage
+    # repairs it
+    bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.bytes} bytes in {self.file_count} files"
+
+
+class UploadRollup(models.Model):
+    """
+    Uploads per day and file type, for the admin dashboard. Filled by
+    file_management/rollups.py, rebuilt by the rollup_uploads command.
+    """
+
+    day = models.DateField()
+    file_type = models.CharField(max_length=255)
+    file_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "file_type"], name="upload_rollup_day_type"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.file_type}: {self.file_count} uploads"
+
+
+class RollupCheckpoint(models.Model):
+    """Highest File id already folded into the rollups."""
+
+    name = models.CharField(max_length=64, unique=True)
+    last_file_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} up to {self.last_file_id}"
+
+
 class SharedFile(models.Model):
     file = models.ForeignKey(
         File, on_delete=models.CASCADE, related_name="shared_files"
@@ -30,6 +184,19 @@ class SharedFile(models.Model):
     )
     shared_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the files shared with a user
+            models.Index(
+                fields=["shared_with", "-shared_date", "-id"],
+                name="shared_with_date_idx",
+            ),
+            # Duplicate checks when sharing and removing a share
+            models.Index(
+                fields=["file", "shared_with"], name="shared_file_recipient_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.file.file_name} shared with {self.shared_with.username}"
 
@@ -42,3 +209,56 @@ class LinkShare(models.Model):
 
     def __str__(self):
         return f"Link for {self.file.file_name}"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload. The client PUTs numbered chunks in any order; each
+    chunk is encrypted as a run of segments of the final file and stored as
+    its own blob until the session is completed.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=255, default="unknown")
+    file_size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    segment_size = models.PositiveIntegerField()
+    key = models.TextField()
+    nonce = models.TextField()
+    # Set by the request joining the chunks, so only one completes the upload
+    completing_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.file_size // self.chunk_size))
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.file_size - index * self.chunk_size)
+
+    def __str__(self):
+        return f"Upload of {self.file_name} by {self.user.username}"
+
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(
+        UploadSession, on_delete=models.CASCADE, related_name="chunks"
+    )
+    index = models.PositiveIntegerField()
+    # Empty until the chunk's blob is stored. The row is created first so
+    # its nonces are never used for two different contents.
+    public_id = models.CharField(max_length=255, blank=True, default="")
+    tag = models.TextField()  # Tag of the chunk's last segment
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("session", "index")
+
+    def __str__(self):
+        return f"Chunk {self.index} of {self.session_id}"
@@ -0,0 +1,140 @@
+"""
+Per-user response cache for read endpoints. Every user has a version in
+the cache; cached responses are keyed by it, so bumping the version
+invalidates all of that user's entries at once without looking for them.
+Stale entries simply expire. GET responses also carry an ETag made from
+the same version, and a matching If-None-Match is answered with 304 before
+the view runs.
+
+A version is a random token rather than a counter, so concurrent bumps,
+cache backends without an atomic incr (file based) and versions evicted
+from the cache can never bring an old version back. Uploads, deletions,
+restores, shares and unshares bump the versions of everyone whose lists
+they change, once the transaction has committed. A bump only reaches the
+processes that share the cache, which is why entries live in their own
+"responses" cache alias and RESPONSE_CACHE_TTL defaults to 0 when that
+alias is a per process (locmem) cache. Only GET and HEAD responses are
+cached.
+"""
+
+import functools
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import SharedFile
+
+
+def _cache():
+    return caches["responses"]
+
+
+def _version_key(user_id):
+    return f"response_cache:version:{user_id}"
+
+
+def user_version(user_id):
+    cache = _cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # First request since the version was bumped away or evicted
+        cache.add(key, uuid.uuid4().hex, timeout=settings.RESPONSE_CACHE_TTL)
+        version = cache.get(key)
+    return version
+
+
+def bump_versions(*user_ids):
+    """Invalidate the cached responses of ``user_ids`` once the data is committed."""
+    user_ids = set(user_ids)
+
+    def bump():
+        _cache().set_many(
+            {_version_key(user_id): uuid.uuid4().hex for user_id in user_ids},
+            timeout=settings.RESPONSE_CACHE_TTL,
+        )
+
+    if user_ids:
+        transaction.on_commit(bump)
+
+
+def bump_file_versions(files):
+    """Bump the owners of ``files`` and everyone the files are shared with."""
+    files = list(files)
+    recipients = SharedFile.objects.filter(
+        file_id__in=[file.id for file in files]
+    ).values_list("shared_with_id", flat=True)
+    bump_versions(*(file.user_id for file in files), *recipients)
+
+
+def set_etag(response, etag):
+    response["ETag"] = etag
+    # Private to the user, and checked with the server before every reuse
+    response["Cache-Control"] = "private, no-cache"
+
+
+def content_etag(file):
+    # The GCM tag changes whenever the content is encrypted again
+    digest = hashlib.sha256(f"{file.public_id}:{file.tag}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def not_modified(etag):
+    response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    set_etag(response, etag)
+    return response
+
+
+def cache_per_user(name):
+    """
+    Cache the successful GET and HEAD responses of a function based view
+    per user and full path (query parameters included) for
+    RESPONSE_CACHE_TTL seconds, and answer conditional GETs of unchanged
+    responses with 304.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Other methods change data or, like the POST that returns the
+            # storage total, must always reach the view
+            if not settings.RESPONSE_CACHE_TTL or request.method not in (
+                "GET",
+                "HEAD",
+            ):
+                return view(request, *args, **kwargs)
+
+            user_id = request.user.id
+            # JSON and the browsable API are different representations
+            variant = hashlib.sha256(
+                f"{request.get_full_path()}:{request.accepted_renderer.format}".encode()
+            ).hexdigest()
+            key = f"response_cache:{name}:{user_id}:{user_version(user_id)}:{variant}"
+            conditional = request.method == "GET"
+            etag = f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+            if conditional and etag in parse_etags(
+                request.headers.get("If-None-Match", "")
+            ):
+                return not_modified(etag)
+
+            cache = _cache()
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response.data, timeout=settings.RESPONSE_CACHE_TTL)
+            if conditional and response.status_code == 200:
+                set_etag(response, etag)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,239 @@
+"""
+Daily upload rollups for the admin dashboard. refresh_rollups folds the
+File rows added since its last run into UploadRollup, delete_files takes
+purged rows back out, and the rollup_uploads command rebuilds a range of
+days from the file table. Dashboard queries read a handful of rows per day
+instead of scanning every file.
+
+The upload statistics endpoints never write. They read the rollups plus
+the files uploaded since the last refresh, so they stay current while the
+rollup_uploads command (scheduled every few minutes, e.g. from cron)
+keeps that tail short; the admin dashboard also refreshes the rollups when
+it recomputes.
+"""
+
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .models import File, RollupCheckpoint, UploadRollup
+
+CHECKPOINT = "uploads"
+
+# Rows this recent are left for the next run: an upload that is still
+# committing can hold a lower id than rows already visible
+ROLLUP_LAG = timedelta(minutes=1)
+
+GRANULARITIES = {
+    "day": lambda field: F(field),
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+
+# The same in Python, for days outside the rollups. Weeks start on Monday.
+PERIOD_OF = {
+    "day": lambda day: day,
+    "week": lambda day: day - timedelta(days=day.weekday()),
+    "month": lambda day: day.replace(day=1),
+}
+
+
+def _lock_checkpoint():
+    RollupCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    # Refreshes run one at a time, so no row is counted twice
+    return RollupCheckpoint.objects.select_for_update().get(name=CHECKPOINT)
+
+
+def _daily_totals(files):
+    return (
+        files.annotate(day=TruncDate("upload_date"))
+        .values("day", "file_type")
+        .annotate(count=Count("id"), size=Sum("file_size"))
+        .values_list("day", "file_type", "count", "size")
+        .order_by()
+    )
+
+
+def _add(totals, sign):
+    for day, file_type, count, size in totals:
+        updated = UploadRollup.objects.filter(day=day, file_type=file_type).update(
+            file_count=F("file_count") + sign * count,
+            total_bytes=F("total_bytes") + sign * (size or 0),
+        )
+        if not updated and sign > 0:
+            UploadRollup.objects.create(
+                day=day, file_type=file_type, file_count=count, total_bytes=size or 0
+            )
+
+
+def _refresh(checkpoint):
+    new = File.all_objects.filter(id__gt=checkpoint.last_file_id)
+    last_id = new.filter(upload_date__lt=timezone.now() - ROLLUP_LAG).aggregate(
+        Max("id")
+    )["id__max"]
+    if last_id is None:
+        return 0
+    new = new.filter(id__lte=last_id)
+    totals = list(_daily_totals(new))
+    _add(totals, 1)
+    checkpoint.last_file_id = last_id
+    checkpoint.save(update_fields=["last_file_id", "updated_at"])
+    return sum(count for _, _, count, _ in totals)
+
+
+def refresh_rollups():
+    """Fold the files uploaded since the last run into the rollups."""
+    with transaction.atomic():
+        return _refresh(_lock_checkpoint())
+
+
+def backfill_rollups(start=None, end=None):
+    """
+    Rebuild the rollups of the days from ``start`` to ``end`` (inclusive,
+    open ended when None) from the file table. Returns the number of files
+    counted.
+    """
+    with transaction.atomic():
+        checkpoint = _lock_checkpoint()
+        _refresh(checkpoint)
+
+        rollups = UploadRollup.objects.all()
+        files = File.all_objects.filter(id__lte=checkpoint.last_file_id)
+        if start is not None:
+            rollups = rollups.filter(day__gte=start)
+            files = files.filter(upload_date__date__gte=start)
+        if end is not None:
+            rollups = rollups.filter(day__lte=end)
+            files = files.filter(upload_date__date__lte=end)
+
+        rollups.delete()
+        totals = list(_daily_totals(files))
+        UploadRollup.objects.bulk_create(
+            UploadRollup(
+                day=day, file_type=file_type, file_count=count, total_bytes=size or 0
+            )
+            for day, file_type, count, size in totals
+        )
+    return sum(count for _, _, count, _ in totals)
+
+
+def _last_file_id():
+    return (
+        RollupCheckpoint.objects.filter(name=CHECKPOINT)
+        .values_list("last_file_id", flat=True)
+        .first()
+        or 0
+    )
+
+
+def files_deleted(files):
+    """Take ``files``, File rows being deleted for good, out of the rollups."""
+    last_file_id = _last_file_id()
+    # Rows past the checkpoint were never counted
+    totals = Counter()
+    sizes = Counter()
+    for file in files:
+        if file.id <= last_file_id:
+            key = (timezone.localdate(file.upload_date), file.file_type)
+            totals[key] += 1
+            sizes[key] += file.file_size or 0
+    _add(((*key, count, sizes[key]) for key, count in totals.items()), -1)
+
+
+def rollup_params(params):
+    """
+    Read ``granularity``, ``start`` and ``end`` (YYYY-MM-DD, inclusive) from
+    the query parameters of a dashboard request. Raises ValueError with a
+    message for the client.
+    """
+    granularity = params.get("granularity", "month")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}.")
+    dates = []
+    for name in ("start", "end"):
+        value = params.get(name)
+        try:
+            dates.append(date.fromisoformat(value) if value else None)
+        except ValueError:
+            raise ValueError(
+                f"{name} must be a date in YYYY-MM-DD format."
+            ) from None
+    return granularity, *dates
+
+
+def rollups_between(start=None, end=None):
+    rollups = UploadRollup.objects.all()
+    if start is not None:
+        rollups = rollups.filter(day__gte=start)
+    if end is not None:
+        rollups = rollups.filter(day__lte=end)
+    return rollups
+
+
+def unrolled_totals(start=None, end=None):
+    """
+    ``(day, file_type, count, size)`` of the files uploaded since the last
+    refresh, which the rollups do not hold yet.
+    """
+    files = File.all_objects.filter(id__gt=_last_file_id())
+    if start is not None:
+        files = files.filter(upload_date__date__gte=start)
+    if end is not None:
+        files = files.filter(upload_date__date__lte=end)
+    return list(_daily_totals(files))
+
+
+def uploads_by_type(start=None, end=None):
+    """A Counter of the uploads of each file type."""
+    counts = Counter(
+        dict(
+            rollups_between(start, end)
+            .values("file_type")
+            .annotate(count=Sum("file_count"))
+            .values_list("file_type", "count")
+            .order_by()
+        )
+    )
+    for _, file_type, count, _ in unrolled_totals(start, end):
+        counts[file_type] += count
+    return counts
+
+
+def period_start(period):
+    """
+    The midnight ``period``, the first day of a day, week or month, starts
+    at: what TruncMonth over the file table returned before the rollups.
+    """
+    period = datetime.combine(period, time.min)
+    return timezone.make_aware(period) if settings.USE_TZ else period
+
+
+def upload_series(granularity, start=None, end=None):
+    """Uploads and bytes per day, week or month, oldest first."""
+    totals = {
+        period: (uploads, total_bytes)
+        for period, uploads, total_bytes in rollups_between(start, end)
+        .annotate(period=GRANULARITIES[granularity]("day"))
+        .values("period")
+        .annotate(total_uploads=Sum("file_count"), total_bytes=Sum("total_bytes"))
+        .values_list("period", "total_uploads", "total_bytes")
+        .order_by()
+    }
+    for day, _, count, size in unrolled_totals(start, end):
+        period = PERIOD_OF[granularity](day)
+        uploads, total_bytes = totals.get(period, (0, 0))
+        totals[period] = (uploads + count, total_bytes + (size or 0))
+    return [
+        {
+            "period": period_start(period),
+            "total_uploads": uploads,
+            "total_bytes": total_bytes,
+        }
+        for period, (uploads, total_bytes) in sorted(totals.items())
+        if uploads
+    ]
@@ -0,0 +1,66 @@
+"""
+File name search. On PostgreSQL matches come from a pg_trgm GIN index on
+``UPPER(file_name)`` (see migration 0014), which serves both substring
+matches and fuzzy word matches and is ranked by trigram similarity. Other
+databases, such as the SQLite used in test runs, fall back to a substring
+scan ranked by exact and prefix matches.
+"""
+
+from django.db import connection
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+from .models import File, SharedFile
+
+
+def visible_files(user):
+    """Files ``user`` owns or that were shared with them."""
+    shared = SharedFile.objects.filter(shared_with=user).values("file_id")
+    return File.objects.filter(Q(user=user) | Q(id__in=shared))
+
+
+def search(user, query):
+    """Return the files matching ``query``, best match first."""
+    files = visible_files(user)
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        # Same expression as the index, so both conditions can use it
+        needle = query.upper()
+        return (
+            files.alias(search_name=Upper("file_name"))
+            .filter(
+                Q(search_name__contains=needle)
+                | Q(search_name__trigram_word_similar=needle)
+            )
+            .annotate(rank=TrigramWordSimilarity(needle, Upper("file_name")))
+            .order_by("-rank", "-upload_date", "-id")
+        )
+
+    return (
+        files.filter(file_name__icontains=query)
+        .annotate(
+            rank=Case(
+                When(file_name__iexact=query, then=Value(3)),
+                When(file_name__istartswith=query, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        )
+        .order_by("-rank", "-upload_date", "-id")
+    )
+
+
+def file_type_facets(files):
+    """
+    Count ``files`` per file type. search_files passes every match before
+    it applies its ``file_type`` filter, so the facets keep listing the
+    other types (and their counts) while the user narrows down to one.
+    """
+    counts = (
+        files.order_by()
+        .values("file_type")
+        .annotate(count=Count("id"))
+        .order_by("-count", "file_type")
+    )
+    return {row["file_type"]: row["count"] for row in counts}
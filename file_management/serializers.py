@@ -10,6 +10,29 @@ import hashlib
 UserModel = get_user_model()
 
 
+class FileListSerializer(serializers.ModelSerializer):
+    """
+    Metadata shown in file lists. Leaves out the encryption components and
+    storage bookkeeping, views load only these columns with
+    ``.only(*FileListSerializer.Meta.fields)``.
+    """
+
+    class Meta:
+        model = File
+        fields = [
+            "id",
+            "file_name",
+            "file_url",
+            "upload_date",
+            "user",
+            "file_type",
+            "file_size",
+            "trashed_at",
+        ]
+        read_only_fields = fields
+
+
+# Full representation, for uploads and the file detail view
 class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = File
@@ -22,11 +45,16 @@ class FileSerializer(serializers.ModelSerializer):
             "user",
             "key",
             "nonce",
-            "ciphertext",
             "tag",
             "file_type",
             "file_size",
+            "segment_size",
+            "content_hash",
+            "compression",
+            "stored_size",
+            "trashed_at",
         ]
+        read_only_fields = ["trashed_at"]
 
     def validate_file_url(self, value):
         if not value:
@@ -53,6 +81,30 @@ class FileSerializer(serializers.ModelSerializer):
         return value
 
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            "id",
+            "file_name",
+            "file_type",
+            "file_size",
+            "chunk_size",
+            "chunk_count",
+            "received_chunks",
+            "created_at",
+        ]
+        read_only_fields = ["chunk_size", "created_at"]
+
+    def get_received_chunks(self, obj):
+        return sorted(
+            obj.chunks.exclude(public_id="").values_list("index", flat=True)
+        )
+
+
 class SharedFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = SharedFile
@@ -0,0 +1,328 @@
+import functools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+import cloudinary.uploader
+import requests
+from cloudinary import api
+from cloudinary.exceptions import NotFound
+from cloudinary.utils import cloudinary_url
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Ciphertext is sent to Cloudinary in parts of this size (Cloudinary minimum is 5 MB)
+UPLOAD_CHUNK_SIZE = 6 * 1024 * 1024
+# Size of the pieces stream() hands out while a blob is downloaded
+STREAM_CHUNK_SIZE = 256 * 1024
+# Most public ids Cloudinary accepts in one delete_resources call
+DELETE_BATCH_SIZE = 100
+
+
+def stream_file(blob, start=0, end=None):
+    """Yield bytes ``start``..``end`` of the open file ``blob`` and close it."""
+    with blob:
+        blob.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            size = STREAM_CHUNK_SIZE
+            if remaining is not None:
+                size = min(size, remaining)
+                remaining -= size
+            chunk = blob.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class BlobStorageError(Exception):
+    """Raised when a backend cannot store or return a blob."""
+
+
+class BlobStorage:
+    """
+    Where encrypted file contents live. A ``File`` row only keeps the
+    ``public_id`` returned by ``save`` plus the crypto metadata needed to
+    decrypt what ``read`` returns.
+    """
+
+    def save(self, content, folder):
+        """Store the file-like ``content`` and return ``(public_id, url)``."""
+        raise NotImplementedError
+
+    def read(self, public_id):
+        """Return the stored bytes for ``public_id``, or raise BlobStorageError."""
+        raise NotImplementedError
+
+    def stream(self, public_id, start=0, end=None):
+        """
+        Yield the bytes from ``start`` to ``end`` (inclusive, None for the end
+        of the blob) in pieces. Backends override this to avoid loading the
+        whole blob.
+        """
+        data = self.read(public_id)
+        stop = len(data) if end is None else end + 1
+        for offset in range(start, stop, STREAM_CHUNK_SIZE):
+            yield data[offset : min(offset + STREAM_CHUNK_SIZE, stop)]
+
+    def concat(self, public_ids, folder):
+        """
+        Store the blobs ``public_ids`` back to back as one new blob and
+        return ``(public_id, url)`` like ``save``. The parts are left for the
+        caller to delete once the new blob is in use. Backends that can
+        compose blobs in place override this; the default downloads the
+        parts and uploads the result.
+        """
+        with tempfile.TemporaryFile() as combined:
+            for public_id in public_ids:
+                for chunk in self.stream(public_id):
+                    combined.write(chunk)
+            combined.seek(0)
+            return self.save(combined, folder)
+
+    def exists(self, public_id):
+        raise NotImplementedError
+
+    def delete(self, public_id):
+        """Remove the blob, returning True if the backend confirmed it."""
+        raise NotImplementedError
+
+    def delete_many(self, public_ids):
+        """
+        Remove several blobs, returning the ids that no longer exist
+        afterwards. Backends with a bulk delete API override this.
+        """
+        return {
+            public_id
+            for public_id in public_ids
+            if self.delete(public_id) or not self.exists(public_id)
+        }
+
+
+class CloudinaryBlobStorage(BlobStorage):
+    """
+    Uploads and deletes go through the Cloudinary SDK, which already keeps a
+    module level urllib3 pool. Downloads use one ``requests.Session`` per
+    storage instance so repeated reads reuse kept-alive TLS connections.
+    """
+
+    def __init__(self, resource_type="raw", pool_maxsize=10, timeout=30):
+        self.resource_type = resource_type
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def save(self, content, folder):
+        upload_result = cloudinary.uploader.upload_large(
+            content,
+            chunk_size=UPLOAD_CHUNK_SIZE,
+            folder=folder,
+            resource_type=self.resource_type,
+        )
+        return upload_result.get("public_id"), upload_result.get("secure_url")
+
+    def url(self, public_id):
+        return cloudinary_url(public_id, resource_type=self.resource_type, secure=True)[0]
+
+    def read(self, public_id):
+        try:
+            response = self.session.get(self.url(public_id), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise BlobStorageError(f"Failed to fetch {public_id}: {e}") from e
+        return response.content
+
+    def stream(self, public_id, start=0, end=None):
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = self.session.get(
+                self.url(public_id), headers=headers, stream=True, timeout=self.timeout
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise BlobStorageError(f"Failed to fetch {public_id}: {e}") from e
+
+        with response:
+            # A server that ignores Range answers 200 with the whole blob
+            skip = start if response.status_code == 200 else 0
+            remaining = None if end is None else end - start + 1
+            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk = chunk[dropped:]
+                    skip -= dropped
+                if remaining is not None:
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                if chunk:
+                    yield chunk
+                if remaining == 0:
+                    break
+
+    def exists(self, public_id):
+        try:
+            api.resource(public_id, resource_type=self.resource_type)
+            return True
+        except NotFound:
+            return False
+        except Exception as e:
+            logger.warning("Error checking resource %s: %s", public_id, e)
+            return False
+
+    def delete(self, public_id):
+        response = cloudinary.uploader.destroy(
+            public_id, resource_type=self.resource_type
+        )
+        return response.get("result") == "ok"
+
+    def delete_many(self, public_ids):
+        gone = set()
+        for offset in range(0, len(public_ids), DELETE_BATCH_SIZE):
+            batch = list(public_ids[offset : offset + DELETE_BATCH_SIZE])
+            try:
+                response = api.delete_resources(
+                    batch, resource_type=self.resource_type
+                )
+            except Exception as e:
+                raise BlobStorageError(f"Failed to delete blobs: {e}") from e
+            gone.update(
+                public_id
+                for public_id, result in response.get("deleted", {}).items()
+                if result in ("deleted", "not_found")
+            )
+        return gone
+
+
+class LocalBlobStorage(BlobStorage):
+    """Keep blobs as plain files below ``location``."""
+
+    def __init__(self, location=None, base_url="http://localhost:8000/blobs/"):
+        self.location = os.path.abspath(
+            location or os.path.join(settings.BASE_DIR, "blobs")
+        )
+        self.base_url = base_url
+
+    def path(self, public_id):
+        path = os.path.abspath(os.path.join(self.location, public_id))
+        if not path.startswith(self.location + os.sep):
+            raise BlobStorageError(f"Invalid blob id {public_id!r}")
+        return path
+
+    def save(self, content, folder):
+        public_id = f"{folder}/{uuid.uuid4().hex}"
+        path = self.path(public_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary name first so readers never see a partial blob
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as destination:
+            shutil.copyfileobj(content, destination)
+        os.replace(destination.name, path)
+        return public_id, self.base_url + public_id
+
+    def concat(self, public_ids, folder):
+        public_id = f"{folder}/{uuid.uuid4().hex}"
+        path = self.path(public_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Append the part files to the new blob directly on disk
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as destination:
+            try:
+                for part_id in public_ids:
+                    with open(self.path(part_id), "rb") as part:
+                        shutil.copyfileobj(part, destination)
+            except OSError as e:
+                os.remove(destination.name)
+                raise BlobStorageError(f"Failed to join blobs: {e}") from e
+        os.replace(destination.name, path)
+        return public_id, self.base_url + public_id
+
+    def read(self, public_id):
+        try:
+            with open(self.path(public_id), "rb") as blob:
+                return blob.read()
+        except OSError as e:
+            raise BlobStorageError(f"Failed to read {public_id}: {e}") from e
+
+    def stream(self, public_id, start=0, end=None):
+        try:
+            blob = open(self.path(public_id), "rb")
+        except OSError as e:
+            raise BlobStorageError(f"Failed to read {public_id}: {e}") from e
+        yield from stream_file(blob, start, end)
+
+    def exists(self, public_id):
+        return os.path.isfile(self.path(public_id))
+
+    def delete(self, public_id):
+        try:
+            os.remove(self.path(public_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class InMemoryBlobStorage(BlobStorage):
+    """Keep blobs in a process-wide dict, for tests and benchmarks."""
+
+    blobs = {}
+    lock = threading.Lock()
+
+    def __init__(self, base_url="http://localhost:8000/blobs/"):
+        self.base_url = base_url
+
+    def save(self, content, folder):
+        public_id = f"{folder}/{uuid.uuid4().hex}"
+        data = content.read()
+        with self.lock:
+            self.blobs[public_id] = data
+        return public_id, self.base_url + public_id
+
+    def read(self, public_id):
+        try:
+            return self.blobs[public_id]
+        except KeyError:
+            raise BlobStorageError(f"Blob {public_id} does not exist")
+
+    def exists(self, public_id):
+        return public_id in self.blobs
+
+    def delete(self, public_id):
+        with self.lock:
+            return self.blobs.pop(public_id, None) is not None
+
+
+def get_blob_storage(alias="default"):
+    """
+    Return the storage configured under ``alias`` in ``settings.BLOB_STORAGES``,
+    which follows the layout of Django's ``STORAGES`` setting.
+    """
+    # Cached by the alias alone, so get_blob_storage() and
+    # get_blob_storage("default") share one instance
+    return _blob_storage(alias)
+
+
+@functools.lru_cache(maxsize=None)
+def _blob_storage(alias):
+    config = settings.BLOB_STORAGES[alias]
+    storage_class = import_string(config["BACKEND"])
+    return storage_class(**config.get("OPTIONS", {}))
+
+
+@receiver(setting_changed)
+def reset_blob_storages(setting, **kwargs):
+    if setting == "BLOB_STORAGES":
+        _blob_storage.cache_clear()
@@ -1,3 +1,1646 @@
-from django.test import TestCase
+import base64
+import functools
+import hashlib
+import io
+import itertools
+import os
+import tempfile
+import tracemalloc
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .blob_cache import BlobCache, CachedBlobStorage
+from .crypto import (
+    ENGINES,
+    SEGMENT_SIZE,
+    SegmentEncryptor,
+    _process_pool,
+    ciphertext_size,
+    decrypt_segments,
+    get_crypto_engine,
+    sealed_offset,
+)
+from .deletion import process_blob_deletions
+from .models import (
+    ContentBlob,
+    File,
+    LinkShare,
+    PendingBlobDeletion,
+    SharedFile,
+    StorageUsage,
+    UploadChunk,
+    UploadRollup,
+    UploadSession,
+)
+from .serializers import FileListSerializer, FileSerializer
+from .storage import (
+    STREAM_CHUNK_SIZE,
+    BlobStorageError,
+    InMemoryBlobStorage,
+    LocalBlobStorage,
+    get_blob_storage,
+)
+from .upload_handlers import EncryptingUploadHandler
+
+
+# Every request has to reach the view
+@override_settings(RESPONSE_CACHE_TTL=0)
+class ShareListQueryCountTests(TestCase):
+    """
+    The share listings must run a fixed number of queries per page, however
+    many files and recipients the page holds.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.recipient = User.objects.create_user("recipient", "r@example.com", "pw")
+        self.client = APIClient()
+
+    def share(self, files, recipients):
+        for _ in range(files):
+            file = File.objects.create(
+                user=self.owner,
+                file_name=f"report_{File.objects.count()}.pdf",
+                public_id=f"blob-{File.objects.count()}",
+                file_type="pdf",
+                key="k",
+                nonce="n",
+                tag="t",
+            )
+            SharedFile.objects.bulk_create(
+                SharedFile(file=file, shared_with=user) for user in recipients
+            )
+
+    def recipients(self, count):
+        start = User.objects.count()
+        return [
+            User.objects.create_user(f"user_{start + index}")
+            for index in range(count)
+        ]
+
+    def count_queries(self, user, url):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.data["results"]
+
+    def test_shared_with_me_is_constant(self):
+        self.share(2, [self.recipient])
+        baseline, results = self.count_queries(self.recipient, "/api/v1/files/shared/")
+        self.assertEqual(len(results), 2)
+
+        self.share(20, [self.recipient])
+        with self.assertNumQueries(baseline):
+            self.client.get("/api/v1/files/shared/")
+        _, results = self.count_queries(self.recipient, "/api/v1/files/shared/")
+        self.assertEqual(len(results), 22)
+        self.assertEqual(results[0]["username"], "owner")
+
+    def test_shared_by_me_is_constant(self):
+        url = "/api/v1/files/shared-by-the-user/"
+        self.share(2, self.recipients(2))
+        baseline, results = self.count_queries(self.owner, url)
+        self.assertEqual(len(results), 2)
+
+        self.share(20, self.recipients(10))
+        with self.assertNumQueries(baseline):
+            self.client.get(url)
+        _, results = self.count_queries(self.owner, url)
+        self.assertEqual(len(results), 22)
+        self.assertEqual(len(results[0]["shared_with"]), 10)
+        self.assertEqual(
+            [user["username"] for user in results[-1]["shared_with"]],
+            ["user_2", "user_3"],
+        )
+
+    def test_shared_by_me_lists_first_share_and_recipients_in_order(self):
+        url = "/api/v1/files/shared-by-the-user/"
+        recipients = self.recipients(3)
+        self.share(1, recipients[::-1])
+        # A file shared with the owner is not one the owner shared
+        theirs = File.objects.create(
+            user=recipients[0], file_name="theirs.pdf", key="k", nonce="n", tag="t"
+        )
+        SharedFile.objects.create(file=theirs, shared_with=self.owner)
+
+        _, results = self.count_queries(self.owner, url)
+        self.assertEqual(len(results), 1)
+        first = SharedFile.objects.filter(file__user=self.owner).earliest("id")
+        self.assertEqual(results[0]["shared_date"], first.shared_date)
+        self.assertEqual(
+            [user["user_id"] for user in results[0]["shared_with"]],
+            [user.id for user in recipients[::-1]],
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "ArrayAgg needs PostgreSQL")
+    def test_shared_by_me_aggregation_matches_the_fallback(self):
+        url = "/api/v1/files/shared-by-the-user/"
+        self.share(3, self.recipients(2))
+        self.share(2, self.recipients(3))
+        _, aggregated = self.count_queries(self.owner, url)
+        with mock.patch("file_management.views.connection", vendor="sqlite"):
+            _, fallback = self.count_queries(self.owner, url)
+        self.assertEqual(aggregated, fallback)
+
+
+@override_settings(RESPONSE_CACHE_TTL=0)
+class FileListTests(TestCase):
+    """Lists send and load metadata only, the detail view the whole file."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.other = User.objects.create_user("other", "other@example.com", "pw")
+        self.file = self.create_file(self.user, "report")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_file(self, user, name):
+        return File.objects.create(
+            user=user,
+            file_name=name,
+            public_id=f"blob-{name}",
+            file_type="pdf",
+            key="secret-key",
+            nonce="n",
+            tag="t",
+            ciphertext="legacy",
+            file_size=100,
+        )
+
+    def assert_metadata_only(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        [row] = response.data["results"]
+        self.assertEqual(set(row), set(FileListSerializer.Meta.fields))
+        for query in queries:
+            for column in ("key", "nonce", "ciphertext", "public_id"):
+                self.assertNotIn(f'"file_management_file"."{column}"', query["sql"])
+
+    def test_file_list(self):
+        self.assert_metadata_only("/api/v1/files/")
+
+    def test_trash_list(self):
+        File.objects.filter(pk=self.file.pk).update(trashed_at=timezone.now())
+        self.assert_metadata_only("/api/v1/files/trash/")
+
+    def test_ciphertext_is_deferred(self):
+        file = File.objects.get(pk=self.file.pk)
+        self.assertIn("ciphertext", file.get_deferred_fields())
+        file = File.objects.defer(None).get(pk=self.file.pk)
+        self.assertEqual(file.ciphertext, "legacy")
+
+    def test_detail_sends_the_full_representation(self):
+        response = self.client.get(f"/api/v1/files/{self.file.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), set(FileSerializer.Meta.fields))
+        self.assertEqual(response.data["key"], "secret-key")
+        self.assertNotIn("ciphertext", response.data)
+
+    def test_detail_of_other_users_files_is_404(self):
+        theirs = self.create_file(self.other, "theirs")
+        response = self.client.get(f"/api/v1/files/{theirs.id}/")
+        self.assertEqual(response.status_code, 404)
+
+
+IN_MEMORY_BLOBS = {
+    "default": {"BACKEND": "file_management.storage.InMemoryBlobStorage"}
+}
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS)
+class MigrateCiphertextTests(TestCase):
+    """Inline ciphertext is only dropped once the blob reads back the same."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.storage = get_blob_storage()
+
+    def legacy_file(self, ciphertext, blob=None, **fields):
+        public_id = f"legacy/{os.urandom(8).hex()}"
+        if blob is not None:
+            self.storage.blobs[public_id] = blob
+        return File.all_objects.create(
+            user=self.user,
+            file_name="legacy",
+            public_id=public_id,
+            key="a2V5",
+            nonce="bm9uY2U=",
+            tag="dGFn",
+            ciphertext=base64.b64encode(ciphertext).decode(),
+            **fields,
+        )
+
+    def migrate(self, *args):
+        call_command(
+            "migrate_ciphertext", *args, stdout=io.StringIO(), stderr=io.StringIO()
+        )
+
+    def inline(self, file):
+        return File.all_objects.defer(None).get(pk=file.pk).ciphertext
+
+    def test_matching_blob(self):
+        ciphertext = os.urandom(1000)
+        file = self.legacy_file(ciphertext, ciphertext)
+        trashed = self.legacy_file(ciphertext, ciphertext, trashed_at=timezone.now())
+        self.migrate()
+        self.assertEqual(self.inline(file), "")
+        self.assertEqual(self.inline(trashed), "")
+
+    def test_different_or_missing_blob_is_kept(self):
+        ciphertext = os.urandom(1000)
+        changed = self.legacy_file(ciphertext, ciphertext[:-1] + b"x")
+        missing = self.legacy_file(ciphertext)
+        self.migrate()
+        self.assertNotEqual(self.inline(changed), "")
+        self.assertNotEqual(self.inline(missing), "")
+
+    def test_read_errors_keep_the_row(self):
+        ciphertext = os.urandom(1000)
+        file = self.legacy_file(ciphertext, ciphertext)
+        with mock.patch.object(
+            InMemoryBlobStorage, "read", side_effect=BlobStorageError("down")
+        ):
+            self.migrate()
+        self.assertNotEqual(self.inline(file), "")
+
+    def test_reupload_missing(self):
+        ciphertext = os.urandom(1000)
+        file = self.legacy_file(ciphertext)
+        self.migrate("--reupload-missing")
+        file = File.all_objects.defer(None).get(pk=file.pk)
+        self.assertEqual(file.ciphertext, "")
+        self.assertEqual(self.storage.read(file.public_id), ciphertext)
+
+
+class SegmentedCryptoTests(SimpleTestCase):
+    """Segments are sealed so that tampering, truncation and reordering fail."""
+
+    SEGMENT_SIZE = 16
+
+    def setUp(self):
+        self.data = os.urandom(3 * self.SEGMENT_SIZE + 5)
+        encryptor = SegmentEncryptor(segment_size=self.SEGMENT_SIZE)
+        self.ciphertext = encryptor.update(self.data) + encryptor.finalize()
+        self.key = encryptor.key
+        self.nonce_prefix = encryptor.nonce_prefix
+
+    def decrypt(self, ciphertext, start=0, end=None, size=None):
+        size = len(self.data) if size is None else size
+        end = size - 1 if end is None else end
+        return b"".join(
+            decrypt_segments(
+                self.key,
+                self.nonce_prefix,
+                self.SEGMENT_SIZE,
+                size,
+                [ciphertext],
+                start,
+                end,
+            )
+        )
+
+    def sealed(self, index):
+        return self.ciphertext[
+            sealed_offset(index, self.SEGMENT_SIZE) : sealed_offset(
+                index + 1, self.SEGMENT_SIZE
+            )
+        ]
+
+    def test_round_trip(self):
+        self.assertEqual(
+            len(self.ciphertext), ciphertext_size(len(self.data), self.SEGMENT_SIZE)
+        )
+        self.assertEqual(self.decrypt(self.ciphertext), self.data)
+
+    def test_range_from_a_middle_segment(self):
+        offset = sealed_offset(1, self.SEGMENT_SIZE)
+        self.assertEqual(
+            self.decrypt(self.ciphertext[offset:], start=20, end=40), self.data[20:41]
+        )
+
+    def test_tampering_fails(self):
+        tampered = bytearray(self.ciphertext)
+        tampered[sealed_offset(1, self.SEGMENT_SIZE) + 3] ^= 1
+        with self.assertRaises(ValueError):
+            self.decrypt(bytes(tampered))
+
+    def test_truncation_fails(self):
+        with self.assertRaises(ValueError):
+            self.decrypt(self.ciphertext[:-1])
+        # Dropping whole segments fails too: none of them was sealed as last
+        kept = sealed_offset(2, self.SEGMENT_SIZE)
+        with self.assertRaises(ValueError):
+            self.decrypt(self.ciphertext[:kept], size=2 * self.SEGMENT_SIZE)
+
+    def test_reordering_fails(self):
+        reordered = self.sealed(1) + self.sealed(0) + self.sealed(2) + self.sealed(3)
+        self.assertEqual(len(reordered), len(self.ciphertext))
+        with self.assertRaises(ValueError):
+            self.decrypt(reordered)
+
+
+class CryptoEngineTests(SimpleTestCase):
+    """Both AES-GCM engines agree, and batches can move to the process pool."""
+
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.nonce = os.urandom(12)
+        self.data = os.urandom(1000)
+
+    def test_engines_are_interchangeable(self):
+        sealed = {
+            name: engine.seal(self.key, self.nonce, self.data, b"aad")
+            for name, engine in ENGINES.items()
+        }
+        self.assertEqual(len(set(sealed.values())), 1)
+        ciphertext = sealed["cryptography"]
+        tampered = bytearray(ciphertext)
+        tampered[0] ^= 1
+        for engine in ENGINES.values():
+            self.assertEqual(
+                engine.open(self.key, self.nonce, ciphertext, b"aad"), self.data
+            )
+            with self.assertRaises(ValueError):
+                engine.open(self.key, self.nonce, bytes(tampered), b"aad")
+            with self.assertRaises(ValueError):
+                engine.open(self.key, self.nonce, ciphertext, b"other")
+
+    def test_setting_selects_the_engine(self):
+        for name in ENGINES:
+            with self.subTest(engine=name), override_settings(CRYPTO_ENGINE=name):
+                self.assertEqual(get_crypto_engine().name, name)
+                self.assertEqual(SegmentEncryptor().engine_name, name)
+        with override_settings(CRYPTO_ENGINE="rot13"):
+            with self.assertRaises(KeyError):
+                get_crypto_engine()
+
+    def round_trip(self, data):
+        encryptor = SegmentEncryptor(segment_size=64)
+        ciphertext = encryptor.update(data) + encryptor.finalize()
+        return b"".join(
+            decrypt_segments(
+                encryptor.key,
+                encryptor.nonce_prefix,
+                64,
+                len(data),
+                [ciphertext],
+                0,
+                len(data) - 1,
+            )
+        )
+
+    def test_process_pool(self):
+        _process_pool.cache_clear()
+        self.addCleanup(_process_pool.cache_clear)
+        with override_settings(
+            CRYPTO_PROCESS_POOL_WORKERS=1, CRYPTO_OFFLOAD_THRESHOLD=512
+        ):
+            # Below the threshold everything stays inline
+            self.assertEqual(self.round_trip(self.data[:100]), self.data[:100])
+            self.assertEqual(_process_pool.cache_info().currsize, 0)
+
+            self.assertEqual(self.round_trip(self.data), self.data)
+            self.assertEqual(_process_pool.cache_info().currsize, 1)
+            self.addCleanup(_process_pool().shutdown)
+
+
+def download(client, file, byte_range=None):
+    headers = {"HTTP_RANGE": byte_range} if byte_range else {}
+    response = client.get(f"/api/v1/files/{file.id}/decrypt/", **headers)
+    if response.streaming:
+        response.body = b"".join(response.streaming_content)
+    return response
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS)
+class RangeDownloadTests(TestCase):
+    """Downloads of segmented files answer single byte ranges."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = os.urandom(200000)
+        response = self.client.post(
+            "/api/v1/upload/",
+            {"files": SimpleUploadedFile("photo.jpg", self.data)},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.file = File.objects.get(pk=response.data[0]["id"])
+
+    def download(self, byte_range=None):
+        return download(self.client, self.file, byte_range)
+
+    def test_whole_file(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response.body, self.data)
+
+    def test_range(self):
+        response = self.download("bytes=10-20")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-20/200000")
+        self.assertEqual(response.body, self.data[10:21])
+
+    def test_range_across_segments(self):
+        start = SEGMENT_SIZE - 5
+        response = self.download(f"bytes={start}-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Length"], str(len(self.data) - start))
+        self.assertEqual(response.body, self.data[start:])
+
+    def test_suffix_range(self):
+        response = self.download("bytes=-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 199995-199999/200000")
+        self.assertEqual(response.body, self.data[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.download("bytes=200000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */200000")
+
+    def test_tampered_blob_is_rejected(self):
+        storage = get_blob_storage()
+        blob = bytearray(storage.read(self.file.public_id))
+        blob[100] ^= 1
+        storage.blobs[self.file.public_id] = bytes(blob)
+        response = self.download()
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS)
+class DownloadAccessTests(TestCase):
+    """Only the owner and share recipients can download a file or its ETag."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.recipient = User.objects.create_user("recipient", "r@example.com", "pw")
+        self.stranger = User.objects.create_user("stranger", "s@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.data = os.urandom(5000)
+        response = self.client.post(
+            "/api/v1/upload/",
+            {"files": SimpleUploadedFile("photo.jpg", self.data)},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.file = File.objects.get(pk=response.data[0]["id"])
+        SharedFile.objects.create(file=self.file, shared_with=self.recipient)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_owner_and_recipient_can_download(self):
+        for user in (self.owner, self.recipient):
+            response = download(self.client_for(user), self.file)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.body, self.data)
+
+    def test_other_users_get_404(self):
+        etag = download(self.client, self.file)["ETag"]
+        response = self.client_for(self.stranger).get(
+            f"/api/v1/files/{self.file.id}/decrypt/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn("ETag", response)
+
+    def test_unchanged_file_is_not_modified(self):
+        etag = download(self.client, self.file)["ETag"]
+        response = self.client.get(
+            f"/api/v1/files/{self.file.id}/decrypt/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_etag_changes_with_the_content(self):
+        etag = download(self.client, self.file)["ETag"]
+        # Store the blob again under a new id, as encrypting it again would
+        storage = get_blob_storage()
+        public_id, _ = storage.save(
+            io.BytesIO(storage.read(self.file.public_id)), "user"
+        )
+        File.objects.filter(pk=self.file.pk).update(public_id=public_id)
+
+        response = self.client.get(
+            f"/api/v1/files/{self.file.id}/decrypt/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS)
+class UploadSessionTests(TestCase):
+    """Resumable uploads take chunks in any order and never reseal a chunk."""
+
+    def setUp(self):
+        patcher = mock.patch(
+            "file_management.views.UPLOAD_SESSION_CHUNK_SIZE", 2 * SEGMENT_SIZE
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = os.urandom(5 * SEGMENT_SIZE + 100)
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {"file_name": "video.mp4", "file_size": len(self.data)},
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["chunk_count"], 3)
+        self.url = f"/api/v1/uploads/{response.data['id']}/"
+
+    def chunk(self, index):
+        size = 2 * SEGMENT_SIZE
+        return self.data[index * size : (index + 1) * size]
+
+    def put(self, index, data=None):
+        return self.client.put(
+            f"{self.url}chunks/{index}/",
+            self.chunk(index) if data is None else data,
+            content_type="application/octet-stream",
+        )
+
+    def stored_chunk(self, index):
+        return UploadChunk.objects.get(session_id=self.url.split("/")[-2], index=index)
+
+    def test_complete_in_any_order(self):
+        for index in (2, 0, 1):
+            self.assertEqual(self.put(index).status_code, 200)
+        self.assertEqual(self.client.get(self.url).data["received_chunks"], [0, 1, 2])
+        parts = list(UploadChunk.objects.values_list("public_id", flat=True))
+
+        response = self.client.post(f"{self.url}complete/")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertFalse(UploadSession.objects.exists())
+        # The chunk blobs are queued once the file row is committed
+        self.assertCountEqual(
+            PendingBlobDeletion.objects.values_list("public_id", flat=True), parts
+        )
+        download = self.client.get(f"/api/v1/files/{response.data['id']}/decrypt/")
+        self.assertEqual(b"".join(download.streaming_content), self.data)
+
+    def test_missing_chunks(self):
+        self.put(1)
+        response = self.client.post(f"{self.url}complete/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["missing"], [0, 2])
+
+    def test_wrong_chunk_length(self):
+        response = self.put(0, self.chunk(0)[:-1])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UploadChunk.objects.exists())
+
+    def test_retry_with_same_content(self):
+        self.assertEqual(self.put(0).status_code, 200)
+        public_id = self.stored_chunk(0).public_id
+        self.assertEqual(self.put(0).status_code, 200)
+        self.assertEqual(self.stored_chunk(0).public_id, public_id)
+
+    def test_retry_with_other_content_is_rejected(self):
+        self.assertEqual(self.put(0).status_code, 200)
+        chunk = self.stored_chunk(0)
+        response = self.put(0, os.urandom(len(self.chunk(0))))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stored_chunk(0).public_id, chunk.public_id)
+        self.assertEqual(self.stored_chunk(0).tag, chunk.tag)
+
+    def test_retry_after_failed_store(self):
+        with mock.patch.object(
+            InMemoryBlobStorage, "save", side_effect=BlobStorageError("down")
+        ), self.assertLogs("file_management.views", "ERROR"):
+            self.assertEqual(self.put(0).status_code, 500)
+        self.assertEqual(self.client.get(self.url).data["received_chunks"], [])
+        # The nonces were claimed by the first content
+        self.assertEqual(self.put(0, os.urandom(len(self.chunk(0)))).status_code, 409)
+        self.assertEqual(self.put(0).status_code, 200)
+        self.assertEqual(self.client.get(self.url).data["received_chunks"], [0])
+
+
+    def put_all(self):
+        for index in range(3):
+            self.assertEqual(self.put(index).status_code, 200)
+
+    def test_completion_in_progress(self):
+        self.put_all()
+        UploadSession.objects.update(completing_at=timezone.now())
+        response = self.client.post(f"{self.url}complete/")
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(File.objects.exists())
+
+    def test_concurrent_completion_keeps_one_file(self):
+        self.put_all()
+        concat = InMemoryBlobStorage.concat
+
+        def concat_while_another_request_claims(storage, *args):
+            # The claim expired and another request took the session over
+            UploadSession.objects.update(completing_at=timezone.now())
+            return concat(storage, *args)
+
+        with mock.patch.object(
+            InMemoryBlobStorage, "concat", concat_while_another_request_claims
+        ):
+            response = self.client.post(f"{self.url}complete/")
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(File.objects.exists())
+        # Only the joined blob of the losing request is given back
+        self.assertEqual(PendingBlobDeletion.objects.count(), 1)
+        self.assertEqual(
+            self.client.get(self.url).data["received_chunks"], [0, 1, 2]
+        )
+
+    def test_quota_is_checked_on_completion(self):
+        self.put_all()
+        with self.settings(USER_STORAGE_QUOTA=len(self.data) + 10):
+            # Another upload of the user finished in the meantime
+            self.client.post(
+                "/api/v1/upload/",
+                {"files": SimpleUploadedFile("other.bin", b"x" * 20)},
+                format="multipart",
+            )
+            response = self.client.post(f"{self.url}complete/")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(File.objects.count(), 1)
+        self.assertIsNone(UploadSession.objects.get().completing_at)
+
+
+class UploadHandlerTests(SimpleTestCase):
+    """The upload handler keeps only a chunk or so of any file in memory."""
+
+    CHUNKS = 24
+
+    def test_memory_stays_bounded(self):
+        handler = EncryptingUploadHandler()
+        chunk = os.urandom(handler.chunk_size)
+        handler.new_file("files", "backup.bin", "application/octet-stream", None)
+
+        # Only what the handler allocates is traced, the parser owns the chunks
+        tracemalloc.start()
+        try:
+            for index in range(self.CHUNKS):
+                handler.receive_data_chunk(chunk, index * len(chunk))
+            uploaded = handler.file_complete(self.CHUNKS * len(chunk))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.addCleanup(uploaded.close)
+
+        # A 24 MB upload never holds much more than its 1 MB chunks
+        self.assertLess(peak, 4 * len(chunk))
+        self.assertEqual(uploaded.size, self.CHUNKS * len(chunk))
+        plaintext = hashlib.sha256()
+        for part in decrypt_segments(
+            uploaded.key,
+            uploaded.nonce_prefix,
+            uploaded.segment_size,
+            uploaded.size,
+            iter(functools.partial(uploaded.file.read, len(chunk)), b""),
+            0,
+            uploaded.size - 1,
+        ):
+            plaintext.update(part)
+        self.assertEqual(plaintext.hexdigest(), uploaded.content_hash)
+        self.assertEqual(
+            uploaded.content_hash, hashlib.sha256(chunk * self.CHUNKS).hexdigest()
+        )
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS)
+class UploadRequestTests(TestCase):
+    """Files of one request are stored on their own unless rollback is asked for."""
+
+    LIMIT = 1024 * 1024 + 100
+
+    def setUp(self):
+        patcher = mock.patch("file_management.views.FILE_SIZE_LIMIT", self.LIMIT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.blobs_before = set(InMemoryBlobStorage.blobs)
+
+    def upload(self, *files, **data):
+        return self.client.post(
+            "/api/v1/upload/",
+            {
+                "files": [SimpleUploadedFile(name, content) for name, content in files],
+                **data,
+            },
+            format="multipart",
+        )
+
+    def new_blobs(self):
+        return set(InMemoryBlobStorage.blobs) - self.blobs_before
+
+    def test_partial_success(self):
+        response = self.upload(
+            ("small.bin", os.urandom(100)), ("large.bin", os.urandom(self.LIMIT + 1))
+        )
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(len(response.data["uploaded"]), 1)
+        self.assertEqual(response.data["errors"][0]["file"], "large.bin")
+        self.assertEqual(File.objects.get().file_name, "small")
+        self.assertEqual(self.new_blobs(), {File.objects.get().public_id})
+
+    def test_rollback_stores_nothing(self):
+        response = self.upload(
+            ("small.bin", os.urandom(100)),
+            ("large.bin", os.urandom(self.LIMIT + 1)),
+            rollback="true",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.new_blobs(), set())
+
+    def test_rollback_after_storage_failure(self):
+        save = InMemoryBlobStorage.save
+        calls = []
+
+        def fail_the_second_save(storage, content, folder):
+            calls.append(folder)
+            if len(calls) == 2:
+                raise BlobStorageError("down")
+            return save(storage, content, folder)
+
+        with mock.patch.object(
+            InMemoryBlobStorage, "save", fail_the_second_save
+        ), self.assertLogs("file_management.views", "ERROR"):
+            response = self.upload(
+                ("one.bin", os.urandom(100)),
+                ("two.bin", os.urandom(100)),
+                rollback="true",
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(File.objects.exists())
+        # The blob that was stored is given back
+        self.assertCountEqual(
+            PendingBlobDeletion.objects.values_list("public_id", flat=True),
+            self.new_blobs(),
+        )
+        self.assertEqual(len(self.new_blobs()), 1)
+
+    def test_large_files_are_not_encrypted_past_the_limit(self):
+        update = SegmentEncryptor.update
+        encrypted = []
+
+        def count(encryptor, data):
+            encrypted.append(len(data))
+            return update(encryptor, data)
+
+        with mock.patch.object(SegmentEncryptor, "update", count):
+            response = self.upload(("large.bin", os.urandom(3 * 1024 * 1024)))
+        self.assertEqual(response.status_code, 400)
+        # Only the parser chunk that stayed below the limit was encrypted
+        self.assertLessEqual(sum(encrypted), self.LIMIT)
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS, FILE_DEDUP_SCOPE="user")
+class DeduplicationTests(TestCase):
+    """Uploads of stored content share its blob until the last copy is gone."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.data = os.urandom(1000)
+
+    def upload(self, *names, data=None):
+        response = self.client.post(
+            "/api/v1/upload/",
+            {
+                "files": [
+                    SimpleUploadedFile(name, self.data if data is None else data)
+                    for name in names
+                ]
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return [File.objects.get(pk=file["id"]) for file in response.data]
+
+    def delete(self, file):
+        response = self.client.delete(
+            f"/api/v1/files/{file.id}/delete/?permanent=true"
+        )
+        self.assertEqual(response.status_code, 204)
+
+    def references(self, file):
+        return ContentBlob.objects.get(public_id=file.public_id).ref_count
+
+    def test_repeated_uploads_share_a_blob(self):
+        first, copy = self.upload("a.jpg", "b.jpg")
+        (later,) = self.upload("c.jpg")
+        self.assertEqual(first.public_id, copy.public_id)
+        self.assertEqual(first.public_id, later.public_id)
+        self.assertEqual(self.references(first), 3)
+
+        self.delete(first)
+        self.delete(copy)
+        self.assertEqual(self.references(later), 1)
+        self.assertFalse(PendingBlobDeletion.objects.exists())
+
+        # The last copy releases the blob
+        self.delete(later)
+        self.assertFalse(ContentBlob.objects.exists())
+        self.assertEqual(
+            list(PendingBlobDeletion.objects.values_list("public_id", flat=True)),
+            [later.public_id],
+        )
+
+    def test_other_content_gets_its_own_blob(self):
+        (first,) = self.upload("a.jpg")
+        (other,) = self.upload("a.jpg", data=os.urandom(1000))
+        self.assertNotEqual(first.public_id, other.public_id)
+        self.assertEqual(self.references(first), 1)
+
+    def test_other_users_do_not_share(self):
+        (first,) = self.upload("a.jpg")
+        self.client.force_authenticate(User.objects.create_user("other"))
+        (other,) = self.upload("a.jpg")
+        self.assertNotEqual(first.public_id, other.public_id)
+
+    @override_settings(FILE_DEDUP_SCOPE="off")
+    def test_disabled(self):
+        first, copy = self.upload("a.jpg", "b.jpg")
+        self.assertNotEqual(first.public_id, copy.public_id)
+        self.assertEqual(self.references(first), 1)
+        self.assertEqual(self.references(copy), 1)
+
+
+@override_settings(
+    BLOB_STORAGES=IN_MEMORY_BLOBS,
+    FILE_COMPRESSION="zlib",
+    FILE_COMPRESSION_TYPES="text",
+    FILE_DEDUP_SCOPE="off",
+)
+class CompressionTests(TestCase):
+    """Only text is compressed, and only when it gets smaller."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, data):
+        response = self.client.post(
+            "/api/v1/upload/",
+            {"files": SimpleUploadedFile(name, data)},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return File.objects.get(pk=response.data[0]["id"])
+
+    def test_text_is_compressed(self):
+        data = b"date,amount\n" + b"2024-01-01,100\n" * 20000
+        file = self.upload("report.csv", data)
+        self.assertEqual(file.compression, "zlib")
+        self.assertLess(file.stored_size, len(data) // 10)
+
+        response = download(self.client, file)
+        self.assertEqual(response["Accept-Ranges"], "none")
+        self.assertEqual(response.body, data)
+        # A compressed file is sent whole
+        response = download(self.client, file, "bytes=10-20")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, data)
+
+    def test_text_that_does_not_shrink_is_stored_as_is(self):
+        data = os.urandom(200000)
+        file = self.upload("random.txt", data)
+        self.assertEqual(file.compression, "")
+        self.assertEqual(file.stored_size, len(data))
+        self.assertEqual(download(self.client, file).body, data)
+
+    def test_other_types_keep_ranges(self):
+        data = os.urandom(200000)
+        for name in ("blob.bin", "image.png", "paper.pdf"):
+            file = self.upload(name, data)
+            self.assertEqual(file.compression, "")
+            response = download(self.client, file, "bytes=10-20")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.body, data[10:21])
+
+    def test_only_the_stored_stream_is_encrypted(self):
+        update = SegmentEncryptor.update
+        encrypted = []
+
+        def count(encryptor, data):
+            encrypted.append(len(data))
+            return update(encryptor, data)
+
+        data = b"date,amount\n" + b"2024-01-01,100\n" * 250000
+        with mock.patch.object(SegmentEncryptor, "update", count):
+            file = self.upload("large.csv", data)
+        self.assertGreater(len(data), 3 * 1024 * 1024)
+        self.assertEqual(file.compression, "zlib")
+        self.assertEqual(sum(encrypted), file.stored_size)
+        self.assertEqual(download(self.client, file).body, data)
+
+    @override_settings(FILE_COMPRESSION_TYPES="all")
+    def test_all_types(self):
+        data = b"\x00" * 200000
+        self.assertEqual(self.upload("blob.bin", data).compression, "zlib")
+        self.assertEqual(self.upload("image.png", data).compression, "")
+
+
+class BlobStorageTests(SimpleTestCase):
+    """The local and in-memory backends and how aliases resolve to them."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backends = [
+            LocalBlobStorage(location=directory.name),
+            InMemoryBlobStorage(),
+        ]
+        self.data = os.urandom(3 * STREAM_CHUNK_SIZE // 2)
+
+    def test_save_read_and_stream(self):
+        for storage in self.backends:
+            with self.subTest(storage=type(storage).__name__):
+                public_id, url = storage.save(io.BytesIO(self.data), "user_1")
+                self.assertTrue(public_id.startswith("user_1/"))
+                self.assertTrue(url.endswith(public_id))
+                self.assertTrue(storage.exists(public_id))
+                self.assertEqual(storage.read(public_id), self.data)
+                chunks = list(storage.stream(public_id))
+                self.assertEqual(len(chunks), 2)
+                self.assertEqual(b"".join(chunks), self.data)
+                self.assertEqual(
+                    b"".join(storage.stream(public_id, 10, STREAM_CHUNK_SIZE + 9)),
+                    self.data[10 : STREAM_CHUNK_SIZE + 10],
+                )
+
+    def test_concat(self):
+        for storage in self.backends:
+            with self.subTest(storage=type(storage).__name__):
+                parts = [
+                    storage.save(io.BytesIO(part), "parts")[0]
+                    for part in (b"first ", b"second ", b"third")
+                ]
+                public_id, _ = storage.concat(parts, "user_1")
+                self.assertEqual(storage.read(public_id), b"first second third")
+                self.assertTrue(all(storage.exists(part) for part in parts))
+
+    def test_delete(self):
+        for storage in self.backends:
+            with self.subTest(storage=type(storage).__name__):
+                kept, removed = (
+                    storage.save(io.BytesIO(b"blob"), "user_1")[0] for _ in range(2)
+                )
+                self.assertTrue(storage.delete(removed))
+                self.assertFalse(storage.delete(removed))
+                self.assertFalse(storage.exists(removed))
+                with self.assertRaises(BlobStorageError):
+                    storage.read(removed)
+                self.assertEqual(
+                    storage.delete_many([kept, removed]), {kept, removed}
+                )
+                self.assertFalse(storage.exists(kept))
+
+    def test_local_ids_stay_inside_the_location(self):
+        with self.assertRaises(BlobStorageError):
+            self.backends[0].read("../outside")
+
+    def test_aliases(self):
+        with override_settings(
+            BLOB_STORAGES={
+                "default": {"BACKEND": "file_management.storage.InMemoryBlobStorage"},
+                "pictures": {
+                    "BACKEND": "file_management.storage.LocalBlobStorage",
+                    "OPTIONS": {"location": "/tmp/pictures"},
+                },
+            }
+        ):
+            self.assertIsInstance(get_blob_storage(), InMemoryBlobStorage)
+            self.assertIs(get_blob_storage(), get_blob_storage("default"))
+            pictures = get_blob_storage("pictures")
+            self.assertIsInstance(pictures, LocalBlobStorage)
+            self.assertEqual(pictures.location, "/tmp/pictures")
+            with self.assertRaises(KeyError):
+                get_blob_storage("missing")
+        # Instances are rebuilt once the setting changes
+        self.assertIsNot(get_blob_storage("default"), pictures)
+        self.assertNotIsInstance(get_blob_storage(), InMemoryBlobStorage)
+
+
+class BlobCacheTests(SimpleTestCase):
+    """The blob cache is a size bounded LRU whose index survives crashes."""
+
+    def setUp(self):
+        location = tempfile.TemporaryDirectory()
+        self.addCleanup(location.cleanup)
+        self.cache = BlobCache(location.name, max_size=250)
+        # Strictly increasing access times
+        clock = mock.patch("file_management.blob_cache.time.time")
+        clock.start().side_effect = itertools.count(1)
+        self.addCleanup(clock.stop)
+
+    def fill(self, public_id, data):
+        self.assertEqual(b"".join(self.cache.fill(public_id, [data])), data)
+
+    def read(self, public_id):
+        blob = self.cache.open(public_id)
+        if blob is None:
+            return None
+        with blob:
+            return blob.read()
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.read("a"))
+        self.fill("a", b"x" * 100)
+        self.assertEqual(self.read("a"), b"x" * 100)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual((stats["entries"], stats["size"]), (1, 100))
+
+    def test_least_recently_used_is_evicted(self):
+        self.fill("a", b"a" * 100)
+        self.fill("b", b"b" * 100)
+        self.read("a")
+        self.fill("c", b"c" * 100)
+        self.assertIsNone(self.read("b"))
+        self.assertEqual(self.read("a"), b"a" * 100)
+        self.assertEqual(self.read("c"), b"c" * 100)
+        stats = self.cache.stats()
+        self.assertEqual((stats["evictions"], stats["size"]), (1, 200))
+
+    def test_blobs_over_the_bound_are_not_cached(self):
+        self.fill("a", b"a" * 100)
+        self.fill("large", b"x" * 300)
+        self.assertIsNone(self.read("large"))
+        self.assertEqual(self.read("a"), b"a" * 100)
+
+    def test_abandoned_fill_leaves_nothing(self):
+        chunks = self.cache.fill("a", [b"a" * 10, b"a" * 10])
+        next(chunks)
+        chunks.close()
+        self.assertIsNone(self.read("a"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_file_without_index_entry(self):
+        # A process died between writing the file and indexing it
+        self.fill("a", b"a" * 100)
+        self.cache._db().execute("DELETE FROM entries")
+        self.assertIsNone(self.read("a"))
+        self.assertFalse(os.path.exists(self.cache._path(self.cache._key("a"))))
+
+    def test_index_entry_without_file(self):
+        # A process died between removing the file and its index entry
+        self.fill("a", b"a" * 100)
+        os.remove(self.cache._path(self.cache._key("a")))
+        self.assertIsNone(self.read("a"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_storage_fills_on_whole_reads_only(self):
+        inner = {"BACKEND": "file_management.storage.InMemoryBlobStorage"}
+        storage = CachedBlobStorage(inner, self.cache.location, max_size=250)
+        public_id, _ = storage.save(io.BytesIO(b"0123456789"), "cache-test")
+        self.addCleanup(storage.storage.delete, public_id)
+
+        self.assertEqual(b"".join(storage.stream(public_id, 2, 4)), b"234")
+        self.assertIsNone(self.read(public_id))
+        self.assertEqual(b"".join(storage.stream(public_id)), b"0123456789")
+        storage.storage.delete(public_id)
+        # Served from the cache once the whole blob was read
+        self.assertEqual(b"".join(storage.stream(public_id, 2, 4)), b"234")
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS)
+class BatchDeleteTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.recipient = User.objects.create_user("recipient", "r@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.files = [
+            File.objects.create(
+                user=self.owner,
+                file_name=f"report_{index}",
+                public_id=f"blob-{index}",
+                file_type="pdf",
+                key="k",
+                nonce="n",
+                tag="t",
+                file_size=100,
+            )
+            for index in range(5)
+        ]
+        for file in self.files:
+            SharedFile.objects.create(file=file, shared_with=self.recipient)
+            LinkShare.objects.create(file=file, share_link=f"link-{file.id}")
+
+    def test_permanent_delete_is_one_statement(self):
+        ids = [file.id for file in self.files[:4]]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/v1/files/batch-delete/",
+                {"ids": ids + [999], "permanent": True},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"deleted": ids, "not_found": [999]})
+
+        file_deletes = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('DELETE FROM "file_management_file"')
+        ]
+        self.assertEqual(len(file_deletes), 1)
+        self.assertEqual(
+            list(File.all_objects.values_list("id", flat=True)), [self.files[4].id]
+        )
+        self.assertEqual(SharedFile.objects.count(), 1)
+        self.assertEqual(LinkShare.objects.count(), 1)
+        self.assertCountEqual(
+            PendingBlobDeletion.objects.values_list("public_id", flat=True),
+            [file.public_id for file in self.files[:4]],
+        )
+
+    def test_other_users_files_are_not_found(self):
+        self.client.force_authenticate(self.recipient)
+        response = self.client.post(
+            "/api/v1/files/batch-delete/",
+            {"ids": [self.files[0].id], "permanent": True},
+            format="json",
+        )
+        self.assertEqual(response.data["not_found"], [self.files[0].id])
+        self.assertEqual(File.all_objects.count(), 5)
+
+
+    def test_trashed_file_can_be_deleted_for_good(self):
+        file = self.files[0]
+        self.client.delete(f"/api/v1/files/{file.id}/delete/")
+        response = self.client.delete(f"/api/v1/files/{file.id}/delete/?permanent=1")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(File.all_objects.filter(pk=file.pk).exists())
+
+    def test_blobs_are_deleted_outside_the_claiming_transaction(self):
+        self.client.post(
+            "/api/v1/files/batch-delete/",
+            {"ids": [file.id for file in self.files], "permanent": True},
+            format="json",
+        )
+        storage = get_blob_storage()
+        seen = []
+
+        def delete_many(public_ids):
+            # The batch is already claimed: a second worker finds nothing
+            seen.append(process_blob_deletions())
+            self.assertTrue(
+                all(
+                    pending.attempts == 1 and pending.claimed_until
+                    for pending in PendingBlobDeletion.objects.all()
+                )
+            )
+            return set(public_ids[:3])
+
+        with mock.patch.object(storage, "delete_many", side_effect=delete_many):
+            self.assertEqual(process_blob_deletions(), (3, 2))
+        self.assertEqual(seen, [(0, 0)])
+        # The failures are released for the next run
+        left = PendingBlobDeletion.objects.all()
+        self.assertEqual(len(left), 2)
+        self.assertTrue(all(pending.claimed_until is None for pending in left))
+        self.assertTrue(all(pending.last_error for pending in left))
+
+
+@override_settings(BLOB_STORAGES=IN_MEMORY_BLOBS, RESPONSE_CACHE_TTL=0)
+class TrashTests(TestCase):
+    """Deleted files wait in the trash until they are restored or purged."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.file = File.objects.create(
+            user=self.user,
+            file_name="report",
+            public_id="blob-1",
+            file_type="pdf",
+            key="k",
+            nonce="n",
+            tag="t",
+            file_size=100,
+        )
+
+    def listed(self, url):
+        return [file["id"] for file in self.client.get(url).data["results"]]
+
+    def total_size(self):
+        return self.client.post("/api/v1/get-tot-file-size/").data["total_size"]
+
+    def trash(self):
+        response = self.client.delete(f"/api/v1/files/{self.file.id}/delete/")
+        self.assertEqual(response.status_code, 204)
+
+    def test_trash_and_restore(self):
+        self.trash()
+        self.assertEqual(self.listed("/api/v1/files/"), [])
+        self.assertEqual(self.listed("/api/v1/files/trash/"), [self.file.id])
+        self.assertEqual(self.total_size(), 0)
+        self.assertFalse(PendingBlobDeletion.objects.exists())
+
+        response = self.client.post(f"/api/v1/files/{self.file.id}/restore/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.listed("/api/v1/files/"), [self.file.id])
+        self.assertEqual(self.listed("/api/v1/files/trash/"), [])
+        self.assertEqual(self.total_size(), 100)
+
+    def test_restore_needs_a_trashed_file(self):
+        response = self.client.post(f"/api/v1/files/{self.file.id}/restore/")
+        self.assertEqual(response.status_code, 404)
+        self.trash()
+        self.client.force_authenticate(User.objects.create_user("other"))
+        response = self.client.post(f"/api/v1/files/{self.file.id}/restore/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_purge_after_retention(self):
+        self.trash()
+        call_command("purge_trash", days=30, stdout=io.StringIO())
+        self.assertTrue(File.all_objects.filter(pk=self.file.pk).exists())
+
+        File.all_objects.filter(pk=self.file.pk).update(
+            trashed_at=timezone.now() - timedelta(days=31)
+        )
+        call_command("purge_trash", days=30, stdout=io.StringIO())
+        self.assertFalse(File.all_objects.filter(pk=self.file.pk).exists())
+        self.assertEqual(
+            list(PendingBlobDeletion.objects.values_list("public_id", flat=True)),
+            ["blob-1"],
+        )
+
+
+@override_settings(
+    BLOB_STORAGES=IN_MEMORY_BLOBS, RESPONSE_CACHE_TTL=0, FILE_DEDUP_SCOPE="user"
+)
+class StorageUsageTests(TestCase):
+    """The usage counters follow uploads, the trash and permanent deletes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, data, client=None):
+        return (client or self.client).post(
+            "/api/v1/upload/",
+            {"files": SimpleUploadedFile(name, data)},
+            format="multipart",
+        )
+
+    def usage(self, user=None):
+        usage = StorageUsage.objects.get(user=user or self.user)
+        return usage.bytes, usage.file_count
+
+    def test_counters(self):
+        data = os.urandom(1000)
+        first = self.upload("a.bin", data).data[0]["id"]
+        self.assertEqual(self.usage(), (1000, 1))
+        # A second copy of the same blob counts as a file but not in bytes
+        second = self.upload("b.bin", data).data[0]["id"]
+        self.assertEqual(self.usage(), (1000, 2))
+
+        self.client.delete(f"/api/v1/files/{first}/delete/")
+        self.assertEqual(self.usage(), (1000, 1))
+        self.client.delete(f"/api/v1/files/{second}/delete/")
+        self.assertEqual(self.usage(), (0, 0))
+        self.client.post(f"/api/v1/files/{first}/restore/")
+        self.assertEqual(self.usage(), (1000, 1))
+
+        # Purging the trash leaves the usage as it is
+        self.client.delete(f"/api/v1/files/{second}/delete/?permanent=1")
+        self.assertEqual(self.usage(), (1000, 1))
+        self.client.delete(f"/api/v1/files/{first}/delete/?permanent=1")
+        self.assertEqual(self.usage(), (0, 0))
+
+    def test_first_row_includes_the_change(self):
+        self.assertFalse(StorageUsage.objects.exists())
+        self.upload("a.bin", os.urandom(1000))
+        self.assertEqual(self.usage(), (1000, 1))
+
+    def test_reconcile_repairs_drift(self):
+        self.upload("a.bin", os.urandom(1000))
+        StorageUsage.objects.update(bytes=5, file_count=7)
+        call_command("reconcile_storage_usage", stdout=io.StringIO())
+        self.assertEqual(self.usage(), (1000, 1))
+
+    @override_settings(USER_STORAGE_QUOTA=1500)
+    def test_reused_blobs_count_against_the_quota(self):
+        data = os.urandom(1000)
+        first = self.upload("a.bin", data)
+        # A copy of a blob the user holds is free
+        second = self.upload("b.bin", data)
+        self.assertEqual(second.status_code, 201)
+        # Once it is only in the trash, a new copy would count again
+        for response in (first, second):
+            self.client.delete(f"/api/v1/files/{response.data[0]['id']}/delete/")
+        self.upload("c.bin", os.urandom(1000))
+        self.assertEqual(self.upload("d.bin", data).status_code, 413)
+
+    @override_settings(USER_STORAGE_QUOTA=1500, FILE_DEDUP_SCOPE="global")
+    def test_other_users_blobs_count_against_the_quota(self):
+        data = os.urandom(1000)
+        self.upload("a.bin", data)
+        other = User.objects.create_user("other", "other@example.com", "pw")
+        client = APIClient()
+        client.force_authenticate(other)
+        response = self.upload("b.bin", os.urandom(1000), client)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.upload("c.bin", data, client).status_code, 413)
+        self.assertEqual(self.usage(other), (1000, 1))
+
+
+class SearchTests(TestCase):
+    """Search only finds the user's own and shared files outside the trash."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.other = User.objects.create_user("other", "other@example.com", "pw")
+        self.files = {}
+        for owner, name, file_type in [
+            (self.user, "budget", "pdf"),
+            (self.user, "budget 2024", "xlsx"),
+            (self.user, "old budget", "pdf"),
+            (self.user, "holiday", "jpg"),
+            (self.other, "budget shared", "pdf"),
+            (self.other, "budget private", "pdf"),
+        ]:
+            self.files[name] = File.objects.create(
+                user=owner,
+                file_name=name,
+                file_type=file_type,
+                public_id=f"blob-{name}",
+                key="k",
+                nonce="n",
+                tag="t",
+                file_size=100,
+            )
+        SharedFile.objects.create(
+            file=self.files["budget shared"], shared_with=self.user
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get("/api/v1/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def names(self, data):
+        return [file["file_name"] for file in data["files"]]
+
+    def test_own_and_shared_files_only(self):
+        data = self.search(q="budget")
+        self.assertCountEqual(
+            self.names(data),
+            ["budget", "budget 2024", "old budget", "budget shared"],
+        )
+        shared = {file["file_name"]: file["shared"] for file in data["files"]}
+        self.assertTrue(shared["budget shared"])
+        self.assertFalse(shared["budget"])
+
+    def test_best_match_first(self):
+        self.assertEqual(self.names(self.search(q="budget"))[0], "budget")
+
+    def test_trash_is_excluded(self):
+        File.objects.filter(
+            pk__in=[self.files["old budget"].pk, self.files["budget shared"].pk]
+        ).update(trashed_at=timezone.now())
+        data = self.search(q="budget")
+        self.assertCountEqual(self.names(data), ["budget", "budget 2024"])
+        self.assertEqual(data["facets"]["file_type"], {"pdf": 1, "xlsx": 1})
+
+    def test_facets_ignore_the_file_type_filter(self):
+        data = self.search(q="budget", file_type="xlsx")
+        self.assertEqual(self.names(data), ["budget 2024"])
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(data["facets"]["file_type"], {"pdf": 3, "xlsx": 1})
+
+    def test_pages(self):
+        data = self.search(q="budget", page=2, page_size=3)
+        self.assertEqual(len(data["files"]), 1)
+        self.assertEqual(data["count"], 4)
+
+    def test_empty_query(self):
+        data = self.search(q=" ")
+        self.assertEqual(data["files"], [])
+        self.assertEqual(data["facets"]["file_type"], {})
+
+
+class UploadStatsTests(TestCase):
+    """The statistics endpoints read the rollups, rollup_uploads fills them."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "owner@example.com", "pw")
+        File.objects.bulk_create(
+            File(
+                user=self.user,
+                file_name=f"report_{index}",
+                file_type="pdf",
+                key="k",
+                nonce="n",
+                tag="t",
+                file_size=100,
+            )
+            for index in range(3)
+        )
+        # Past the lag refresh_rollups leaves for uploads still committing
+        File.objects.update(upload_date=timezone.now() - timedelta(hours=1))
+        self.client = APIClient()
+
+    def test_reads_do_not_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/upload-per-month/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(
+            [query for query in queries if not query["sql"].startswith("SELECT")]
+        )
+        # Uploads not rolled up yet are counted from the file table
+        self.assertEqual(response.data[0]["total_uploads"], 3)
+        self.assertFalse(UploadRollup.objects.exists())
+
+    def test_months_are_datetimes(self):
+        response = self.client.get("/api/v1/upload-per-month/")
+        month = File.objects.first().upload_date.strftime("%Y-%m-01T00:00:00Z")
+        self.assertEqual(
+            response.json(), [{"month": month, "total_uploads": 3, "total_bytes": 300}]
+        )
+
+    def test_uploads_after_the_last_refresh_count(self):
+        call_command("rollup_uploads", stdout=io.StringIO())
+        File.objects.create(
+            user=self.user,
+            file_name="new",
+            file_type="txt",
+            key="k",
+            nonce="n",
+            tag="t",
+        )
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get("/api/v1/files-count/").data["file_count"], 4)
+        self.assertEqual(
+            self.client.get("/api/v1/get-files/").data, {"pdf": 3, "txt": 1}
+        )
+
+    def test_command_refreshes(self):
+        call_command("rollup_uploads", stdout=io.StringIO())
+        self.client.force_authenticate(self.user)
+        response = self.client.get("/api/v1/files-count/")
+        self.assertEqual(response.data, {"file_count": 3})
+        response = self.client.get("/api/v1/upload-per-month/")
+        self.assertEqual(response.data[0]["total_uploads"], 3)
+        self.assertEqual(response.data[0]["total_bytes"], 300)
+
+
+@override_settings(
+    BLOB_STORAGES=IN_MEMORY_BLOBS,
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "responses": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "responses",
+        },
+    },
+    RESPONSE_CACHE_TTL=300,
+)
+class ResponseCacheTests(TestCase):
+    """Cached lists are invalidated by every change to them."""
+
+    def setUp(self):
+        caches["responses"].clear()
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.recipient = User.objects.create_user("recipient", "r@example.com", "pw")
+        self.owner_client = APIClient()
+        self.owner_client.force_authenticate(self.owner)
+        self.recipient_client = APIClient()
+        self.recipient_client.force_authenticate(self.recipient)
+        self.file = self.upload("report.jpg")
+
+    def upload(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.owner_client.post(
+                "/api/v1/upload/",
+                {"files": SimpleUploadedFile(name, os.urandom(1000))},
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        return File.objects.get(pk=response.data[0]["id"])
+
+    def change(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.owner_client, method)(url, data, format="json")
+        self.assertLess(response.status_code, 300, response.data)
+
+    def owner_files(self):
+        response = self.owner_client.get("/api/v1/files/")
+        return [file["id"] for file in response.data["results"]]
+
+    def shared_by_owner(self):
+        response = self.owner_client.get("/api/v1/files/shared-by-the-user/")
+        return [file["id"] for file in response.data["results"]]
+
+    def shared_with_recipient(self):
+        response = self.recipient_client.get("/api/v1/files/shared/")
+        return [file["file_id"] for file in response.data["results"]]
+
+    def total_size(self):
+        return self.owner_client.post("/api/v1/get-tot-file-size/").data["total_size"]
+
+    def share(self):
+        self.change(
+            "post",
+            "/api/v1/files/share/",
+            {"file_id": self.file.id, "username": "recipient"},
+        )
+
+    def test_repeated_reads_are_cached(self):
+        self.owner_files()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.owner_files(), [self.file.id])
+
+    def test_posts_are_not_cached(self):
+        self.assertEqual(self.total_size(), 1000)
+        StorageUsage.objects.filter(user=self.owner).update(bytes=1234)
+        self.assertEqual(self.total_size(), 1234)
+
+    def test_default_cache_is_not_used(self):
+        self.owner_files()
+        self.assertIsNone(cache.get(f"response_cache:version:{self.owner.id}"))
+        self.assertIsNotNone(
+            caches["responses"].get(f"response_cache:version:{self.owner.id}")
+        )
+
+    def test_upload(self):
+        self.assertEqual(self.owner_files(), [self.file.id])
+        self.assertEqual(self.total_size(), 1000)
+        other = self.upload("other.jpg")
+        self.assertEqual(self.owner_files(), [other.id, self.file.id])
+        self.assertEqual(self.total_size(), 2000)
+
+    def test_share_and_unshare(self):
+        self.assertEqual(self.shared_by_owner(), [])
+        self.assertEqual(self.shared_with_recipient(), [])
+        self.share()
+        self.assertEqual(self.shared_by_owner(), [self.file.id])
+        self.assertEqual(self.shared_with_recipient(), [self.file.id])
+        self.change("delete", f"/api/v1/files/shared/delete/{self.file.id}/")
+        self.assertEqual(self.shared_by_owner(), [])
+        self.assertEqual(self.shared_with_recipient(), [])
+
+    def test_trash_and_restore(self):
+        self.share()
+        self.assertEqual(self.owner_files(), [self.file.id])
+        self.assertEqual(self.shared_with_recipient(), [self.file.id])
+        self.assertEqual(self.total_size(), 1000)
+
+        self.change("delete", f"/api/v1/files/{self.file.id}/delete/")
+        self.assertEqual(self.owner_files(), [])
+        self.assertEqual(self.total_size(), 0)
+
+        self.change("post", f"/api/v1/files/{self.file.id}/restore/")
+        self.assertEqual(self.owner_files(), [self.file.id])
+        self.assertEqual(self.total_size(), 1000)
+
+    def test_permanent_delete(self):
+        self.share()
+        self.assertEqual(self.shared_by_owner(), [self.file.id])
+        self.assertEqual(self.shared_with_recipient(), [self.file.id])
+        self.change(
+            "post",
+            "/api/v1/files/batch-delete/",
+            {"ids": [self.file.id], "permanent": True},
+        )
+        self.assertEqual(self.owner_files(), [])
+        self.assertEqual(self.shared_by_owner(), [])
+        self.assertEqual(self.shared_with_recipient(), [])
+
+    def test_etag_changes_with_the_list(self):
+        response = self.owner_client.get("/api/v1/files/")
+        etag = response["ETag"]
+        response = self.owner_client.get("/api/v1/files/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.upload("other.jpg")
+        response = self.owner_client.get("/api/v1/files/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
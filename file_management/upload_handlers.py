@@ -0,0 +1,180 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .compression import codec_for
+from .crypto import SegmentEncryptor
+
+logger = logging.getLogger(__name__)
+
+
+class EncryptedUploadedFile(UploadedFile):
+    """
+    An uploaded file whose content was encrypted while the request body was
+    being parsed. The wrapped temporary file holds ciphertext in the
+    segmented format; ``size`` is the size of the original (plaintext) upload
+    and ``content_hash`` its SHA-256. When the upload was compressed before
+    encryption, ``compression`` names the codec and ``stored_size`` is the
+    size of the compressed data.
+    """
+
+    def __init__(
+        self,
+        file,
+        name,
+        content_type,
+        size,
+        charset,
+        content_type_extra,
+        key,
+        nonce_prefix,
+        last_tag,
+        segment_size,
+        content_hash,
+        compression,
+        stored_size,
+    ):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.key = key
+        self.nonce_prefix = nonce_prefix
+        self.last_tag = last_tag
+        self.segment_size = segment_size
+        self.content_hash = content_hash
+        self.compression = compression
+        self.stored_size = stored_size
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # The temporary file was already moved or deleted.
+            pass
+
+
+class EncryptingUploadHandler(FileUploadHandler):
+    """
+    Encrypt every uploaded file with AES-256-GCM as MultiPartParser hands over
+    its chunks, spooling only ciphertext to a temporary file. The SHA-256 of
+    the plaintext is computed in the same pass, and compressible file types
+    are compressed before they are encrypted when their first chunk gets
+    smaller. Memory use per
+    file is bounded by the parser's chunk size plus one segment instead of
+    the file size.
+
+    Files over ``max_file_size`` are dropped as soon as they grow past it:
+    the rest of their data is read but neither encrypted nor spooled, and
+    they are returned as an empty UploadedFile that still has their full
+    ``size``, so the view can report them.
+    """
+
+    # Large enough for a batch of segments to be worth offloading, see
+    # file_management/crypto.py
+    chunk_size = 1024 * 1024
+
+    def __init__(self, request=None, max_file_size=None):
+        super().__init__(request)
+        self.max_file_size = max_file_size
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.too_large = False
+        self.encryptor = SegmentEncryptor()
+        self.hasher = hashlib.sha256()
+        file_type = os.path.splitext(self.file_name)[1].lower().replace(".", "")
+        self.codec = codec_for(file_type)
+        self.compressor = None
+        self.compressed_size = 0
+        self.compress_time = 0.0
+        self.file = tempfile.NamedTemporaryFile(
+            suffix=".upload.enc", dir=settings.FILE_UPLOAD_TEMP_DIR
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.too_large:
+            return
+        if self.max_file_size is not None and self.received > self.max_file_size:
+            self.too_large = True
+            self.upload_interrupted()
+            return
+        self.hasher.update(raw_data)
+        if self.codec and start == 0:
+            # Only one stream is encrypted, so whether to compress is decided
+            # up front: by compressing the first chunk on its own
+            started = time.perf_counter()
+            probe = self.codec.compressor()
+            probe_size = len(probe.compress(raw_data)) + len(probe.flush())
+            if probe_size < len(raw_data):
+                self.compressor = self.codec.compressor()
+            self.compress_time += time.perf_counter() - started
+        if self.compressor:
+            started = time.perf_counter()
+            raw_data = self.compressor.compress(raw_data)
+            self.compress_time += time.perf_counter() - started
+            self.compressed_size += len(raw_data)
+        self.file.write(self.encryptor.update(raw_data))
+        # Returning None keeps the plaintext away from any later handlers
+
+    def file_complete(self, file_size):
+        if self.too_large:
+            return UploadedFile(
+                file=io.BytesIO(),
+                name=self.file_name,
+                content_type=self.content_type,
+                size=file_size,
+                charset=self.charset,
+                content_type_extra=self.content_type_extra,
+            )
+        compression, stored_size = "", file_size
+        if self.compressor:
+            tail = self.compressor.flush()
+            self.compressed_size += len(tail)
+            self.file.write(self.encryptor.update(tail))
+            compression, stored_size = self.codec.name, self.compressed_size
+        if self.codec:
+            logger.debug(
+                "Compressed %s with %s: %d -> %d bytes in %.1f ms",
+                self.file_name,
+                compression or "nothing",
+                file_size,
+                stored_size,
+                self.compress_time * 1000,
+            )
+        self.file.write(self.encryptor.finalize())
+        self.file.flush()
+        self.file.seek(0)
+        return EncryptedUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+            key=self.encryptor.key,
+            nonce_prefix=self.encryptor.nonce_prefix,
+            last_tag=self.encryptor.last_tag,
+            segment_size=self.encryptor.segment_size,
+            content_hash=self.hasher.hexdigest(),
+            compression=compression,
+            stored_size=stored_size,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            temp_location = self.file.name
+            try:
+                self.file.close()
+                os.remove(temp_location)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,144 @@
+"""
+Per-user storage usage. Files enter a user's usage when they are uploaded
+or restored and leave it when they are trashed or deleted. Every change
+updates the user's StorageUsage row with F() expressions, so reading the
+total or checking the quota is a single-row lookup instead of an aggregate
+over the file table.
+
+Bytes are counted per stored blob: copies of a deduplicated blob a user
+holds count once, and files in the trash do not count. This differs from
+the original get_tot_size, which summed file_size over every file row, so
+the total_size users see, and what the quota is checked against, is lower
+for users with repeated uploads. file_count still counts every copy.
+
+A blob counts for every user holding a copy of it. Reusing a blob from an
+earlier upload, or another user's with FILE_DEDUP_SCOPE="global", is
+checked against the quota like new content unless the user already holds
+an active copy.
+"""
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import File, StorageUsage
+
+
+def compute_usage(user_ids):
+    """
+    Aggregate the actual ``(bytes, file_count)`` of each user in
+    ``user_ids`` from the file table.
+    """
+    usage = {user_id: (0, 0) for user_id in user_ids}
+    blobs = (
+        File.objects.filter(user_id__in=user_ids)
+        .values("user_id", "public_id")
+        .annotate(blob_size=Max("file_size"), copies=Count("id"))
+        .values_list("user_id", "blob_size", "copies")
+    )
+    for user_id, blob_size, copies in blobs:
+        total, count = usage[user_id]
+        usage[user_id] = (total + (blob_size or 0), count + copies)
+    return usage
+
+
+def create_usage(user_id):
+    """
+    Return ``(usage, created)`` for the StorageUsage row of ``user_id``,
+    computing the row from the file table if it does not exist yet.
+    """
+    with transaction.atomic():
+        total, count = compute_usage([user_id])[user_id]
+        return StorageUsage.objects.get_or_create(
+            user_id=user_id, defaults={"bytes": total, "file_count": count}
+        )
+
+
+def get_usage(user):
+    """
+    Return the StorageUsage of ``user``, computing it from the file table
+    the first time it is asked for.
+    """
+    usage = StorageUsage.objects.filter(user=user).first()
+    if usage is None:
+        usage, _ = create_usage(user.id)
+    return usage
+
+
+def quota_exceeded(user, incoming):
+    """Whether storing ``incoming`` more bytes would take ``user`` over quota."""
+    quota = settings.USER_STORAGE_QUOTA
+    return bool(quota) and get_usage(user).bytes + incoming > quota
+
+
+def reused_bytes(user, sizes):
+    """
+    Bytes that new copies of existing blobs would add to ``user``'s usage.
+    ``sizes`` maps the blobs' public ids to their sizes; blobs the user
+    already holds an active copy of are free.
+    """
+    held = set(
+        File.objects.filter(user=user, public_id__in=sizes).values_list(
+            "public_id", flat=True
+        )
+    )
+    return sum(size for public_id, size in sizes.items() if public_id not in held)
+
+
+def files_added(files):
+    """Count ``files``, File rows that just became active, in their users' usage."""
+    _apply(files, 1)
+
+
+def files_removed(files):
+    """Take ``files``, File rows that just left the active set, out of their users' usage."""
+    _apply(files, -1)
+
+
+def _apply(files, sign):
+    files = list(files)
+    if not files:
+        return
+
+    # Compare each blob's copies before and after the change: its bytes are
+    # added with a user's first copy and removed with their last one
+    changed = Counter((file.user_id, file.public_id) for file in files)
+    sizes = {(file.user_id, file.public_id): file.file_size or 0 for file in files}
+    copies = File.objects.filter(
+        user_id__in={user_id for user_id, _ in changed},
+        public_id__in={public_id for _, public_id in changed},
+    )
+    active = {
+        (user_id, public_id): count
+        for user_id, public_id, count in copies.values("user_id", "public_id")
+        .annotate(count=Count("id"))
+        .values_list("user_id", "public_id", "count")
+    }
+
+    deltas = {}
+    for key, count in changed.items():
+        after = active.get(key, 0)
+        before = after - sign * count
+        total, files_delta = deltas.get(key[0], (0, 0))
+        if (before == 0) != (after == 0):
+            total += sign * sizes[key]
+        deltas[key[0]] = (total, files_delta + sign * count)
+
+    now = timezone.now()
+    for user_id, (total, count) in deltas.items():
+        changes = {
+            "bytes": F("bytes") + total,
+            "file_count": F("file_count") + count,
+            "updated_at": now,
+        }
+        if StorageUsage.objects.filter(user_id=user_id).update(**changes):
+            continue
+        # The user's first row is computed from the file table, which
+        # already holds this change. A row another request created first
+        # does not.
+        _, created = create_usage(user_id)
+        if not created:
+            StorageUsage.objects.filter(user_id=user_id).update(**changes)
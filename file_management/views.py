@@ -6,37 +6,105 @@ from rest_framework import status
 from .validations import *
 from rest_framework.parsers import MultiPartParser, FormParser
 import os
-import cloudinary.uploader
-from cloudinary import api
-from cloudinary.exceptions import NotFound
-from Crypto.Cipher import AES
-from Crypto.Random import get_random_bytes
 import base64
-from django.http import FileResponse
-import io
+import hashlib
+import itertools
+import logging
+import tempfile
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
 import uuid
+from django.conf import settings
 from django.utils import timezone
 import mimetypes
-from django.db.models import Sum
+from django.db import connection
+from django.db.models import Exists, Min, OuterRef, Q
+from django.contrib.postgres.aggregates import ArrayAgg
 from django.shortcuts import get_object_or_404
 from .models import *
-from django.db.models import Count
-from django.db.models.functions import TruncMonth
+from .upload_handlers import EncryptingUploadHandler
+from .storage import BlobStorageError, get_blob_storage
+from .compression import decompress_chunks
+from .blob_cache import CachedBlobStorage
+from .dedup import acquire_duplicate, register_blob, release_blobs
+from .deletion import delete_files, queue_blob_deletions, trash_files
+from .usage import files_added, get_usage, quota_exceeded, reused_bytes
+from .search import file_type_facets, search
+from .response_cache import (
+    bump_file_versions,
+    bump_versions,
+    cache_per_user,
+    content_etag,
+    not_modified,
+    set_etag,
+)
+from .rollups import rollup_params, upload_series, uploads_by_type
+from api.instrumentation import timed, timed_iterator
+from api.pagination import KeysetPagination
+from .crypto import (
+    SEGMENT_SIZE,
+    SegmentEncryptor,
+    ciphertext_size,
+    decrypt_segments,
+    decrypt_single,
+    new_key,
+    new_nonce_prefix,
+    sealed_offset,
+)
+
+logger = logging.getLogger(__name__)
 
 # (10 MB)
 FILE_SIZE_LIMIT = 10 * 1024 * 1024  # 10 MB
+# Larger files go through upload sessions, one chunk per request
+UPLOAD_SESSION_SIZE_LIMIT = 5 * 1024 * 1024 * 1024  # 5 GB
+UPLOAD_SESSION_CHUNK_SIZE = 128 * SEGMENT_SIZE  # 8 MB
+# A completion claim older than this was left by a worker that died
+UPLOAD_SESSION_COMPLETE_TIMEOUT = timedelta(hours=1)
+# Files of one upload request are sent to the blob storage in parallel
+FILE_UPLOAD_WORKERS = 4
+BATCH_DELETE_LIMIT = 1000
 
 
 @api_view(["GET"])
+@permission_classes([IsAuthenticated])
 def search_files(request):
-    query = request.GET.get("q", "")  # Get the search query from the request
+    query = request.GET.get("q", "").strip()  # Get the search query from the request
+    file_type = request.GET.get("file_type")
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+        page_size = min(max(int(request.GET.get("page_size", 20)), 1), 100)
+    except ValueError:
+        return Response(
+            {"error": "page and page_size must be numbers."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
     if query:
-        # Filter files by file_name
-        files = File.objects.filter(file_name__icontains=query)
+        # Only files the user owns or that were shared with them, best first
+        files = search(request.user, query)
     else:
         files = File.objects.none()  # Return no files if no query is provided
 
+    # Facets describe every match, before narrowing down to one file type
+    facets = file_type_facets(files)
+    if file_type:
+        files = files.filter(file_type=file_type)
+    count = facets.get(file_type, 0) if file_type else sum(facets.values())
+    page_files = files.only(
+        "id",
+        "user",
+        "file_name",
+        "file_url",
+        "public_id",
+        "upload_date",
+        "file_type",
+        "file_size",
+    )[(page - 1) * page_size : page * page_size]
+
     # Manually create a response structure without the extra 'model' and 'pk' fields
     files_data = [
         {
@@ -47,12 +115,22 @@ def search_files(request):
             "upload_date": file.upload_date,
             "file_type": file.file_type,
             "file_size": file.file_size,
+            "shared": file.user_id != request.user.id,
         }
-        for file in files
+        for file in page_files
     ]
 
     # Return the response with a status code of 200
-    return Response({"files": files_data}, status=200)
+    return Response(
+        {
+            "files": files_data,
+            "count": count,
+            "page": page,
+            "page_size": page_size,
+            "facets": {"file_type": facets},
+        },
+        status=200,
+    )
 
 
 # GET ALL FILES FOR ADMIN
@@ -60,15 +138,19 @@ def search_files(request):
 @permission_classes([IsAuthenticated])
 def get_files(request):
     try:
-        # Fetch all files and annotate with the count of each file type
-        file_counts = (
-            File.objects.values("file_type")
-            .annotate(count=Count("file_type"))
-            .order_by("-count")  # Sort by count in descending order
-        )[:5]
+        _, start, end = rollup_params(request.query_params)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+    try:
+        # Count the uploads of each file type from the daily rollups
+        file_counts = [
+            (file_type, count)
+            for file_type, count in uploads_by_type(start, end).most_common()
+            if count > 0
+        ][:5]
 
         # Prepare the response format
-        result = {file["file_type"]: file["count"] for file in file_counts}
+        result = dict(file_counts)
 
         return Response(result, status=200)
     except Exception as e:
@@ -79,18 +161,21 @@ def get_files(request):
 @permission_classes([AllowAny])
 def count_upload(request):
     try:
-        # Group by month and count the number of uploads for each month
-        monthly_uploads = (
-            File.objects.annotate(month=TruncMonth("upload_date"))
-            .values("month")
-            .annotate(count=Count("id"))
-            .order_by("month")
-        )
+        granularity, start, end = rollup_params(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    try:
+        # Group the daily rollups by day, week or month
+        uploads = upload_series(granularity, start, end)
 
         # Format the result as a list of dictionaries
         result = [
-            {"month": entry["month"], "total_uploads": entry["count"]}
-            for entry in monthly_uploads
+            {
+                granularity: entry["period"],
+                "total_uploads": entry["total_uploads"],
+                "total_bytes": entry["total_bytes"],
+            }
+            for entry in uploads
         ]
 
         return Response(result, status=200)
@@ -101,9 +186,13 @@ def count_upload(request):
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def count_file(request):
+    try:
+        _, start, end = rollup_params(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     try:
         print("Attempting to count files in the database.")  # Debug line
-        file_count = File.objects.aggregate(count=Count("id"))["count"]
+        file_count = sum(uploads_by_type(start, end).values())
         print(f"File count: {file_count}")  # Debug line
         return Response({"file_count": file_count}, status=200)
     except Exception as e:
@@ -115,53 +204,175 @@ def count_file(request):
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def get_tot_size(request):
-    user = request.user
-    total_size = (
-        File.objects.filter(user=user).aggregate(Sum("file_size"))["file_size__sum"]
-        or 0
+    # Maintained as files come and go, see file_management/usage.py
+    usage = get_usage(request.user)
+    return Response(
+        {
+            "total_size": usage.bytes,
+            "file_count": usage.file_count,
+            "quota": settings.USER_STORAGE_QUOTA or None,
+        }
     )
-    return Response({"total_size": total_size})
 
 
-# Encryption function for AES
-def encrypt_file(file_data):
-    key = get_random_bytes(32)  # AES-256 requires a 32-byte key
-    cipher = AES.new(key, AES.MODE_GCM)
-    nonce = cipher.nonce
-    ciphertext, tag = cipher.encrypt_and_digest(file_data)
-    return key, nonce, ciphertext, tag
+# Rows not yet handled by the migrate_ciphertext command still carry the
+# ciphertext inline, every other row is read from the blob storage
+def read_ciphertext(file_instance):
+    if file_instance.ciphertext:
+        return base64.b64decode(file_instance.ciphertext)
+    with timed("storage"):
+        return get_blob_storage().read(file_instance.public_id)
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Return the inclusive ``(start, end)`` of a single ``bytes=`` range, or
+    None when the whole file should be sent.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start = size - int(last)
+            end = size - 1
+    except ValueError:
+        return None
+    if start < 0 and size:
+        start = 0
+    if start > end or start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def sealed_size(file_instance):
+    # Compressed files seal fewer bytes than the original file holds
+    if file_instance.stored_size is None:
+        return file_instance.file_size
+    return file_instance.stored_size
+
+
+def iter_segmented_plaintext(file_instance, key, nonce, start, end):
+    # Fetch and decrypt only the segments that overlap the requested range
+    segment_size = file_instance.segment_size
+    size = sealed_size(file_instance)
+    if end < start:
+        return iter(())
+    ciphertext_start = sealed_offset(start // segment_size, segment_size)
+    ciphertext_end = sealed_offset(end // segment_size + 1, segment_size) - 1
+    if ciphertext_end >= ciphertext_size(size, segment_size) - 1:
+        # Up to the end of the blob. Read from its start, that is the whole
+        # blob, which the blob cache keeps; other reads do not fill it.
+        ciphertext_end = None
+    chunks = timed_iterator(
+        "storage",
+        get_blob_storage().stream(
+            file_instance.public_id, ciphertext_start, ciphertext_end
+        ),
+    )
+    return decrypt_segments(key, nonce, segment_size, size, chunks, start, end)
 
 
 # Decryption function for AES
-@api_view(["POST"])
+@api_view(["GET", "POST"])
 @permission_classes([IsAuthenticated])
 def decrypt_file(request, pk):
     try:
-        # Retrive the file instance
-        file_instance = File.objects.get(pk=pk)
+        # Retrive the file instance, including the legacy ciphertext column.
+        # Only its owner and the users it is shared with may read it, which
+        # is checked before the ETag so it cannot reveal other files.
+        shared_with_user = SharedFile.objects.filter(
+            file=OuterRef("pk"), shared_with=request.user
+        )
+        file_instance = (
+            File.objects.defer(None)
+            .filter(Q(user=request.user) | Exists(shared_with_user))
+            .get(pk=pk)
+        )
+
+        # The browser already has this content, skip decrypting it again
+        etag = content_etag(file_instance)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return not_modified(etag)
+
         # Extract the encryption components
         key = base64.b64decode(file_instance.key)
         nonce = base64.b64decode(file_instance.nonce)
-        ciphertext = base64.b64decode(file_instance.ciphertext)
-        tag = base64.b64decode(file_instance.tag)
 
-        # Create a new AES cipher object for decrpytion
-        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
-        decrypted_data = cipher.decrypt_and_verify(ciphertext, tag)
+        if file_instance.compression:
+            # A compressed stream can only be decoded from its start, so
+            # Range requests get the whole file
+            size = file_instance.file_size
+            byte_range = None
+            start, end = 0, size - 1
+            chunks = decompress_chunks(
+                file_instance.compression,
+                iter_segmented_plaintext(
+                    file_instance, key, nonce, 0, sealed_size(file_instance) - 1
+                ),
+            )
+        elif file_instance.segment_size:
+            size = file_instance.file_size
+            byte_range = parse_range_header(request.headers.get("Range"), size)
+            start, end = byte_range or (0, size - 1)
+            chunks = iter_segmented_plaintext(file_instance, key, nonce, start, end)
+        else:
+            # Single-blob files can only be verified as a whole
+            tag = base64.b64decode(file_instance.tag)
+            decrypted_data = decrypt_single(
+                key, nonce, read_ciphertext(file_instance), tag
+            )
+            size = len(decrypted_data)
+            byte_range = parse_range_header(request.headers.get("Range"), size)
+            start, end = byte_range or (0, size - 1)
+            chunks = iter([decrypted_data[start : end + 1]])
+
+        # Decrypt the first segment before answering so a broken file still
+        # gets an error response instead of a cut-off download
+        first_chunk = next(chunks, b"")
 
         # Determine the correct MIME type using the file_type field
         mime_type = mimetypes.types_map.get(
             f".{file_instance.file_type}", "application/octet-stream"
         )
-        # Prepare the decrypted data for download
-        response = FileResponse(io.BytesIO(decrypted_data), content_type=mime_type)
+        # Stream the decrypted data for download
+        response = StreamingHttpResponse(
+            itertools.chain([first_chunk], chunks),
+            content_type=mime_type,
+            status=(
+                status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK
+            ),
+        )
+        response["Content-Length"] = end - start + 1
+        set_etag(response, etag)
+        response["Accept-Ranges"] = "none" if file_instance.compression else "bytes"
+        if byte_range:
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
         response["Content-Disposition"] = (
             f'attachment; filename="{file_instance.file_name + "." + file_instance.file_type}"'
         )
-        print(file_instance.file_name)
         return response
     except File.DoesNotExist:
         return Response({"detail": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+    except RangeNotSatisfiable:
+        response = Response(
+            {"detail": "Requested range not satisfiable."},
+            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+        )
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+    except BlobStorageError as e:
+        return Response(
+            {"detail": f"Failed to fetch file from storage: {str(e)}"},
+            status=status.HTTP_502_BAD_GATEWAY,
+        )
     except ValueError as e:
         return Response(
             {"detail": f"Decryption failed: {str(e)}"},
@@ -174,11 +385,36 @@ def decrypt_file(request, pk):
         )
 
 
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def blob_cache_stats(request):
+    storage = get_blob_storage()
+    if not isinstance(storage, CachedBlobStorage):
+        return Response(
+            {"detail": "The blob cache is disabled."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    return Response(storage.cache.stats())
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@cache_per_user("file_list")
 def file_list_view(request):
-    files = File.objects.filter(user=request.user)
-    serializer = FileSerializer(files, many=True)
+    paginator = KeysetPagination(ordering=("-upload_date", "-id"))
+    files = paginator.paginate_queryset(
+        File.objects.filter(user=request.user).only(*FileListSerializer.Meta.fields),
+        request,
+    )
+    serializer = FileListSerializer(files, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def file_detail_view(request, pk):
+    file = get_object_or_404(File, pk=pk, user=request.user)
+    serializer = FileSerializer(file)
     return Response(serializer.data)
 
 
@@ -186,6 +422,13 @@ def file_list_view(request):
 @permission_classes([IsAuthenticated])
 @parser_classes([MultiPartParser, FormParser])
 def file_upload_view(request):
+    # Encrypt each file while the multipart body streams in, so only
+    # ciphertext is ever spooled (to disk) and sent to the blob storage.
+    # The files are encrypted one after the other as they arrive, and one
+    # that grows past the limit is no longer encrypted or spooled.
+    request.upload_handlers = [
+        EncryptingUploadHandler(request, max_file_size=FILE_SIZE_LIMIT)
+    ]
     files = request.FILES.getlist("files")
 
     if not files:
@@ -193,101 +436,475 @@ def file_upload_view(request):
             {"error": "No files uploaded."}, status=status.HTTP_400_BAD_REQUEST
         )
 
-    responses = []
+    # Roll back every stored file when any of them fails, instead of keeping
+    # the ones that succeeded
+    rollback = str(request.data.get("rollback", "")).lower() in ("1", "true", "yes")
+    storage = get_blob_storage()
+    storage_folder = f"user_{request.user.id}"
+
+    errors = []
+    accepted = []
     for file in files:
         # Check file size
         if file.size > FILE_SIZE_LIMIT:
-            return Response(
+            errors.append(
                 {
-                    "error": f"File '{file.name}' is too large. Maximum allowed size is 10 MB."
-                },
-                status=status.HTTP_400_BAD_REQUEST,
+                    "file": file.name,
+                    "error": f"File '{file.name}' is too large. Maximum allowed size is 10 MB.",
+                }
             )
+        else:
+            accepted.append(file)
+
+    # Content that is already stored reuses the existing blob and its
+    # encryption components, which takes a reference on that blob. Copies of
+    # the same content within this request are uploaded once.
+    dedup = settings.FILE_DEDUP_SCOPE != "off"
+    reused = {}
+    to_upload = {}
+    if not (rollback and errors):
+        for file in accepted:
+            if dedup and file.content_hash in to_upload:
+                continue
+            duplicate = acquire_duplicate(request.user, file.content_hash)
+            if duplicate is not None:
+                reused[file] = {
+                    "file_url": duplicate.file_url,
+                    "public_id": duplicate.public_id,
+                    "key": duplicate.key,
+                    "nonce": duplicate.nonce,
+                    "tag": duplicate.tag,
+                    "segment_size": duplicate.segment_size,
+                    "compression": duplicate.compression,
+                    "stored_size": duplicate.stored_size,
+                }
+            else:
+                to_upload[file.content_hash if dedup else file] = file
+
+    # New content counts against the quota, and so do reused blobs the user
+    # holds no copy of yet
+    incoming = sum(file.size for file in to_upload.values()) + reused_bytes(
+        request.user,
+        {blob_fields["public_id"]: file.size for file, blob_fields in reused.items()},
+    )
+    if incoming and quota_exceeded(request.user, incoming):
+        queue_blob_deletions(
+            release_blobs(blob_fields["public_id"] for blob_fields in reused.values())
+        )
+        return Response(
+            {"error": "Storage quota exceeded."},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
 
-        # Read and encrypt file content
-        file_data = file.read()
+    # The upload handler already encrypted every file while the body was
+    # parsed, so only the storage round trips are left and they can overlap
+    uploaded = {}
+    storage_failed = False
+    if to_upload:
+        with timed("storage"), ThreadPoolExecutor(
+            max_workers=min(FILE_UPLOAD_WORKERS, len(to_upload))
+        ) as executor:
+            futures = {
+                file: executor.submit(storage.save, file.file, storage_folder)
+                for file in to_upload.values()
+            }
+        for file, future in futures.items():
+            try:
+                public_id, file_url = future.result()
+            except Exception:
+                logger.exception("Failed to upload %s to storage", file.name)
+                storage_failed = True
+                continue
+            # Encryption components in Base64
+            uploaded[file] = {
+                "file_url": file_url,
+                "public_id": public_id,
+                "key": base64.b64encode(file.key).decode(),
+                "nonce": base64.b64encode(file.nonce_prefix).decode(),
+                "tag": base64.b64encode(file.last_tag).decode(),
+                "segment_size": file.segment_size,
+                "compression": file.compression,
+                "stored_size": file.stored_size,
+            }
 
-        # Encrypt the file
-        key, nonce, ciphertext, tag = encrypt_file(file_data)
-        cloudinary_folder = f"user_{request.user.id}"
+    serializers_to_save = []
+    for file in accepted:
+        if file in reused:
+            blob_fields = reused[file]
+        else:
+            leader = to_upload.get(file.content_hash if dedup else file)
+            if leader not in uploaded:
+                if leader is not None:
+                    errors.append(
+                        {"file": file.name, "error": "Failed to upload file."}
+                    )
+                continue
+            blob_fields = uploaded[leader]
 
         original_filename, _ = os.path.splitext(file.name)
         file_extension = os.path.splitext(file.name)[1].lower().replace(".", "")
-        upload_options = {
-            "folder": cloudinary_folder,
-            "resource_type": "raw",
-        }
 
-        try:
-            # Upload encrypted file to Cloudinary
-            upload_result = cloudinary.uploader.upload(ciphertext, **upload_options)
-            cloudinary_url = upload_result.get("secure_url")
-            public_id = upload_result.get("public_id")
-
-            # Encode encryption components in Base64
-            encoded_key = base64.b64encode(key).decode()
-            encoded_nonce = base64.b64encode(nonce).decode()
-            encoded_ciphertext = base64.b64encode(ciphertext).decode()
-            encoded_tag = base64.b64encode(tag).decode()
-
-            # Prepare data for serializer
-            serializer_data = {
+        serializer = FileSerializer(
+            data={
+                **blob_fields,
                 "file_name": original_filename,
-                "file_url": cloudinary_url,
-                "public_id": public_id,
                 "user": request.user.id,
-                "key": encoded_key,
-                "nonce": encoded_nonce,
-                "ciphertext": encoded_ciphertext,
-                "tag": encoded_tag,
                 "file_type": file_extension,
                 "file_size": file.size,
+                "content_hash": file.content_hash,
             }
+        )
+        if serializer.is_valid():
+            serializers_to_save.append((serializer, file))
+        else:
+            logger.error("Invalid file %s: %s", file.name, serializer.errors)
+            errors.append({"file": file.name, "error": serializer.errors})
 
-            # Create serializer
-            serializer = FileSerializer(data=serializer_data)
+    if rollback and errors:
+        serializers_to_save = []
 
-            if serializer.is_valid():
-                serializer.save()
-                responses.append(serializer.data)
-            else:
-                print("Serializer errors:", serializer.errors)  # Log errors if any
-        except Exception as e:
-            print(f"Failed to upload {file.name} to Cloudinary: {e}")
+    responses = []
+    references = {}
+    with transaction.atomic():
+        instances = []
+        for serializer, file in serializers_to_save:
+            instance = serializer.save()
+            instances.append(instance)
+            references.setdefault(instance.public_id, []).append(file)
+            responses.append(serializer.data)
+        files_added(instances)
+        bump_versions(*(instance.user_id for instance in instances))
+        for leader, blob_fields in uploaded.items():
+            if blob_fields["public_id"] in references:
+                register_blob(
+                    request.user,
+                    blob_fields["public_id"],
+                    leader.content_hash,
+                    len(references[blob_fields["public_id"]]),
+                )
+
+    # Give back what no saved row ended up using
+    queue_blob_deletions(
+        [
+            blob_fields["public_id"]
+            for blob_fields in uploaded.values()
+            if blob_fields["public_id"] not in references
+        ]
+        + release_blobs(
+            [
+                blob_fields["public_id"]
+                for file, blob_fields in reused.items()
+                if file not in references.get(blob_fields["public_id"], ())
+            ]
+        )
+    )
+
+    if responses and not errors:
+        return Response(responses, status=status.HTTP_201_CREATED)
+    if responses:
+        # Some files were stored and some were not
+        return Response(
+            {"uploaded": responses, "errors": errors},
+            status=status.HTTP_207_MULTI_STATUS,
+        )
+    return Response(
+        {"error": "Failed to upload files.", "errors": errors},
+        status=(
+            status.HTTP_500_INTERNAL_SERVER_ERROR
+            if storage_failed
+            else status.HTTP_400_BAD_REQUEST
+        ),
+    )
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def create_upload_session(request):
+    file_name = request.data.get("file_name", "")
+    try:
+        file_size = int(request.data.get("file_size"))
+    except (TypeError, ValueError):
+        return Response(
+            {"error": "file_size must be a number of bytes."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if not file_name:
+        return Response(
+            {"error": "File name cannot be empty."}, status=status.HTTP_400_BAD_REQUEST
+        )
+    if file_size < 0 or file_size > UPLOAD_SESSION_SIZE_LIMIT:
+        return Response(
+            {"error": f"File '{file_name}' is too large. Maximum allowed size is 5 GB."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if quota_exceeded(request.user, file_size):
+        return Response(
+            {"error": "Storage quota exceeded."},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    original_filename, file_extension = os.path.splitext(file_name)
+    session = UploadSession.objects.create(
+        user=request.user,
+        file_name=original_filename,
+        file_type=file_extension.lower().replace(".", "") or "unknown",
+        file_size=file_size,
+        chunk_size=UPLOAD_SESSION_CHUNK_SIZE,
+        segment_size=SEGMENT_SIZE,
+        key=base64.b64encode(new_key()).decode(),
+        nonce=base64.b64encode(new_nonce_prefix()).decode(),
+    )
+    return Response(
+        UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED
+    )
+
+
+@api_view(["GET", "DELETE"])
+@permission_classes([IsAuthenticated])
+def upload_session_detail(request, session_id):
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+
+    if request.method == "GET":
+        # Lets a client find out which chunks still have to be sent
+        return Response(UploadSessionSerializer(session).data)
+
+    # Abort the upload and release the chunks stored so far
+    with transaction.atomic():
+        queue_blob_deletions(
+            session.chunks.exclude(public_id="").values_list("public_id", flat=True)
+        )
+        session.delete()
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(["PUT"])
+@permission_classes([IsAuthenticated])
+def upload_chunk(request, session_id, index):
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+
+    if index >= session.chunk_count:
+        return Response(
+            {"error": f"Chunk index must be below {session.chunk_count}."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    expected_length = session.chunk_length(index)
+    is_last = index == session.chunk_count - 1
+
+    # The nonces of a chunk are fixed by its index, so sealing different
+    # bytes under them again would reuse (key, nonce) pairs. A chunk is
+    # claimed with the hash of its content before it is stored, and later
+    # PUTs of the same index must send the same content.
+    claimed = UploadChunk.objects.filter(session=session, index=index).first()
+    stored = claimed is not None and bool(claimed.public_id)
+
+    # Chunk i holds segments i * (chunk_size / segment_size) onwards
+    encryptor = SegmentEncryptor(
+        key=base64.b64decode(session.key),
+        nonce_prefix=base64.b64decode(session.nonce),
+        segment_size=session.segment_size,
+        first_index=index * (session.chunk_size // session.segment_size),
+    )
+    hasher = hashlib.sha256()
+    storage = get_blob_storage()
+    stream = request.stream
+
+    with tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as ciphertext:
+        # Read the raw body a batch of segments at a time instead of
+        # buffering it
+        received = 0
+        while stream is not None:
+            data = stream.read(16 * session.segment_size)
+            if not data:
+                break
+            received += len(data)
+            if received > expected_length:
+                break
+            hasher.update(data)
+            if not stored:
+                ciphertext.write(encryptor.update(data))
+
+        if received != expected_length:
+            return Response(
+                {"error": f"Chunk {index} must be exactly {expected_length} bytes."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        content_hash = hasher.hexdigest()
+        if claimed is None:
+            try:
+                with transaction.atomic():
+                    claimed = UploadChunk.objects.create(
+                        session=session, index=index, content_hash=content_hash
+                    )
+            except IntegrityError:
+                # Another request claimed the chunk in the meantime
+                claimed = UploadChunk.objects.get(session=session, index=index)
+                stored = bool(claimed.public_id)
+        if claimed.content_hash != content_hash:
+            return Response(
+                {"error": f"Chunk {index} was already sent with different content."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if stored:
+            # A retry of a chunk that made it to the storage
             return Response(
-                {"error": "Failed to upload files."},
+                {"index": index, "size": received}, status=status.HTTP_200_OK
+            )
+
+        # The same content sealed under the same nonces gives the same
+        # ciphertext, so a retry after a failed store is safe
+        ciphertext.write(encryptor.finalize(is_last=is_last))
+        ciphertext.seek(0)
+        try:
+            with timed("storage"):
+                public_id, _ = storage.save(
+                    ciphertext, f"user_{request.user.id}/uploads/{session.id}"
+                )
+        except Exception:
+            logger.exception("Failed to store chunk %s of %s", index, session.id)
+            return Response(
+                {"error": "Failed to store chunk."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-    if responses:
-        return Response(responses, status=status.HTTP_201_CREATED)
+    updated = UploadChunk.objects.filter(pk=claimed.pk, public_id="").update(
+        public_id=public_id, tag=base64.b64encode(encryptor.last_tag).decode()
+    )
+    if not updated:
+        # A concurrent retry stored the same chunk first
+        queue_blob_deletions([public_id])
+    session.save(update_fields=["updated_at"])
 
-    return Response(
-        {"error": "Files were invalid."}, status=status.HTTP_400_BAD_REQUEST
+    return Response({"index": index, "size": received}, status=status.HTTP_200_OK)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def complete_upload_session(request, session_id):
+    session = get_object_or_404(UploadSession, id=session_id, user=request.user)
+    chunks = list(session.chunks.exclude(public_id="").order_by("index"))
+
+    missing = sorted(
+        set(range(session.chunk_count)) - {chunk.index for chunk in chunks}
     )
+    if missing:
+        return Response(
+            {"error": "Some chunks have not been uploaded.", "missing": missing},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if quota_exceeded(request.user, session.file_size):
+        return Response(
+            {"error": "Storage quota exceeded."},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    # Claim the session so a second request does not join the chunks into
+    # another file at the same time
+    claimed_at = timezone.now()
+    claimed = (
+        UploadSession.objects.filter(pk=session.pk)
+        .filter(
+            Q(completing_at__isnull=True)
+            | Q(completing_at__lt=claimed_at - UPLOAD_SESSION_COMPLETE_TIMEOUT)
+        )
+        .update(completing_at=claimed_at)
+    )
+    if not claimed:
+        return Response(
+            {"error": "The upload is already being completed."},
+            status=status.HTTP_409_CONFLICT,
+        )
 
+    def release_claim():
+        UploadSession.objects.filter(pk=session.pk, completing_at=claimed_at).update(
+            completing_at=None
+        )
 
-def check_resource_exists(public_id):
+    parts = [chunk.public_id for chunk in chunks]
     try:
-        # Attempt to retrieve the resource information from Cloudinary
-        resource_info = api.resource(public_id, resource_type="raw")
-        return resource_info
-    except NotFound:
-        # If the resource does not exist, print a message and return None
-        print("Resource not found.")
-        return None
-    except Exception as e:
-        # Handle other potential exceptions and log the error
-        print(f"Error checking resource: {str(e)}")
-        return None
+        # Join the encrypted chunks into one blob in the segmented format
+        with timed("storage"):
+            public_id, file_url = get_blob_storage().concat(
+                parts, f"user_{request.user.id}"
+            )
+    except Exception:
+        logger.exception("Failed to join the chunks of upload %s", session.id)
+        release_claim()
+        return Response(
+            {"error": "Failed to upload files."},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+
+    serializer = FileSerializer(
+        data={
+            "file_name": session.file_name,
+            "file_url": file_url,
+            "public_id": public_id,
+            "user": request.user.id,
+            "key": session.key,
+            "nonce": session.nonce,
+            "tag": chunks[-1].tag,
+            "file_type": session.file_type,
+            "file_size": session.file_size,
+            "segment_size": session.segment_size,
+        }
+    )
+    if not serializer.is_valid():
+        logger.error("Invalid file for upload %s: %s", session.id, serializer.errors)
+        release_claim()
+        queue_blob_deletions([public_id])
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    error = None
+    try:
+        with transaction.atomic():
+            still_claimed = (
+                UploadSession.objects.select_for_update()
+                .filter(pk=session.pk, completing_at=claimed_at)
+                .exists()
+            )
+            # Parallel sessions of one user are checked against the quota
+            # one after the other
+            StorageUsage.objects.select_for_update().filter(user=request.user).first()
+            if not still_claimed:
+                error = Response(
+                    {"error": "The upload is already being completed."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            elif quota_exceeded(request.user, session.file_size):
+                error = Response(
+                    {"error": "Storage quota exceeded."},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                )
+            else:
+                files_added([serializer.save()])
+                bump_versions(request.user.id)
+                # The chunks go only together with the row that replaces them
+                queue_blob_deletions(parts)
+                session.delete()
+    except Exception:
+        logger.exception("Failed to complete upload %s", session.id)
+        error = Response(
+            {"error": "Failed to upload files."},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
+    if error is not None:
+        # The chunks are kept, so completing the session can be retried
+        release_claim()
+        queue_blob_deletions([public_id])
+        return error
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
 def file_delete_view(request, pk):
     try:
-        # Fetch the file instance
-        file_instance = File.objects.get(pk=pk)
+        # Fetch the file instance, files in the trash can be deleted for good
+        file_instance = File.all_objects.get(pk=pk)
 
         # Check if the user is the owner of the file
         if file_instance.user != request.user:
@@ -296,40 +913,87 @@ def file_delete_view(request, pk):
                 status=status.HTTP_403_FORBIDDEN,
             )
 
-        public_id = file_instance.public_id
+        if str(request.query_params.get("permanent", "")).lower() in ("1", "true"):
+            # Deduplicated uploads share the blob, it is queued for the
+            # process_blob_deletions worker once its last reference is gone
+            delete_files(File.all_objects.filter(pk=pk))
+        else:
+            # Move the file to the trash, purge_trash deletes it later
+            trash_files(File.objects.filter(pk=pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    except File.DoesNotExist:
+        return Response({"detail": "File not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Check if the resource exists in Cloudinary
-        resource_info = check_resource_exists(public_id)
-        if resource_info is None:
-            return Response(
-                {"detail": "File not found in Cloudinary."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
 
-        # Attempt to delete the resource from Cloudinary
-        try:
-            response = cloudinary.uploader.destroy(
-                file_instance.public_id, resource_type="raw"
-            )
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def file_batch_delete_view(request):
+    ids = request.data.get("ids")
+    if (
+        not isinstance(ids, list)
+        or not ids
+        or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids)
+    ):
+        return Response(
+            {"error": "ids must be a non-empty list of file IDs."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(ids) > BATCH_DELETE_LIMIT:
+        return Response(
+            {"error": f"At most {BATCH_DELETE_LIMIT} files can be deleted at once."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
 
-            if response.get("result") == "ok":
-                # File deleted successfully from Cloudinary
-                # Now delete the file instance from the database
-                file_instance.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            else:
-                # Handle error response from Cloudinary
-                return Response(
-                    {"detail": f"Failed to delete file from Cloudinary: {response}"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
-        except Exception as e:
-            return Response(
-                {"detail": f"Failed to delete file from Cloudinary: {str(e)}"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
-    except File.DoesNotExist:
-        return Response({"detail": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+    # Files of other users are reported as not found. Files already in the
+    # trash can still be deleted permanently.
+    if request.data.get("permanent") in (True, "true", "1"):
+        deleted = delete_files(File.all_objects.filter(user=request.user, id__in=ids))
+    else:
+        deleted = trash_files(File.objects.filter(user=request.user, id__in=ids))
+
+    return Response(
+        {
+            "deleted": sorted(deleted),
+            "not_found": sorted(set(ids) - set(deleted)),
+        },
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def trash_list_view(request):
+    paginator = KeysetPagination(ordering=("-trashed_at", "-id"))
+    files = paginator.paginate_queryset(
+        File.all_objects.filter(user=request.user, trashed_at__isnull=False).only(
+            *FileListSerializer.Meta.fields
+        ),
+        request,
+    )
+    serializer = FileListSerializer(files, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+def file_restore_view(request, pk):
+    with transaction.atomic():
+        restored = (
+            File.all_objects.filter(pk=pk, user=request.user, trashed_at__isnull=False)
+            .select_for_update()
+            .only("id", "public_id", "user", "file_size")
+            .first()
+        )
+        if restored is not None:
+            File.all_objects.filter(pk=pk).update(trashed_at=None)
+            files_added([restored])
+            bump_file_versions([restored])
+    if restored is None:
+        return Response(
+            {"detail": "File not found in the trash."},
+            status=status.HTTP_404_NOT_FOUND,
+        )
+    return Response({"message": "File restored."}, status=status.HTTP_200_OK)
 
 
 @api_view(["POST"])
@@ -359,6 +1023,8 @@ def share_file(request):
     shared_file, created = SharedFile.objects.get_or_create(
         file=file, shared_with=shared_with
     )
+    if created:
+        bump_versions(request.user.id, shared_with.id)
 
     return Response(
         {
@@ -375,8 +1041,26 @@ def share_file(request):
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@cache_per_user("shared_files")
 def list_shared_files(request):
-    shared_files = SharedFile.objects.filter(shared_with=request.user)
+    paginator = KeysetPagination(ordering=("-shared_date", "-id"))
+    shared_files = paginator.paginate_queryset(
+        # One joined query for the share, its file and the file's owner
+        SharedFile.objects.filter(
+            shared_with=request.user, file__trashed_at__isnull=True
+        )
+        .select_related("file__user")
+        .only(
+            "id",
+            "shared_date",
+            "file",
+            "file__file_name",
+            "file__file_type",
+            "file__user",
+            "file__user__username",
+        ),
+        request,
+    )
     shared_files_data = [
         {
             "id": sf.id,
@@ -389,33 +1073,77 @@ def list_shared_files(request):
         for sf in shared_files
     ]
 
-    return Response(shared_files_data, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(shared_files_data)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@cache_per_user("files_shared_by_user")
 def list_files_shared_by_user(request):
-    shared_files = SharedFile.objects.filter(file__user=request.user)
-    shared_files_data = {}
-
-    for sf in shared_files:
-        file_id = sf.file.id
-        if file_id not in shared_files_data:
-            shared_files_data[file_id] = {
-                "id": file_id,
-                "file_name": sf.file.file_name,
-                "file_type": sf.file.file_type,
-                "shared_date": sf.shared_date,
-                "shared_with": [],
-            }
-        shared_files_data[file_id]["shared_with"].append(
+    # Pages hold files, each with everyone it was shared with. They are
+    # ordered by upload date, newest first, as keyset pages need a stable
+    # indexed order; shared_date is still the date of the first share.
+    paginator = KeysetPagination(ordering=("-upload_date", "-id"))
+    shared = SharedFile.objects.filter(file__user=request.user)
+    files = File.objects.filter(
+        user=request.user, id__in=shared.values("file_id")
+    ).only("id", "file_name", "file_type", "upload_date")
+
+    if connection.vendor == "postgresql":
+        # Aggregate the recipients in the database, one query per page
+        share_order = ("shared_files__shared_date", "shared_files__id")
+        files = paginator.paginate_queryset(
+            files.annotate(
+                shared_date=Min("shared_files__shared_date"),
+                shared_user_ids=ArrayAgg(
+                    "shared_files__shared_with_id", ordering=share_order
+                ),
+                shared_usernames=ArrayAgg(
+                    "shared_files__shared_with__username", ordering=share_order
+                ),
+            ),
+            request,
+        )
+        shared_with = {
+            file.id: [
+                {"user_id": user_id, "username": username}
+                for user_id, username in zip(
+                    file.shared_user_ids, file.shared_usernames
+                )
+            ]
+            for file in files
+        }
+        shared_dates = {file.id: file.shared_date for file in files}
+    else:
+        # Portable fallback: the shares of the whole page in one joined query
+        files = paginator.paginate_queryset(files, request)
+        shares = (
+            SharedFile.objects.filter(file__in=[file.id for file in files])
+            .order_by("shared_date", "id")
+            .values_list(
+                "file_id", "shared_date", "shared_with_id", "shared_with__username"
+            )
+        )
+        shared_with = {file.id: [] for file in files}
+        shared_dates = {}
+        for file_id, shared_date, user_id, username in shares:
+            shared_with[file_id].append({"user_id": user_id, "username": username})
+            shared_dates.setdefault(file_id, shared_date)
+
+    return paginator.get_paginated_response(
+        [
             {
-                "user_id": sf.shared_with.id,
-                "username": sf.shared_with.username,
+                "id": file.id,
+                "file_name": file.file_name,
+                "file_type": file.file_type,
+                "shared_date": shared_dates[file.id],
+                "shared_with": shared_with[file.id],
             }
-        )
-
-    return Response(list(shared_files_data.values()), status=status.HTTP_200_OK)
+            for file in files
+            # Skip files unshared while the page was being built
+            if shared_with[file.id]
+        ]
+    )
 
 
 @api_view(["DELETE"])
@@ -432,6 +1160,7 @@ def delete_shared_file(request, shared_file_id):
         )
 
     shared_file.delete()
+    bump_versions(shared_file.shared_with_id, shared_file.file.user_id)
     return Response(
         {"message": "Shared file entry deleted successfully."},
         status=status.HTTP_204_NO_CONTENT,
@@ -494,6 +1223,7 @@ def remove_shared_file(request, pk):
 
         # Delete the SharedFile entry
         shared_file.delete()
+        bump_versions(shared_file.shared_with_id, request.user.id)
 
         return Response(
             {"message": "Access to the file has been removed successfully."},
@@ -31,6 +31,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "cloudinary",
     "cloudinary_storage",
     "rest_framework",
@@ -40,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its numbers cover the rest of the stack
+    "api.instrumentation.RequestMetricsMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -57,6 +60,122 @@ cloudinary.config(
     secure=True,
 )
 
+# Where encrypted files and profile pictures are stored. Set
+# BLOB_STORAGE_BACKEND to file_management.storage.LocalBlobStorage or
+# file_management.storage.InMemoryBlobStorage to run without Cloudinary.
+BLOB_STORAGE_BACKEND = os.getenv(
+    "BLOB_STORAGE_BACKEND", "file_management.storage.CloudinaryBlobStorage"
+)
+BLOB_STORAGES = {
+    "default": {"BACKEND": BLOB_STORAGE_BACKEND},
+    "profile_pictures": {
+        "BACKEND": BLOB_STORAGE_BACKEND,
+        "OPTIONS": (
+            {"resource_type": "image"}
+            if BLOB_STORAGE_BACKEND.endswith("CloudinaryBlobStorage")
+            else {}
+        ),
+    },
+}
+
+# Downloads keep the ciphertext of whole blobs in an on-disk LRU cache that
+# all worker processes on the host share. BLOB_CACHE_MAX_SIZE is in bytes,
+# 0 disables the cache.
+BLOB_CACHE_LOCATION = os.getenv("BLOB_CACHE_LOCATION", BASE_DIR / "blob_cache")
+BLOB_CACHE_MAX_SIZE = int(os.getenv("BLOB_CACHE_MAX_SIZE", 1024 * 1024 * 1024))
+if BLOB_CACHE_MAX_SIZE:
+    BLOB_STORAGES["default"] = {
+        "BACKEND": "file_management.blob_cache.CachedBlobStorage",
+        "OPTIONS": {
+            "storage": BLOB_STORAGES["default"],
+            "location": BLOB_CACHE_LOCATION,
+            "max_size": BLOB_CACHE_MAX_SIZE,
+        },
+    }
+
+# AES-GCM implementation ("pycryptodome" or "cryptography"). Batches of at
+# least CRYPTO_OFFLOAD_THRESHOLD bytes run on a process pool of
+# CRYPTO_PROCESS_POOL_WORKERS processes, 0 keeps all crypto inline.
+CRYPTO_ENGINE = os.getenv("CRYPTO_ENGINE", "cryptography")
+CRYPTO_PROCESS_POOL_WORKERS = int(os.getenv("CRYPTO_PROCESS_POOL_WORKERS", 0))
+CRYPTO_OFFLOAD_THRESHOLD = 512 * 1024
+
+# Codec ("zlib" or "lzma") applied to uploads before encryption; empty
+# disables compression. FILE_COMPRESSION_TYPES "text" compresses text
+# formats only, "all" every type that is not already compressed, at the
+# cost of Range downloads for those files (see file_management/compression.py)
+FILE_COMPRESSION = os.getenv("FILE_COMPRESSION", "zlib")
+FILE_COMPRESSION_LEVEL = int(os.getenv("FILE_COMPRESSION_LEVEL", 6))
+FILE_COMPRESSION_TYPES = os.getenv("FILE_COMPRESSION_TYPES", "text")
+
+# Uploads whose content was already stored reuse the existing blob. "user"
+# only matches a user's own files, "global" matches every user's files
+# (which reveals to a user that someone stored the same content), "off"
+# disables deduplication.
+FILE_DEDUP_SCOPE = os.getenv("FILE_DEDUP_SCOPE", "user")
+
+# Deleted files stay restorable from the trash this long before purge_trash
+# removes them
+TRASH_RETENTION_DAYS = int(os.getenv("TRASH_RETENTION_DAYS", 30))
+
+# Bytes a user may store outside the trash, 0 means no limit
+USER_STORAGE_QUOTA = int(os.getenv("USER_STORAGE_QUOTA", 0))
+
+# Seconds the admin dashboard serves a computed result before recomputing
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", 30))
+
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    },
+    # Cached API responses, see file_management/response_cache.py. File based
+    # by default, so every worker process on the host sees the same entries
+    # and invalidations. Deployments on several hosts point
+    # RESPONSE_CACHE_BACKEND and RESPONSE_CACHE_LOCATION at a cache server
+    # they all share.
+    "responses": {
+        "BACKEND": os.getenv(
+            "RESPONSE_CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        "LOCATION": os.getenv("RESPONSE_CACHE_LOCATION", BASE_DIR / "cache"),
+    },
+}
+
+# Seconds file lists, share lists and storage totals stay cached per user.
+# Changes invalidate them right away, see file_management/response_cache.py.
+# 0 disables the response cache. A per process cache would keep serving
+# other workers stale entries after a change, so it disables it by default.
+RESPONSE_CACHE_TTL = int(
+    os.getenv(
+        "RESPONSE_CACHE_TTL",
+        0 if CACHES["responses"]["BACKEND"].endswith("LocMemCache") else 300,
+    )
+)
+
+# Requests running more SQL queries than this log their statements, see
+# api/instrumentation.py. 0 disables the check.
+REQUEST_QUERY_BUDGET = int(os.getenv("REQUEST_QUERY_BUDGET", 30))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        # REQUEST_LOG_LEVEL=INFO logs one JSON line per request with its
+        # query count and timings. Requests over the query budget are
+        # logged as warnings.
+        "api.requests": {
+            "handlers": ["console"],
+            "level": os.getenv("REQUEST_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
+
 ROOT_URLCONF = "my_core_project.urls"
 
 SIMPLE_JWT = {
@@ -68,7 +187,12 @@ CORS_ALLOW_CREDENTIALS = True
 CSRF_COOKIE_SAMESITE = "Lax"
 CSRF_COOKIE_NAME = "csrftoken"
 CSRF_COOKIE_HTTPONLY = False  # Allows JavaScript to read it
-CORS_EXPOSE_HEADERS = ["Content-Disposition"]
+CORS_EXPOSE_HEADERS = [
+    "Content-Disposition",
+    "Content-Length",
+    "Content-Range",
+    "Accept-Ranges",
+]
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -121,6 +245,9 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    # List endpoints page through their rows by keyset, see api/pagination.py
+    "DEFAULT_PAGINATION_CLASS": "api.pagination.KeysetPagination",
+    "PAGE_SIZE": int(os.getenv("API_PAGE_SIZE", 50)),
 }
 
 # Password validation
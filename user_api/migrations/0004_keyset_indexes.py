@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_api', '0003_alter_userprofile_public_id_alter_userprofile_url'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['-created_at', '-id'], name='contact_created_idx'),
+        ),
+    ]
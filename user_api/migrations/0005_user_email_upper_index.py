@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+# Case-insensitive email lookups (email__iexact compiles to
+# UPPER(email::text) = UPPER(...) on PostgreSQL) use this expression index.
+# auth_user belongs to django.contrib.auth, so it is created here by hand.
+CREATE_INDEX = """
+CREATE INDEX IF NOT EXISTS auth_user_email_upper_idx
+    ON auth_user (UPPER(email::text));
+"""
+DROP_INDEX = "DROP INDEX IF EXISTS auth_user_email_upper_idx;"
+
+
+def create_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_INDEX)
+
+
+def drop_email_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("user_api", "0004_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -1,8 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
-import cloudinary
-import cloudinary.uploader
-import cloudinary.api
+from file_management.storage import get_blob_storage
+from api.instrumentation import timed
 
 
 class UserProfile(models.Model):
@@ -18,16 +17,19 @@ class UserProfile(models.Model):
     )
 
     def save_profile_picture(self, file):
+        storage = get_blob_storage("profile_pictures")
         # Check if the current profile picture is not the default
         if self.public_id and self.public_id != "pf8iioqsmo9unsmegxrv":
-            cloudinary.uploader.destroy(self.public_id)  # Delete old picture if custom
+            with timed("storage"):
+                storage.delete(self.public_id)  # Delete old picture if custom
 
-        # Upload the new file to Cloudinary
-        result = cloudinary.uploader.upload(file, folder="profile_pictures")
+        # Upload the new file to the profile picture storage
+        with timed("storage"):
+            public_id, url = storage.save(file, "profile_pictures")
 
         # Update URL and public_id with the new image information
-        self.public_id = result.get("public_id")
-        self.url = result.get("url")
+        self.public_id = public_id
+        self.url = url
         self.save()
 
 
@@ -43,5 +45,11 @@ class Contact(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of contact_list
+            models.Index(fields=["-created_at", "-id"], name="contact_created_idx"),
+        ]
+
     def __str__(self):
         return f"Message from {self.name} ({self.email})"
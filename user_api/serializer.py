@@ -96,6 +96,22 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+# For the paginated user list, expects users loaded with
+# select_related("userprofile")
+class UserListSerializer(UserSerializer):
+    profile = serializers.SerializerMethodField()
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ["profile"]
+
+    def get_profile(self, obj):
+        try:
+            profile = obj.userprofile
+        except UserProfile.DoesNotExist:
+            return {}  # In case there's no profile for the user
+        return {"public_id": profile.public_id, "url": profile.url}
+
+
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -1,3 +1,138 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import UserProfile
+
+
+class ResetPasswordRequestTests(TestCase):
+    """Emails are matched ignoring case, but an exact match always wins."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def request_reset(self, email):
+        response = self.client.post("/api/v1/reset-password-request", {"email": email})
+        self.assertEqual(response.status_code, 200)
+        return [message.to for message in mail.outbox]
+
+    def test_case_insensitive(self):
+        User.objects.create_user("alice", "Alice@example.com")
+        self.assertEqual(
+            self.request_reset("alice@example.com"), [["Alice@example.com"]]
+        )
+
+    def test_exact_match_wins(self):
+        User.objects.create_user("upper", "Bob@example.com")
+        User.objects.create_user("lower", "bob@example.com")
+        self.assertEqual(self.request_reset("bob@example.com"), [["bob@example.com"]])
+        self.assertEqual(
+            self.request_reset("Bob@example.com"),
+            [["bob@example.com"], ["Bob@example.com"]],
+        )
+
+    def test_ambiguous_or_unknown(self):
+        User.objects.create_user("upper", "Bob@example.com")
+        User.objects.create_user("lower", "bob@example.com")
+        self.assertEqual(self.request_reset("BOB@example.com"), [])
+        self.assertEqual(self.request_reset("nobody@example.com"), [])
+
+
+class UserListTests(TestCase):
+    """Every page of users costs the same queries, profiles included."""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def create_users(self, count):
+        start = User.objects.count()
+        users = [User.objects.create_user(f"user_{start + i}") for i in range(count)]
+        for user in users[::2]:
+            UserProfile.objects.create(user=user, public_id=f"profile-{user.id}")
+        return users
+
+    def test_query_count_is_constant(self):
+        self.create_users(2)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/v1/users/")
+        self.create_users(20)
+        with self.assertNumQueries(len(queries)):
+            response = self.client.get("/api/v1/users/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_profiles(self):
+        with_profile, without_profile = self.create_users(2)
+        results = self.client.get("/api/v1/users/").data["results"]
+        profiles = {user["id"]: user["profile"] for user in results}
+        self.assertEqual(
+            profiles[with_profile.id]["public_id"], f"profile-{with_profile.id}"
+        )
+        self.assertEqual(profiles[without_profile.id], {})
+
+    def test_is_active_filter(self):
+        active, inactive = self.create_users(2)
+        User.objects.filter(pk=inactive.pk).update(is_active=False)
+        response = self.client.get("/api/v1/users/", {"is_active": "false"})
+        results = response.data["results"]
+        self.assertEqual([user["id"] for user in results], [inactive.id])
+        response = self.client.get("/api/v1/users/", {"is_active": "maybe"})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminDashboardTests(TestCase):
+    """Concurrent dashboard requests share one computation per TTL."""
+
+    KEY = "admin_dashboard:month:None:None"
+    DATA = {"user_count": 42}
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user("admin", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def dashboard(self):
+        response = self.client.get("/api/v1/admin-dashboard/")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_cached_between_requests(self):
+        with mock.patch(
+            "user_api.views.dashboard_data", return_value=self.DATA
+        ) as compute:
+            self.assertEqual(self.dashboard(), self.DATA)
+            self.assertEqual(self.dashboard(), self.DATA)
+        compute.assert_called_once()
+        self.assertIsNone(cache.get(f"{self.KEY}:lock"))
+
+    def test_lock_is_released_after_a_failure(self):
+        with mock.patch("user_api.views.dashboard_data", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get("/api/v1/admin-dashboard/")
+        self.assertIsNone(cache.get(f"{self.KEY}:lock"))
+
+    def test_waits_for_the_request_holding_the_lock(self):
+        cache.add(f"{self.KEY}:lock", True)
+
+        def other_request_finishes(seconds):
+            cache.set(self.KEY, self.DATA)
+
+        with mock.patch("user_api.views.dashboard_data") as compute, mock.patch(
+            "user_api.views.time.sleep", side_effect=other_request_finishes
+        ):
+            self.assertEqual(self.dashboard(), self.DATA)
+        compute.assert_not_called()
 
-# Create your tests here.
+    def test_computes_itself_when_the_wait_times_out(self):
+        cache.add(f"{self.KEY}:lock", True)
+        with mock.patch(
+            "user_api.views.dashboard_data", return_value=self.DATA
+        ) as compute, mock.patch("user_api.views.DASHBOARD_LOCK_TIMEOUT", 0.1):
+            self.assertEqual(self.dashboard(), self.DATA)
+        compute.assert_called_once()
@@ -30,7 +30,7 @@ def register_validation(data):
   if not username or UserModel.objects.filter(username=username).exists():
     raise ValidationError("Choose another username")
   
-  if not email or UserModel.objects.filter(email=email).exists():
+  if not email or UserModel.objects.filter(email__iexact=email).exists():
         raise ValidationError('choose another email')
   
   if not password or len(password) < 8:
@@ -21,9 +21,23 @@ import jwt
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.core.mail import EmailMessage
 import logging
+import time
+from collections import Counter
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from api.pagination import KeysetPagination
+from file_management.rollups import (
+    GRANULARITIES,
+    period_start,
+    refresh_rollups,
+    rollup_params,
+    rollups_between,
+)
 
 logger = logging.getLogger(__name__)
 
+DASHBOARD_LOCK_TIMEOUT = 10  # seconds
+
 
 # Change profile picture
 @api_view(["POST"])
@@ -59,9 +73,14 @@ def change_profile_picture(request):
 def reset_password_request(request):
     email = request.data.get("email")
 
-    # Attempt to find the user by email
-    try:
-        user = User.objects.get(email=email)
+    # Matched case-insensitively, through the index from migration 0005. An
+    # exact match wins, so accounts whose emails differ only by case each
+    # keep their own reset; an ambiguous address gets no email.
+    matches = list(User.objects.filter(email__iexact=email)) if email else []
+    candidates = [match for match in matches if match.email == email] or matches
+
+    if len(candidates) == 1:
+        user = candidates[0]
 
         # Generate a JWT token
         payload = {
@@ -75,14 +94,10 @@ def reset_password_request(request):
             "Password Reset Request",
             f"Use this link to reset your password: https://filesharingpython-frontend.onrender.com/change-password/{reset_token}/",
             settings.EMAIL_HOST_USER,  # Use the configured email from settings
-            [email],  # The recipient's email
+            [user.email],  # The address the account was registered with
             fail_silently=False,
         )
 
-    except User.DoesNotExist:
-        # Do nothing, simply respond as if it succeeded
-        pass
-
     # Always return a success response
     return Response(
         {"message": "If this email is registered, a reset link has been sent."},
@@ -130,6 +145,77 @@ def get_deactivated_count(request):
     return JsonResponse({"deactivated_count": deactivated_count}, status=200)
 
 
+def dashboard_data(granularity, start, end):
+    # Both user counts come from one pass over the user table
+    users = User.objects.aggregate(
+        user_count=Count("id"),
+        deactivated_count=Count("id", filter=Q(is_active=False)),
+    )
+
+    # Upload series and file types from one grouped read of the rollups
+    refresh_rollups()
+    uploads = {}
+    file_types = Counter()
+    for entry in (
+        rollups_between(start, end)
+        .annotate(period=GRANULARITIES[granularity]("day"))
+        .values("period", "file_type")
+        .annotate(total_uploads=Sum("file_count"), total_bytes=Sum("total_bytes"))
+        .order_by("period")
+    ):
+        period = uploads.setdefault(
+            entry["period"],
+            {
+                granularity: period_start(entry["period"]),
+                "total_uploads": 0,
+                "total_bytes": 0,
+            },
+        )
+        period["total_uploads"] += entry["total_uploads"]
+        period["total_bytes"] += entry["total_bytes"]
+        file_types[entry["file_type"]] += entry["total_uploads"]
+
+    return {
+        **users,
+        "contact_count": Contact.objects.count(),
+        "file_count": sum(file_types.values()),
+        "file_types": {
+            file_type: count for file_type, count in file_types.most_common(5) if count
+        },
+        "uploads": list(uploads.values()),
+    }
+
+
+# Everything the admin dashboard shows, in one request
+@api_view(["GET"])
+@permission_classes([IsAdminUser])
+def admin_dashboard(request):
+    try:
+        granularity, start, end = rollup_params(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Admins refreshing at the same time share one computation per TTL
+    key = f"admin_dashboard:{granularity}:{start}:{end}"
+    data = cache.get(key)
+    if data is None:
+        if cache.add(f"{key}:lock", True, timeout=DASHBOARD_LOCK_TIMEOUT):
+            try:
+                data = dashboard_data(granularity, start, end)
+                cache.set(key, data, timeout=settings.DASHBOARD_CACHE_TTL)
+            finally:
+                cache.delete(f"{key}:lock")
+        else:
+            # Wait for the request that is computing it
+            deadline = time.monotonic() + DASHBOARD_LOCK_TIMEOUT
+            while data is None and time.monotonic() < deadline:
+                time.sleep(0.05)
+                data = cache.get(key)
+            if data is None:
+                data = dashboard_data(granularity, start, end)
+    return Response(data, status=status.HTTP_200_OK)
+
+
 class UserRegister(APIView):
     permission_classes = [permissions.AllowAny]
 
@@ -175,7 +261,9 @@ def check_unique(request, id=None):
     is_username_unique = (
         not User.objects.filter(username=username).exclude(id=id).exists()
     )
-    is_email_unique = not User.objects.filter(email=email).exclude(id=id).exists()
+    is_email_unique = (
+        not User.objects.filter(email__iexact=email).exclude(id=id).exists()
+    )
 
     return Response(
         {
@@ -261,35 +349,24 @@ class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.AllowAny]
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    keyset_ordering = ("id",)
 
     def list(self, request):
-        """Retrieve all users, sorted by ID (ascending), with their user profile data."""
-        users = self.get_queryset().order_by("id")  # Sort users by ID
+        """Retrieve a page of users, sorted by ID (ascending), with their user profile data."""
+        # Profiles come from the same query, one row per user
+        users = self.get_queryset().select_related("userprofile")
 
-        # Manually add UserProfile data to each user
-        users_data = []
-        for user in users:
-            # Retrieve the related UserProfile object for each user
-            try:
-                user_profile = (
-                    user.userprofile
-                )  # This assumes the reverse relationship is named 'userprofile'
-                # Add the user profile data as a dictionary or object
-                profile_data = {
-                    "public_id": user_profile.public_id,
-                    "url": user_profile.url,
-                }
-            except UserProfile.DoesNotExist:
-                profile_data = {}  # In case there's no profile for the user
-
-            # Serialize the user data along with the profile data
-            user_data = UserSerializer(user).data
-            user_data["profile"] = (
-                profile_data  # Add profile data to the user dictionary
-            )
-            users_data.append(user_data)
+        is_active = request.query_params.get("is_active")
+        if is_active is not None:
+            if is_active.lower() not in ("true", "false"):
+                return Response(
+                    {"error": "is_active must be true or false."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            users = users.filter(is_active=is_active.lower() == "true")
 
-        return Response(users_data, status=status.HTTP_200_OK)
+        users = self.paginate_queryset(users)
+        return self.get_paginated_response(UserListSerializer(users, many=True).data)
 
     def create(self, request):
         """Create a new user."""
@@ -374,9 +451,10 @@ def create_contact(request):
 @api_view(["GET"])
 @permission_classes([IsAdminUser])
 def contact_list(request):
-    contacts = Contact.objects.all()
+    paginator = KeysetPagination(ordering=("-created_at", "-id"))
+    contacts = paginator.paginate_queryset(Contact.objects.all(), request)
     serializer = ContactSerializer(contacts, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(["PUT"])